@@ -0,0 +1,201 @@
+# -*- coding:utf-8 -*-
+"""
+bench_ucan.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN python layer benchmarks (against in-process simulated dll, runs on any platform)
+
+usage: python benchmarks/bench_ucan.py [--calls N] [--batch N] [--latency s] [--json out.json] [--compare base.json]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ucanSystec import ucanSystec, ucanSimDll, tCanMsgStruct     # noqa: E402
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """ :return: dict of percentiles (plus max) of samples """
+    samples = sorted(samples)
+    res = dict(("p{}".format(pt), samples[min(int(len(samples) * pt / 100.0), len(samples) - 1)]) for pt in points)
+    res["max"] = samples[-1]
+    return res
+
+
+def run_case(name, fct, calls, frames_per_call):
+    """ Run a benchmark case
+    :param name: case name
+    :param fct: function to benchmark (one dll call)
+    :param calls: number of calls
+    :param frames_per_call: frames handled by each call (0 for non frame calls)
+    :return: case results dict """
+    for _ in range(min(calls, 100)):    # warm up
+        fct()
+
+    clock = time.perf_counter
+    lat = [0.0] * calls
+    start = clock()
+    for idx in range(calls):
+        t0 = clock()
+        fct()
+        lat[idx] = clock() - t0
+    elapsed = clock() - start
+
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    for _ in range(calls):
+        fct()
+    blocks = sys.getallocatedblocks() - blocks
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "name": name,
+        "calls": calls,
+        "calls_per_s": calls / elapsed,
+        "frames_per_s": calls * frames_per_call / elapsed,
+        "latency_us": dict((key, val * 1e6) for key, val in percentiles(lat).items()),
+        "alloc": {"net_blocks_per_call": float(blocks) / calls, "peak_bytes": peak},
+    }
+
+
+def run_duplex(name, calls, batch, latency, global_lock=False):
+    """ Run concurrent reception and transmission threads on the same instance
+    :param name: case name
+    :param calls: number of calls per thread
+    :param batch: frames per batched call
+    :param latency: simulated dll call latency in s (spent sleeping, GIL released as for real dll calls)
+    :param global_lock: serialize every call with one lock (single lock concurrency model reference)
+    :return: case results dict """
+    dll = ucanSimDll(latency=latency, rx_rate=1e9, tx_rate=1e9, blocking=True)
+    bus = ucanSystec(dll=dll, rx_batch=batch)
+    frames = (tCanMsgStruct * batch)(*([tCanMsgStruct(0x123, 0, 8)] * batch))
+    lock = threading.Lock() if global_lock else None
+    clock = time.perf_counter
+    lat = {"rx": [0.0] * calls, "tx": [0.0] * calls}
+
+    def loop(key, fct):
+        samples = lat[key]
+        for idx in range(calls):
+            t0 = clock()
+            if lock:
+                with lock:
+                    fct()
+            else:
+                fct()
+            samples[idx] = clock() - t0
+
+    threads = [threading.Thread(target=loop, args=("rx", lambda: bus.can_read_msgs(nb_msg=batch))),
+               threading.Thread(target=loop, args=("tx", lambda: bus.send_many(frames)))]
+    start = clock()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = clock() - start
+    bus.can_close()
+    return {
+        "name": name,
+        "calls": 2 * calls,
+        "calls_per_s": 2 * calls / elapsed,
+        "frames_per_s": 2 * calls * batch / elapsed,
+        "latency_us": dict((key, val * 1e6) for key, val in percentiles(lat["rx"] + lat["tx"]).items()),
+    }
+
+
+def run(calls=20000, batch=64, latency=0.0):
+    """ Run all benchmark cases
+    :param calls: number of calls per case
+    :param batch: frames per batched call
+    :param latency: simulated dll call latency in s
+    :return: results dict """
+    dll = ucanSimDll(latency=latency, rx_rate=1e9, tx_rate=1e9)
+    bus = ucanSystec(dll=dll, rx_batch=batch)
+    msg = tCanMsgStruct(0x123, 0, 8, 1, 2, 3, 4, 5, 6, 7, 8, 0)
+    frames = (tCanMsgStruct * batch)(*([msg] * batch))
+
+    results = [
+        run_case("can_send_msg", lambda: bus.can_send_msg(msg), calls, 1),
+        run_case("send_many", lambda: bus.send_many(frames), calls, batch),
+        run_case("can_get_msg", lambda: bus.can_get_msg(), calls, 1),
+        run_case("can_read_msgs", lambda: bus.can_read_msgs(nb_msg=batch), calls, batch),
+        run_case("can_get_status", lambda: bus.can_get_status(), calls, 0),
+    ]
+    bus.can_close()
+    duplex_calls = max(calls // 10, 1)
+    duplex_latency = latency or 0.0001
+    results.append(run_duplex("duplex", duplex_calls, batch, duplex_latency))
+    results.append(run_duplex("duplex_global_lock", duplex_calls, batch, duplex_latency, global_lock=True))
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "calls": calls,
+            "batch": batch,
+            "dll_latency_s": latency,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """ Compare results to a baseline
+    :param results: results dict
+    :param baseline: baseline results dict
+    :param threshold: allowed relative slowdown (0.1 for 10%)
+    :return: list of regressions messages """
+    regressions = []
+    base = dict((case["name"], case) for case in baseline["results"])
+    for case in results["results"]:
+        ref = base.get(case["name"])
+        if ref and case["calls_per_s"] < ref["calls_per_s"] * (1 - threshold):
+            regressions.append("{}: {:.0f} calls/s vs {:.0f} calls/s".format(
+                case["name"], case["calls_per_s"], ref["calls_per_s"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ucanSystec python layer benchmarks (simulated dll)")
+    parser.add_argument("--calls", type=int, default=20000, help="calls per case")
+    parser.add_argument("--batch", type=int, default=64, help="frames per batched call")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated dll call latency in s")
+    parser.add_argument("--json", help="write results to json file")
+    parser.add_argument("--compare", help="baseline json file to compare with (exit code 1 on regression)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown vs baseline")
+    args = parser.parse_args()
+
+    results = run(args.calls, args.batch, args.latency)
+
+    print("{:<16} {:>12} {:>12} {:>9} {:>9} {:>9} {:>12}".format(
+        "case", "calls/s", "frames/s", "p50 us", "p90 us", "p99 us", "blocks/call"))
+    for case in results["results"]:
+        print("{:<16} {:>12.0f} {:>12.0f} {:>9.2f} {:>9.2f} {:>9.2f} {:>12.3f}".format(
+            case["name"], case["calls_per_s"], case["frames_per_s"], case["latency_us"]["p50"],
+            case["latency_us"]["p90"], case["latency_us"]["p99"],
+            case.get("alloc", {}).get("net_blocks_per_call", float("nan"))))
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+    if args.compare:
+        with open(args.compare) as base:
+            regressions = compare(results, json.load(base), args.threshold)
+        for msg in regressions:
+            print("REGRESSION {}".format(msg))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
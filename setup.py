@@ -25,6 +25,9 @@ setup(
     description='Systec usb/can dll bindings',
     keywords=['Communication', 'CAN', 'Systec', 'DLL'],
     long_description=open('README.md').read(),
+    extras_require={
+        'numpy': ['numpy'],     # structured arrays support (ucanNumpy)
+    },
     classifiers=[
             'License :: OSI Approved :: MIT License',
 
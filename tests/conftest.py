@@ -0,0 +1,33 @@
+# -*- coding:utf-8 -*-
+"""
+conftest.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN tests fixtures (simulated Usbcan dll, runs on any platform)
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ucanSystec import ucanSystec, ucanSimDll, clear_hw_cache     # noqa: E402
+
+
+@pytest.fixture
+def dll():
+    """ simulated dll without generated traffic (frames only received when injected) """
+    return ucanSimDll()
+
+
+@pytest.fixture
+def bus(dll):
+    """ module opened on simulated dll (channel 0 initialized), closed at test end """
+    clear_hw_cache()
+    can_bus = ucanSystec(dll=dll)
+    assert can_bus.is_initialised()
+    yield can_bus
+    can_bus.can_close()
+    clear_hw_cache()
@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanAsync.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN asyncio front-end tests
+"""
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from ucanSystec import tCanMsgStruct, retSystec
+from ucanSystec.ucanAsync import AsyncUcanSystec
+
+
+def run(coro):
+    """ run coroutine on a new loop """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_send_many_backpressure(bus, dll):
+    bus.can_set_buffers(tx_entries=100)
+
+    async def scenario():
+        front = AsyncUcanSystec(bus, max_tx_pending=1000)
+        try:
+            return await asyncio.wait_for(front.send_many([tCanMsgStruct(0x123, 0, 8)] * 600), 5)
+        finally:
+            front.close()
+    assert run(scenario()) == 600
+    assert dll.modules[0].channels[0].sent == 600
+
+
+def test_send_many_error_raised(bus, dll):
+    async def scenario():
+        front = AsyncUcanSystec(bus)
+        try:
+            dll.unplug()
+            return await asyncio.wait_for(front.send(tCanMsgStruct(0x123, 0, 8)), 5)
+        finally:
+            front.close()
+    with pytest.raises(OSError) as err:
+        run(scenario())
+    assert err.value.errno == retSystec["USBCAN_ERR_ILLHANDLE"]
+
+
+def test_running_loop_required(bus):
+    with pytest.raises(RuntimeError):
+        AsyncUcanSystec(bus)    # no running loop
+
+
+def test_io_thread_never_sleeps_on_full_tx_buffer(bus, dll, monkeypatch):
+    sleeps = []
+    sleep = time.sleep
+
+    def recording_sleep(delay):
+        sleeps.append(threading.current_thread().name)
+        sleep(delay)
+    monkeypatch.setattr(time, "sleep", recording_sleep)
+    bus.can_set_buffers(tx_entries=100)
+
+    async def scenario():
+        front = AsyncUcanSystec(bus, max_tx_pending=1000)
+        try:
+            return await asyncio.wait_for(front.send_many([tCanMsgStruct(0x123, 0, 8)] * 600), 5)
+        finally:
+            front.close()
+    assert run(scenario()) == 600
+    assert "AsyncUcanSystec" not in sleeps     # backpressure handled by the I/O loop wait (reception not stalled)
+
+
+def test_frames_received(bus, dll):
+    async def scenario():
+        front = AsyncUcanSystec(bus)
+        try:
+            batches = front.batches(0)
+            first = asyncio.ensure_future(batches.__anext__())
+            await asyncio.sleep(0.01)   # iterator subscribed
+            dll.inject([tCanMsgStruct(0x10 + idx, 0, 1) for idx in range(3)])
+            return await asyncio.wait_for(first, 5)
+        finally:
+            front.close()
+    assert [msg.dw_id for msg in run(scenario())] == [0x10, 0x11, 0x12]
@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanCapture.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN capture recording and reading tests
+"""
+
+import os
+import struct
+import itertools
+
+from ucanSystec import (ucanReader, ucanRecorder, ucanCaptureReader, capture_header, export_asc, tCanMsgStruct,
+                        clock_ns)
+from ucanSystec import ucanCapture
+
+
+def record(bus, dll, path, batches):
+    """ record injected batches (list of tCanMsgStruct lists), each batch read separately """
+    reader = ucanReader(bus)
+    recorder = ucanRecorder(bus, path, reader=reader, flush_period=0.01).start()
+    for batch in batches:
+        dll.inject(batch)
+        reader.drain()
+    recorder.stop(2)
+    return recorder
+
+
+def test_records_monotonic_on_wall_clock_step(bus, dll, tmpdir, monkeypatch):
+    steps = itertools.count(10 ** 18, -10 ** 12)     # wall clock stepping back by 1000s at each read
+    monkeypatch.setattr(ucanCapture, "_time_ns", lambda: next(steps))
+    path = str(tmpdir.join("cap.bin"))
+    before = clock_ns()
+    recorder = record(bus, dll, path, [[tCanMsgStruct(idx, 0, 0)] for idx in range(5)])
+    assert recorder.recorded == 5
+    start_ns, host_ns = capture_header(path)
+    assert start_ns == 10 ** 18                     # single wall clock reference
+    with ucanCaptureReader(path) as reader:
+        stamps = [reader.record(idx).ns for idx in range(len(reader))]
+        assert stamps == sorted(stamps) and before <= host_ns <= stamps[0]
+        assert reader.to_epoch(stamps[0]) == start_ns + stamps[0] - host_ns
+        assert reader.from_epoch(reader.to_epoch(stamps[-1])) == stamps[-1]
+        assert reader.find(stamps[2]) == 2
+        del stamps
+    asc = str(tmpdir.join("cap.asc"))
+    assert export_asc(path, asc) == 5
+
+
+def test_rotated_files_share_wall_clock_reference(bus, dll, tmpdir):
+    path = str(tmpdir.join("cap.bin"))
+    reader = ucanReader(bus)
+    recorder = ucanRecorder(bus, path, reader=reader, max_bytes=ucanCapture._HEADER.size + 4 * ucanCapture._REC_SIZE,
+                            flush_period=0.01).start()
+    for idx in range(8):
+        dll.inject([tCanMsgStruct(idx, 0, 0)])
+        reader.drain()
+    recorder.stop(2)
+    assert len(recorder.files) == 2
+    (start0, host0), (start1, host1) = capture_header(recorder.files[0]), capture_header(recorder.files[1])
+    assert start1 - host1 == start0 - host0
+    with ucanCaptureReader(recorder.files[1]) as second:
+        assert second.record(0).ns == host1
+
+
+def test_standard_and_extended_ids_indexed_apart(bus, dll, tmpdir):
+    path = str(tmpdir.join("cap.bin"))
+    record(bus, dll, path, [[tCanMsgStruct(0x123, 0, 0), tCanMsgStruct(0x123, 0x80, 0), tCanMsgStruct(0x123, 0, 0)]])
+    with ucanCaptureReader(path) as reader:
+        assert list(reader.select(0x123)) == [0, 2]
+        assert list(reader.select(0x123, extended=True)) == [1]
+        assert [rec.msg.b_ff for rec in reader.frames(0x123, extended=True)] == [0x80]
+    with ucanCaptureReader(path) as reader:      # persisted index keeps them apart
+        assert list(reader.select(0x123, extended=True)) == [1]
+
+
+def test_index_rebuilt_when_capture_changes(bus, dll, tmpdir):
+    path = str(tmpdir.join("cap.bin"))
+    record(bus, dll, path, [[tCanMsgStruct(0x10, 0, 0), tCanMsgStruct(0x20, 0, 0)]])
+    ucanCaptureReader(path).close()
+    with open(path, "r+b") as f:    # same size and record count, other identifier in last record
+        f.seek(ucanCapture._HEADER.size + ucanCapture._REC_SIZE + ucanCapture._ID_OFFSET)
+        f.write(struct.pack("=B", 0x30))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))     # same mtime too: caught by checksum
+    with ucanCaptureReader(path) as reader:
+        assert list(reader.select(0x30)) == [1] and not len(reader.select(0x20))
+
+
+def test_batches_queued_out_of_order_stay_monotonic(bus, tmpdir, monkeypatch):
+    stamps = iter([3000, 1000, 2000])   # concurrent readers: stamp taken before the batch is queued
+    monkeypatch.setattr(ucanCapture, "clock_ns", lambda: next(stamps))
+    path = str(tmpdir.join("cap.bin"))
+    recorder = ucanRecorder(bus, path, reader=ucanReader(bus), flush_period=0.01).start()
+    for idx in range(2):
+        recorder.record((tCanMsgStruct * 1)(tCanMsgStruct(idx, 0, 0)), chan=0)
+    recorder.stop(2)
+    with ucanCaptureReader(path) as reader:
+        assert [reader.record(idx).ns for idx in range(2)] == [1000, 2000]
+        assert reader.find(1500) == 1
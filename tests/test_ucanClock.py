@@ -0,0 +1,38 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanClock.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN device clock model tests
+"""
+
+from ucanSystec import ucanClockModel, tCanMsgStruct
+
+
+def test_unwrap_across_counter_wrap():
+    model = ucanClockModel()
+    assert model.update(0xFFFFFFF0, 0) == 0xFFFFFFF0
+    assert model.update(0x10, 32000000) == 0x100000010
+    assert model.unwrap(0xFFFFFFFF) == 0xFFFFFFFF    # late frame from before wrap
+    assert model.update(0x20, 48000000) == 0x100000020
+    model.reset()
+    assert model.unwrap(0x10) == 0x10 and not model.ready
+
+
+def test_fit_follows_drift_on_lower_envelope():
+    model = ucanClockModel(bucket=1000, buckets=10)
+    for idx in range(1000):     # 100 ppm fast host clock, read latency up to 1.8ms
+        ms = 1000 + idx * 10
+        model.update(ms, 5000000000 + ms * 1000100 + (idx % 7) * 300000)
+    assert model.ready and model.samples == 1000
+    assert abs(model.rate - 1000100) < 0.01
+    assert abs(model.to_host(20000) - (5000000000 + 20000 * 1000100)) < 1000
+
+
+def test_stamp_at_tick_middle():
+    model = ucanClockModel()
+    frames = [tCanMsgStruct(0x10, 0, 0, dw_time=100)]
+    assert list(model.stamp(frames)[1]) == [0]      # not ready: no host time
+    model.update(0, 1000000000)
+    device, host = model.stamp(frames)
+    assert list(device) == [100] and list(host) == [1000000000 + 100500000]
@@ -0,0 +1,65 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanDbc.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN DBC decoding/encoding tests
+"""
+
+import logging
+
+import pytest
+
+from ucanSystec import ucanDbc, tCanMsgStruct, USBCAN_MSG_FF_EXT, USBCAN_MSG_FF_STD
+
+DBC = """
+BO_ 256 Std: 8 ECU
+ SG_ Speed : 0|16@1+ (0.1,0) [0|6553.5] "km/h" Vector__XXX
+ SG_ Temp : 16|8@1- (1,-40) [-40|215] "degC" Vector__XXX
+
+BO_ 2147483904 Ext: 8 ECU
+ SG_ Mode M : 0|8@1+ (1,0) [0|255] "" Vector__XXX
+ SG_ Low m0 : 8|8@1+ (1,0) [0|255] "" Vector__XXX
+ SG_ High m1 : 8|16@0+ (1,0) [0|65535] "" Vector__XXX
+
+VAL_ 2147483904 Mode 0 "low" 1 "high" ;
+"""
+
+
+def test_standard_and_extended_identifiers_kept_apart():
+    dbc = ucanDbc(text=DBC)
+    assert dbc.message(0x100).name == "Std" and dbc.message(0x100, extended=True).name == "Ext"
+    assert dbc.message("Ext").signals[0].choices == {0: "low", 1: "high"}
+    std = dbc.encode("Std", {"Speed": 12.5, "Temp": -10})
+    ext = dbc.encode(0x100, {"Mode": 1, "High": 0x1234}, extended=True)
+    assert (std.b_ff, ext.b_ff) == (USBCAN_MSG_FF_STD, USBCAN_MSG_FF_EXT) and std.dw_id == ext.dw_id == 0x100
+    assert dbc.decode(std) == {"Speed": 12.5, "Temp": -10}
+    assert dbc.decode(ext) == {"Mode": 1, "High": 0x1234}
+
+
+def test_decode_frames_checks_frame_format():
+    dbc = ucanDbc(text=DBC).subscribe("Ext")
+    frames = (tCanMsgStruct * 2)(tCanMsgStruct(0x100, USBCAN_MSG_FF_STD, 8, 0, 7),
+                                 tCanMsgStruct(0x100, USBCAN_MSG_FF_EXT, 8, 0, 7))
+    assert dbc.decode(frames[0]) is None
+    assert dbc.decode_frames(frames) == [(1, 0x100, {"Mode": 0, "Low": 7})]
+
+
+def test_extended_multiplexing_logged(caplog):
+    text = DBC.replace(" SG_ High m1 :", " SG_ High m1M :")
+    with caplog.at_level(logging.WARNING, logger="ucanSystec.ucanDbc"):
+        dbc = ucanDbc(text=text)
+    assert [sig.name for sig in dbc.message("Ext").signals] == ["Mode", "Low"]
+    assert "High" in caplog.text
+
+
+def test_decode_array_per_identifier_key():
+    pytest.importorskip("numpy")    # optional dependency
+    from ucanSystec.ucanNumpy import frames_view
+    dbc = ucanDbc(text=DBC)
+    frames = (tCanMsgStruct * 3)(dbc.encode("Std", {"Speed": 1.0}), dbc.encode("Ext", {"Mode": 0, "Low": 3}),
+                                 dbc.encode("Ext", {"Mode": 1, "High": 9}))
+    columns = dbc.decode_array(frames_view(frames))
+    assert sorted(columns) == [0x100, 0x80000100]
+    assert columns[0x100]["Speed"].tolist() == [1.0]
+    assert columns[0x80000100]["Mode"].tolist() == [0, 1] and columns[0x80000100]["Low"][0] == 3
@@ -0,0 +1,64 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanDemux.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN multi-channel demultiplexing reader tests
+"""
+
+import logging
+
+from ucanSystec import ucanDemuxReader, tCanMsgStruct
+
+
+def test_demux_per_channel(bus, dll):
+    bus.can_init_can(1)
+    reader = ucanDemuxReader(bus)
+    seen = []
+    reader.subscribe_chan(1, lambda frames: seen.extend(msg.dw_id for msg in frames))
+    queue0 = reader.queue(0)
+    dll.inject([tCanMsgStruct(0x10, 0, 0)] * 2, chan=0)
+    dll.inject([tCanMsgStruct(0x20, 0, 0)] * 3, chan=1)
+    assert reader.drain() == 5
+    assert [msg.dw_id for msg in queue0.get_nowait()] == [0x10, 0x10]
+    assert seen == [0x20] * 3
+    assert reader.unclaimed == {}
+
+
+def test_demux_queue_overflow(bus, dll):
+    reader = ucanDemuxReader(bus, nb_msg=1, queue_size=2)
+    queue0 = reader.queue(0)
+    dll.inject([tCanMsgStruct(idx, 0, 0) for idx in range(5)])
+    reader.drain()
+    assert reader.dropped[0] == 3
+    assert [queue0.get_nowait()[0].dw_id for _ in range(2)] == [3, 4]
+
+
+def test_demux_unclaimed_counted(bus, dll, caplog):
+    bus.can_init_can(1)
+    reader = ucanDemuxReader(bus)
+    reader.queue(0)
+    with caplog.at_level(logging.WARNING, logger="ucanSystec.ucanDemux"):
+        dll.inject([tCanMsgStruct(0x20, 0, 0)] * 3, chan=1)
+        reader.drain()
+        dll.inject([tCanMsgStruct(0x20, 0, 0)] * 2, chan=1)
+        reader.drain()
+    assert reader.unclaimed == {1: 5}
+    assert len([rec for rec in caplog.records if "Channel 1" in rec.getMessage()]) == 1     # logged once
+
+
+def test_demux_failing_consumer(bus, dll, caplog):
+    reader = ucanDemuxReader(bus)
+    seen = []
+
+    def failing(frames):
+        raise ValueError(len(frames))
+    reader.subscribe_chan(0, failing)
+    reader.subscribe_chan(0, lambda frames: seen.extend(msg.dw_id for msg in frames))
+    queue0 = reader.queue(0)
+    with caplog.at_level(logging.ERROR, logger="ucanSystec.ucanDemux"):
+        dll.inject([tCanMsgStruct(0x10, 0, 0)] * 2)
+        assert reader.drain() == 2
+    assert seen == [0x10, 0x10]
+    assert len(queue0.get_nowait()) == 2    # batch still queued
+    assert any("failed" in rec.getMessage() for rec in caplog.records)
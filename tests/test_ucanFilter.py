@@ -0,0 +1,71 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanFilter.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN acceptance filter compiler tests
+"""
+
+from ucanSystec import ucanFilter, tCanMsgStruct, USBCAN_AMR_ALL, USBCAN_ACR_ALL, USBCAN_MSG_FF_EXT
+
+
+def test_receive_all_without_ids():
+    flt = ucanFilter()
+    assert (flt.amr, flt.acr) == (USBCAN_AMR_ALL, USBCAN_ACR_ALL)
+    assert flt.fp_ratio() == 0.0 and flt.match(0x123) and flt.match(0x1ABCDEF, True)
+
+
+def test_single_std_id_exact():
+    flt = ucanFilter(ids=[0x123])
+    assert flt.acr == 0x123 << 21
+    assert flt.amr == 0x001FFFFF     # id bits cared, RTR and data bits don't care
+    assert flt.hw_std_accepted == 1 and flt.fp_ratio_std() == 0.0
+    assert flt.hw_match(0x123) and not flt.hw_match(0x124)
+
+
+def test_std_ids_cover_tightest():
+    flt = ucanFilter(ids=[0x100, 0x101, 0x103])
+    assert flt.hw_std_accepted == 4     # 0x100..0x103: one bit pattern
+    assert flt.fp_ratio_std() == 0.25
+    assert [can_id for can_id in range(0x7FF + 1) if flt.hw_match(can_id)] == [0x100, 0x101, 0x102, 0x103]
+    assert [can_id for can_id in range(0x7FF + 1) if flt.match(can_id)] == [0x100, 0x101, 0x103]
+
+
+def test_every_wanted_id_passes_hardware():
+    flt = ucanFilter(ids=[0x10, 0x7F0], ranges=[(0x200, 0x2FF)], ext_ids=[0x1ABCDEF], ext_ranges=[(0x1000, 0x10FF)])
+    for can_id in [0x10, 0x7F0] + list(range(0x200, 0x300)):
+        assert flt.hw_match(can_id) and flt.match(can_id)
+    for can_id in [0x1ABCDEF] + list(range(0x1000, 0x1100)):
+        assert flt.hw_match(can_id, True) and flt.match(can_id, True)
+    assert flt.wanted == (2 + 0x100, 1 + 0x100)
+
+
+def test_ext_ranges_match():
+    flt = ucanFilter(ext_ranges=[(0x1000, 0x100F), (0x2000, 0x2000)])
+    assert flt.match(0x100F, True) and flt.match(0x2000, True)
+    assert not flt.match(0x1010, True) and not flt.match(0x1FFF, True)
+    assert not flt.match(0x100, False)  # no standard identifier wanted
+
+
+def test_filter_drops_false_positives():
+    flt = ucanFilter(ids=[0x100, 0x103], ext_ids=[0x100])
+    frames = [tCanMsgStruct(0x100, 0, 0), tCanMsgStruct(0x101, 0, 0), tCanMsgStruct(0x103, 0, 0),
+              tCanMsgStruct(0x100, USBCAN_MSG_FF_EXT, 0), tCanMsgStruct(0x101, USBCAN_MSG_FF_EXT, 0)]
+    assert [(msg.dw_id, msg.b_ff) for msg in flt.filter(frames)] == [(0x100, 0), (0x103, 0), (0x100, 0x80)]
+    kept = []
+    flt.wrap(kept.append)(frames[1:2])  # nothing wanted: consumer not called
+    assert kept == []
+
+
+def test_estimate():
+    flt = ucanFilter(ids=[0x100, 0x103])
+    est = flt.estimate({(0x100, False): 50, (0x101, False): 25, (0x400, False): 25})
+    assert est == {"hw_pass": 0.75, "sw_pass": 0.5}
+
+
+def test_apply_sets_channel_registers(bus, dll):
+    flt = ucanFilter(ids=[0x123])
+    flt.apply(bus)
+    params = dll.modules[0].channels[0].params
+    assert (params.m_dwAMR, params.m_dwACR) == (flt.amr, flt.acr)
+    assert not bus.failures()
@@ -0,0 +1,107 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanHotplug.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN hot-plug connection manager tests
+"""
+
+import time
+
+import pytest
+
+from ucanSystec import (ucanSystec, ucanSimDll, ucanConnectionManager, tCanMsgStruct, eventSystec, cyclicSystec,
+                        clear_hw_cache)
+
+
+@pytest.fixture(autouse=True)
+def hw_cache():
+    """ discovery cache cleared around each test """
+    clear_hw_cache()
+    yield
+    clear_hw_cache()
+
+
+class InitRecordingDll(ucanSimDll):
+    """ simulated dll recording (channel, baud registers) of each channel init """
+    def __init__(self, **kwargs):
+        ucanSimDll.__init__(self, **kwargs)
+        self.inits = []
+
+    def UcanInitCanEx2(self, handle, chan, p_params):
+        params = p_params._obj
+        self.inits.append((chan, (params.m_bBTR0, params.m_bBTR1, params.m_dwBaudrate)))
+        return ucanSimDll.UcanInitCanEx2(self, handle, chan, p_params)
+
+
+def baud(params):
+    """ :return: baud registers of channel params """
+    return params.m_bBTR0, params.m_bBTR1, params.m_dwBaudrate
+
+
+def configured_bus(dll):
+    """ :return: bus with non default speed on channel 0, channel 1 initialized and a running cyclic list """
+    bus = ucanSystec(dll=dll)
+    bus.can_set_speed(500000)
+    bus.can_set_buffers(rx_entries=1024, tx_entries=256, chan=1)
+    bus.can_define_cyclic([(tCanMsgStruct(0x10, 0, 0), 100)])
+    bus.can_start_cyclic()
+    return bus
+
+
+def test_teardown_and_restore():
+    dll = InitRecordingDll()
+    manager = ucanConnectionManager(dll)
+    bus = manager.manage(configured_bus(dll))
+    saved = [baud(params) for params in bus.chan_params]
+    events = []
+    manager.subscribe(events.append)
+    handle = bus._handle.value
+    dll.unplug()
+    manager.handle(eventSystec["USBCAN_EVENT_FATALDISCON"], handle)
+    assert not bus.is_initialised() and not manager.connected(bus)
+    del dll.inits[:]
+    dll.plug()
+    manager.handle(eventSystec["USBCAN_EVENT_CONNECT"])
+    assert bus.is_initialised() and manager.connected(bus)
+    assert dll.inits == [(0, saved[0]), (1, saved[1])]     # each channel initialized once, never at a stale speed
+    chan1 = dll.modules[0].channels[1].params
+    assert (chan1.m_wNrOfRxBufferEntries, chan1.m_wNrOfTxBufferEntries) == (1024, 256)
+    chan0 = dll.modules[0].channels[0]
+    assert [msg.dw_id for msg in chan0.cyclic] == [0x10]
+    assert chan0.cyclic_flags & cyclicSystec["USBCAN_CYCLIC_FLAG_START"]
+    assert [(event.connected, event.serial) for event in events] == [(False, 0x1000), (True, 0x1000)]
+    bus.can_close()
+
+
+def test_disconnect_without_fatal_event():
+    dll = ucanSimDll()
+    manager = ucanConnectionManager(dll)
+    bus = manager.manage(ucanSystec(dll=dll))
+    dll.modules[0].present = False     # loss not notified with module handle
+    manager.handle(eventSystec["USBCAN_EVENT_DISCONNECT"])
+    assert not manager.connected(bus)
+    dll.modules[0].present = True
+    manager.handle(eventSystec["USBCAN_EVENT_CONNECT"])
+    assert manager.connected(bus) and bus.chan_init == {0}
+    bus.can_close()
+
+
+def test_worker_thread_handles_dll_events():
+    dll = ucanSimDll()
+    manager = ucanConnectionManager(dll).start()
+    bus = manager.manage(ucanSystec(dll=dll))
+    try:
+        dll.unplug()
+        deadline = time.time() + 2
+        while manager.connected(bus) and time.time() < deadline:
+            time.sleep(0.005)
+        assert not manager.connected(bus)
+        dll.plug()
+        while not manager.connected(bus) and time.time() < deadline:
+            time.sleep(0.005)
+        assert manager.connected(bus) and bus.is_initialised()
+    finally:
+        manager.stop(2)
+        bus.can_close()
+    assert dll._connect_cb is None
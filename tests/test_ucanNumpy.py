@@ -0,0 +1,39 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanNumpy.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN NumPy structured arrays tests
+"""
+
+import pytest
+
+from ucanSystec import tCanMsgStruct
+from ucanSystec.ucanNumpy import can_msg_dtype, frames_array, frames_view, payload_view, read_array
+
+pytest.importorskip("numpy")    # optional dependency
+
+
+def test_dtype_matches_struct():
+    assert can_msg_dtype.itemsize == 26
+    assert can_msg_dtype.names[0] == "dw_id" and can_msg_dtype.names[-1] == "dw_time"
+    assert can_msg_dtype.fields["dw_time"][1] == tCanMsgStruct.dw_time.offset
+
+
+def test_frames_view_zero_copy():
+    frames = (tCanMsgStruct * 2)(tCanMsgStruct(0x10, 0, 2, 1, 2), tCanMsgStruct(0x20, 0x80, 1, 9))
+    view = frames_view(frames)
+    assert list(view["dw_id"]) == [0x10, 0x20] and list(view["b_ff"]) == [0, 0x80]
+    assert payload_view(view)[0, :2].tolist() == [1, 2]
+    view["dw_id"][1] = 0x30
+    assert frames[1].dw_id == 0x30     # view shares ctypes memory
+
+
+def test_read_array_fills_in_place(bus, dll):
+    dll.inject([tCanMsgStruct(0x100 + idx, 0, 1, idx) for idx in range(5)])
+    array = frames_array(8)
+    assert read_array(bus, array, offset=2) == 5
+    assert array["dw_id"][:2].tolist() == [0, 0]
+    assert array["dw_id"][2:7].tolist() == [0x100 + idx for idx in range(5)]
+    assert payload_view(array)[2:7, 0].tolist() == list(range(5))
+    assert read_array(bus, array, offset=8) == 0    # array full
@@ -0,0 +1,65 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanPool.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN multi-device pool tests
+"""
+
+import importlib
+
+import pytest
+
+from ucanSystec import ucanPool, ucanSimDll, enumerate_devices, tCanMsgStruct, retSystec, clear_hw_cache
+
+
+@pytest.fixture
+def pool():
+    clear_hw_cache()
+    pool = ucanPool(dll=ucanSimDll(modules=3))
+    yield pool
+    pool.close()
+    clear_hw_cache()
+
+
+def test_enumerate_devices():
+    dll = ucanSimDll(modules=2)
+    assert [(dev.device_nr, dev.serial, dev.used) for dev in enumerate_devices(dll)] == \
+        [(0, 0x1000, False), (1, 0x1001, False)]
+
+
+def test_open_all_free_modules(pool):
+    results = pool.open()
+    assert sorted((res.device_nr, res.serial, res.error) for res in results) == \
+        [(0, 0x1000, None), (1, 0x1001, None), (2, 0x1002, None)]
+    assert sorted(pool.buses) == sorted(pool.readers) == [0, 1, 2]
+    assert not pool.enumerate()     # all modules in use
+
+
+def test_open_by_serial_and_unknown(pool):
+    results = pool.open(serials=[0x1002, 0x2000])
+    assert (results[0].device_nr, results[0].serial, results[0].error) == (2, 0x1002, None)
+    assert (results[1].device_nr, results[1].ret, results[1].bus) == (None, retSystec["USBCAN_ERR_ILLHW"], None)
+    assert list(pool.buses) == [2]
+
+
+def test_open_failure_reported(pool):
+    pool.open(devices=[1])
+    results = pool.open(devices=[1])    # already in use
+    assert results[0].error == "USBCAN_ERR_HWINUSE" and results[0].bus is None
+
+
+def test_readers_per_module(pool):
+    pool.open(devices=[0, 1])
+    seen = {}
+    for nbr, reader in pool.readers.items():
+        reader.subscribe_chan(0, lambda frames, nbr=nbr: seen.setdefault(nbr, []).extend(m.dw_id for m in frames))
+    pool.dll.inject([tCanMsgStruct(0x10, 0, 0)], device_nr=1)
+    for reader in pool.readers.values():
+        reader.drain()
+    assert seen == {1: [0x10]}
+
+
+def test_per_module_logger():
+    for name in ("ucanSystec.ucanPool", "ucanSystec.ucanHotplug"):
+        assert importlib.import_module(name).logger.name == name
@@ -0,0 +1,44 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanReplay.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN trace replay tests
+"""
+
+import time
+
+import pytest
+
+from ucanSystec import ucanReplay, tCanMsgStruct, tCaptureRecord
+
+
+def test_unthrottled_replay_sends_whole_trace(bus):
+    trace = [tCanMsgStruct(idx & 0x7FF, 0, 8, dw_time=idx) for idx in range(3000)]
+    report = ucanReplay(bus, trace, speed=0).run()
+    assert (report.sent, report.dropped) == (3000, 0)
+    assert report.batches >= 3000 // bus.chan_params[0].m_wNrOfTxBufferEntries
+
+
+def test_report_percentiles_on_absolute_errors(bus, monkeypatch):
+    replay = ucanReplay(bus, [tCanMsgStruct(0x10, 0, 0)])
+    errors = [-0.004, -0.003, -0.002, 0.001]     # frames sent ahead within a window are early
+    monkeypatch.setattr(replay, "_send", lambda first, last, *args: replay.errors.extend(errors) or last - first)
+    report = replay.run()
+    assert report.p50 == 0.003 and report.max == 0.004
+
+
+def test_stop_interrupts_loop_gap(bus):
+    replay = ucanReplay(bus, [tCanMsgStruct(0x10, 0, 0)], loops=0, loop_gap=60.0).start()
+    time.sleep(0.05)
+    start = time.time()
+    replay.stop(5.0)
+    assert time.time() - start < 1.0
+    assert replay.wait(0) is not None and replay.report.sent == 1
+
+
+def test_unavailable_channel_rejected(bus):
+    with pytest.raises(ValueError):
+        ucanReplay(bus, chan=len(bus.chan_params))
+    with pytest.raises(ValueError):
+        ucanReplay(bus, [tCaptureRecord(tCanMsgStruct(0x10, 0, 0), 2, 0)])
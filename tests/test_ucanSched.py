@@ -0,0 +1,76 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanSched.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN transmit scheduler tests
+"""
+
+from ucanSystec import ucanSystec, ucanSimDll, ucanTxScheduler, tCanMsgStruct, retSystec
+
+
+class RefusingDll(ucanSimDll):
+    """ simulated dll refusing writes (tx buffer full) or failing pending reads on demand """
+    def __init__(self, **kwargs):
+        ucanSimDll.__init__(self, **kwargs)
+        self.refuse = False
+        self.pending_error = False
+        self.writes = 0
+
+    def UcanWriteCanMsgEx(self, handle, nbr, p_msgs, p_count):
+        self.writes += 1
+        if self.refuse:
+            return retSystec["USBCAN_ERR_DLL_TXFULL"]
+        return ucanSimDll.UcanWriteCanMsgEx(self, handle, nbr, p_msgs, p_count)
+
+    def UcanGetMsgPending(self, handle, nbr, flags, p_count):
+        if self.pending_error:
+            raise OSError("driver failure")
+        return ucanSimDll.UcanGetMsgPending(self, handle, nbr, flags, p_count)
+
+
+def test_priority_order(bus, dll):
+    sched = ucanTxScheduler(bus)
+    sched.enqueue_many([tCanMsgStruct(can_id, 0, 0) for can_id in (0x300, 0x100, 0x200)])
+    dll.loopback = True
+    assert sched.step() == 3
+    bus.can_read_msgs(0)
+    assert [msg.dw_id for msg in bus.rx_frames] == [0x100, 0x200, 0x300]
+
+
+def test_rate_limit():
+    bus = ucanSystec(dll=ucanSimDll())
+    sched = ucanTxScheduler(bus)
+    sched.set_rate(0x100, 10)
+    sched.enqueue_many([tCanMsgStruct(0x100, 0, 0)] * 3)
+    assert sched.step() == 1    # others held for 100ms
+    assert sched.step() == 0
+    assert sched.deferred == 2
+    bus.can_close()
+
+
+def test_rate_limit_not_advanced_by_refused_frames():
+    dll = RefusingDll()
+    bus = ucanSystec(dll=dll)
+    sched = ucanTxScheduler(bus)
+    sched.set_rate(0x100, 10)
+    sched.enqueue(tCanMsgStruct(0x100, 0, 0))
+    dll.refuse = True
+    assert sched.step() == 0
+    assert sched.tx_full == 1 and sched.pending == 1
+    assert dll.writes == 1      # single dll write: step never waits for the tx buffer to drain
+    dll.refuse = False
+    assert sched.step() == 1    # sent at once: refused frame did not use its rate slot
+    bus.can_close()
+
+
+def test_pending_failure():
+    dll = RefusingDll()
+    bus = ucanSystec(dll=dll)
+    sched = ucanTxScheduler(bus)
+    sched.enqueue(tCanMsgStruct(0x100, 0, 0))
+    dll.pending_error = True
+    assert sched.step() == 0
+    dll.pending_error = False
+    assert sched.step() == 1
+    bus.can_close()
@@ -0,0 +1,76 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanShm.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN shared memory fan-out tests
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+pytest.importorskip("multiprocessing.shared_memory")
+
+from ucanSystec import tCanMsgStruct     # noqa: E402
+from ucanSystec.ucanShm import ucanShmWriter, ucanShmReader     # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def frames(nb, first_id=0x100):
+    """ :return: tCanMsgStruct array of nb numbered frames """
+    buf = (tCanMsgStruct * nb)()
+    for idx in range(nb):
+        buf[idx].dw_id, buf[idx].b_dlc = first_id + idx, 8
+    return buf
+
+
+@pytest.fixture
+def writer(bus):
+    """ shared memory ring owned by this process """
+    ring = ucanShmWriter(bus, "ucan_test_{}".format(os.getpid()), capacity=64, tx_capacity=64)
+    yield ring
+    ring.close()
+
+
+def test_publish_and_read(writer):
+    reader = ucanShmReader(writer.name)
+    writer.publish(frames(10), chan=1)
+    assert reader.read() == 10
+    assert [msg.dw_id for msg in reader.frames[:10]] == [0x100 + idx for idx in range(10)]
+    assert bytes(reader.chans[:10]) == b"\x01" * 10
+    reader.close()
+
+
+def test_reader_overrun(writer):
+    reader = ucanShmReader(writer.name, nb_msg=256)
+    for idx in range(3):
+        writer.publish(frames(32, 0x100 + 32 * idx), chan=0)
+    assert reader.read() == 64      # oldest batch overwritten
+    assert reader.lost == 32
+    assert reader.frames[0].dw_id == 0x120
+    reader.close()
+
+
+def test_tx_ring_forwarded(writer, dll):
+    dll.loopback = True
+    reader = ucanShmReader(writer.name, tx=0)
+    assert reader.send_many(frames(5)) == 5
+    assert writer._tx_process(writer.tx[0]) == 5
+    assert writer.bus.can_read_msgs(0) == 5
+    reader.close()
+
+
+def test_block_kept_after_consumer_process_exits(writer):
+    code = ("import sys; sys.path.insert(0, {!r}); from ucanSystec.ucanShm import ucanShmReader; "
+            "reader = ucanShmReader({!r}); print(reader.ring.capacity); reader.close()").format(ROOT, writer.name)
+    out = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+    assert out.stdout.strip() == b"64"
+    assert b"leaked" not in out.stderr and b"Error" not in out.stderr
+    time.sleep(0.2)     # consumer resource tracker ended
+    reader = ucanShmReader(writer.name)    # block not unlinked by consumer tracker
+    reader.close()
@@ -0,0 +1,39 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanSim.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN simulated dll tests
+"""
+
+import time
+import threading
+
+from ucanSystec import ucanSystec, ucanSimDll, clear_hw_cache
+
+
+def sim_threads():
+    """ :return: alive simulated dll events threads """
+    return [thread for thread in threading.enumerate() if thread.name == "ucanSimDll"]
+
+
+def test_events_thread_ends_with_last_module():
+    clear_hw_cache()
+    before = len(sim_threads())
+    dll = ucanSimDll(events=True, rx_rate=1000.0)
+    assert len(sim_threads()) == before     # started on module opening only
+    received = []
+    bus = ucanSystec(dll=dll)
+    bus.add_event_listener(lambda event, chan: received.append(event))
+    deadline = time.time() + 2
+    while not received and time.time() < deadline:
+        time.sleep(0.005)
+    assert received and dll._events is not None
+    thread = dll._events
+    bus.can_close()
+    thread.join(2)
+    assert not thread.is_alive() and dll._events is None
+    bus = ucanSystec(dll=dll)   # reopened: events thread started again
+    assert dll._events is not None and dll._events.is_alive()
+    bus.can_close()
+    clear_hw_cache()
@@ -0,0 +1,91 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanStats.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN traffic statistics and failure counters tests
+"""
+
+import sys
+import threading
+import importlib
+
+from ucanSystec import ucanStats, retSystec, retSystecNames
+
+ucanStatsModule = importlib.import_module("ucanSystec.ucanStats")   # module shadowed by class in package namespace
+
+
+def hammer(fct, threads=4, calls=20000):
+    """ call fct from several threads at once (switch interval lowered to force preemption) """
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        workers = [threading.Thread(target=lambda: [fct() for _ in range(calls)]) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setswitchinterval(interval)
+    return threads * calls
+
+
+def test_counters_concurrent():
+    stats = ucanStats(retSystecNames)
+    overrun = retSystec["USBCAN_WARN_DLL_RXOVERRUN"]
+
+    def account():
+        stats.rx(0, 1, 8)
+        stats.tx(0, 2, 16)
+        stats.code(0, overrun)
+    nb = hammer(account)
+    totals = stats.snapshot()[0]["totals"]
+    assert (totals["rx_frames"], totals["rx_bytes"], totals["tx_frames"], totals["tx_bytes"]) == \
+        (nb, 8 * nb, 2 * nb, 16 * nb)
+    assert stats.snapshot()[0]["codes"]["USBCAN_WARN_DLL_RXOVERRUN"] == nb
+
+
+def test_err_cnt_deltas():
+    stats = ucanStats()
+    stats.err_cnt(1, 5, 2)
+    stats.err_cnt(1, 3, 4)     # counter going down not accounted
+    stats.err_cnt(1, 10, 4)
+    totals = stats.snapshot()[1]["totals"]
+    assert (totals["tx_errors"], totals["rx_errors"]) == (5 + 7, 4)
+
+
+def test_rates():
+    stats = ucanStats(windows=(1,))
+    stats.sample(100.0)
+    stats.rx(0, 50, 400)
+    stats.sample(100.5)
+    assert stats._rates(list(stats._history), 100.5, 0, stats.totals[0], 1)["rx_frames"] == 100.0
+
+
+def test_fail_count_concurrent(bus):
+    bus._ucanret = retSystec["USBCAN_ERR_ILLHANDLE"]
+
+    def fail():
+        bus._ucanret = retSystec["USBCAN_ERR_ILLHANDLE"]     # per thread return code
+        bus._fail("UcanTest", verbose_only=True)
+    nb = hammer(fail, calls=5000)
+    assert bus.failures()[("UcanTest", "USBCAN_ERR_ILLHANDLE")] == nb
+
+
+def test_rates_sparse_samples(monkeypatch):
+    stats = ucanStats()
+    stats.rx(0, 0, 0)
+    stats.sample(0.0)
+    stats.rx(0, 1000, 8000)
+    monkeypatch.setattr(ucanStatsModule, "_clock", lambda: 15.0)   # scraped every 15s: no sample within 1/10s
+    rates = stats.snapshot()[0]["rates"]
+    assert [rates[window]["rx_frames"] for window in (1, 10, 60)] == [1000 / 15.0] * 3
+
+
+def test_rates_from_window_start():
+    stats = ucanStats(windows=(10,))
+    for now in range(0, 21):
+        stats.rx(0, 10, 80)
+        stats.sample(float(now))
+    # newest sample at or before window start (t=10) used
+    assert stats._rates(list(stats._history), 20.0, 0, stats.totals[0], 10)["rx_frames"] == 10.0
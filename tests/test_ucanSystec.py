@@ -0,0 +1,432 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanSystec.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN core tests: batched reception, bulk transmission, CanFrame, event driven reader, failure counters,
+cyclic lists, concurrent reception, transmission and control calls
+"""
+
+import sys
+import time
+import pickle
+import logging
+import itertools
+import threading
+from ctypes import c_ulong, cast, POINTER
+
+import pytest
+
+from ucanSystec import (ucanSystec, ucanReader, ucanSimDll, tCanMsgStruct, tUcanInitCanParam, CanFrame, retSystec,
+                        statusSystec, cyclicSystec, USBCAN_MAX_CYCCANMSG, decode_status, clear_hw_cache)
+from ucanSystec.ucanSystec import _hw_cache
+
+
+def frames(nb, first_id=0x100):
+    """ :return: tCanMsgStruct array of nb numbered frames """
+    buf = (tCanMsgStruct * nb)()
+    for idx in range(nb):
+        buf[idx].dw_id, buf[idx].b_dlc = first_id + idx, 8
+        buf[idx].data = bytes(bytearray((idx + byte) & 0xFF for byte in range(8)))
+    return buf
+
+
+class CountingDll(ucanSimDll):
+    """ simulated dll recording count requested by each read """
+    def __init__(self, **kwargs):
+        ucanSimDll.__init__(self, **kwargs)
+        self.read_counts = []
+
+    def UcanReadCanMsgEx(self, handle, p_chan, p_msgs, p_count):
+        if p_count is not None:
+            self.read_counts.append(cast(p_count, POINTER(c_ulong))[0])
+        return ucanSimDll.UcanReadCanMsgEx(self, handle, p_chan, p_msgs, p_count)
+
+
+def test_read_msgs_count_pointer():
+    dll = CountingDll()
+    bus = ucanSystec(dll=dll)
+    dll.inject(frames(10))
+    assert bus.can_read_msgs(0, 4) == 4
+    assert bus.can_read_msgs(0) == 6
+    assert dll.read_counts == [4, len(bus.rx_buffer)]
+    bus.can_close()
+
+
+def test_read_msgs_partial_fill(bus, dll):
+    dll.inject(frames(5))
+    assert bus.can_read_msgs(0, 32) == 5
+    assert bus._ucanret == retSystec["USBCAN_SUCCESSFUL"]
+    assert [msg.dw_id for msg in bus.rx_frames] == [0x100 + idx for idx in range(5)]
+
+
+def test_read_msgs_nodata(bus):
+    assert bus.can_read_msgs(0, 16) == 0
+    assert bus._ucanret == retSystec["USBCAN_WARN_NODATA"]
+    assert len(bus.rx_frames) == 0
+
+
+def test_read_msgs_grows_buffer(bus, dll):
+    dll.inject(frames(200))
+    assert bus.can_read_msgs(0, 200) == 200
+    assert len(bus.rx_buffer) >= 200
+
+
+def test_rx_frames_zero_copy(bus, dll):
+    dll.inject(frames(3))
+    bus.can_read_msgs(0, 8)
+    view = bus.rx_frames
+    assert len(view) == 3
+    view[1].dw_id = 0x7FF
+    assert bus.rx_buffer[1].dw_id == 0x7FF     # view shares reception buffer memory
+
+
+def test_read_msgs_caller_buffer(bus, dll):
+    buf = (tCanMsgStruct * 4)()
+    dll.inject(frames(6))
+    assert bus.can_read_msgs(0, 0, buf) == 4
+    assert bus.rx_frames[3].dw_id == buf[3].dw_id == 0x103
+
+
+def test_send_many_resumes_on_txlimit(bus, dll):
+    bus.can_set_buffers(tx_entries=100)
+    calls = dll.calls
+    assert bus.send_many(frames(300), timeout=1.0) == 300
+    assert dll.calls - calls > 1    # partial writes resubmitted
+    assert dll.modules[0].channels[0].sent == 300
+
+
+def test_send_many_timeout_ignores_wall_clock_steps(bus, dll, monkeypatch):
+    steps = itertools.count(0, 3600)     # wall clock jumping 1 hour forward at each read
+    monkeypatch.setattr(time, "time", lambda: float(next(steps)))
+    bus.can_set_buffers(tx_entries=100)
+    assert bus.send_many(frames(300), timeout=1.0) == 300
+
+
+def test_send_many_single_write(bus, dll):
+    bus.can_set_buffers(tx_entries=100)
+    calls = dll.calls
+    assert bus.send_many(frames(300), timeout=None) == 100
+    assert dll.calls - calls == 1   # no resubmit
+    assert bus._ucanret == retSystec["USBCAN_WARN_TXLIMIT"]
+
+
+def test_send_many_sequence(bus, dll):
+    msgs = [tCanMsgStruct(0x10 + idx, 0, 1) for idx in range(5)]
+    assert bus.send_many(msgs) == 5
+    assert bus._ucanret == retSystec["USBCAN_SUCCESSFUL"]
+
+
+def test_send_many_loopback():
+    bus = ucanSystec(dll=ucanSimDll(loopback=True))
+    sent = frames(8)
+    assert bus.send_many(sent) == 8
+    assert bus.can_read_msgs(0, 16) == 8
+    assert [msg.dw_id for msg in bus.rx_frames] == [msg.dw_id for msg in sent]
+    bus.can_close()
+
+
+def test_failures_counted_and_logged(bus, dll, caplog):
+    dll.unplug()
+    with caplog.at_level(logging.DEBUG, logger="ucanSystec.ucanSystec"):
+        bus.send_many(frames(1))
+        bus.send_many(frames(1))
+    assert bus.failures() == {("UcanWriteCanMsgEx", "USBCAN_ERR_ILLHANDLE"): 2}
+    assert [rec.levelno for rec in caplog.records if "UcanWriteCanMsgEx" in rec.getMessage()] == [logging.DEBUG] * 2
+
+
+def test_failures_logged_as_warning_when_verbose(caplog):
+    dll = ucanSimDll()
+    bus = ucanSystec(verbose=True, dll=dll)
+    dll.unplug()
+    with caplog.at_level(logging.WARNING, logger="ucanSystec.ucanSystec"):
+        bus.send_many(frames(1))
+    assert any("!FAIL! UcanWriteCanMsgEx = USBCAN_ERR_ILLHANDLE" in rec.getMessage() for rec in caplog.records)
+
+
+def test_statuses_counted_and_decoded(bus, dll):
+    dll.set_status(statusSystec["USBCAN_CANERR_BUSLIGHT"] | statusSystec["USBCAN_CANERR_BUSHEAVY"])
+    bus.can_get_status()
+    bus.can_get_status()
+    dll.set_status(statusSystec["USBCAN_CANERR_OK"])
+    bus.can_get_status()    # OK status not counted
+    assert bus.statuses() == {("USBCAN_CANERR_BUSLIGHT", "USBCAN_CANERR_BUSHEAVY"): 2}
+
+
+def test_decode_status():
+    assert decode_status(0) == ("USBCAN_CANERR_OK",)
+    assert decode_status(statusSystec["USBCAN_CANERR_BUSOFF"] | 0x8000) == ("USBCAN_CANERR_BUSOFF", "UNKNOWN_0x8000")
+
+
+def test_cyclic_define_and_read(bus):
+    assert bus.can_define_cyclic([(tCanMsgStruct(0x10, 0, 1, 0xAA), 10), (CanFrame(0x20, 0, 2, b"\x01\x02"), 100)]) == 0
+    listed = bus.can_read_cyclic()
+    assert [(msg.dw_id, msg.b_dlc, period) for msg, period in listed] == [(0x10, 1, 10), (0x20, 2, 100)]
+    assert [(msg.dw_id, period) for msg, period in bus.cyclic[0]] == [(0x10, 10), (0x20, 100)]
+
+
+def test_cyclic_too_many(bus):
+    assert bus.can_define_cyclic([(tCanMsgStruct(idx, 0, 0), 10) for idx in range(USBCAN_MAX_CYCCANMSG + 1)]) == \
+        retSystec["USBCAN_ERR_ILLPARAM"]
+    assert 0 not in bus.cyclic
+
+
+def test_cyclic_transmission(bus, dll):
+    chan = dll.modules[0].channels[0]
+    bus.can_define_cyclic([(tCanMsgStruct(0x10, 0, 0), 1), (tCanMsgStruct(0x20, 0, 0), 1)])
+    assert bus.can_start_cyclic(locked=(1,)) == 0
+    assert bus.cyclic_flags[0] == cyclicSystec["USBCAN_CYCLIC_FLAG_START"] | cyclicSystec["USBCAN_CYCLIC_FLAG_LOCK_1"]
+    time.sleep(0.02)
+    bus.can_read_msgs(0)
+    assert len(bus.rx_frames) and set(msg.dw_id for msg in bus.rx_frames) == {0x10}     # echoed, locked not sent
+    assert bus.can_stop_cyclic() == 0
+    bus.can_read_msgs(0)
+    sent = chan.cyclic_sent
+    time.sleep(0.01)
+    bus.can_read_msgs(0)
+    assert chan.cyclic_sent == sent
+
+
+def test_cyclic_redefined_while_running(bus, dll):
+    chan = dll.modules[0].channels[0]
+    bus.can_define_cyclic([(tCanMsgStruct(0x10, 0, 0), 10)])
+    bus.can_start_cyclic(sequential=True, echo=False)
+    flags = bus.cyclic_flags[0]
+    assert bus.can_define_cyclic([(tCanMsgStruct(0x30, 0, 0), 10)]) == 0    # stopped, loaded, restarted
+    assert [msg.dw_id for msg in chan.cyclic] == [0x30]
+    assert chan.cyclic_flags == bus.cyclic_flags[0] == flags
+    assert not bus.failures()
+
+
+def test_concurrent_rx_tx_ctl():
+    dll = ucanSimDll(loopback=True, tx_rate=1e9)
+    bus = ucanSystec(dll=dll)
+    nb, batch = 20000, 50
+    received, errors = [], []
+
+    def sender():
+        msgs = frames(batch)
+        for _ in range(nb // batch):
+            if bus.send_many(msgs, timeout=1.0) != batch:
+                errors.append(("tx", bus._ucanret))
+
+    def reader():
+        deadline = time.time() + 10
+        while len(received) < nb and time.time() < deadline:
+            if bus.can_read_msgs(0, 256) > 0:
+                received.extend(msg.dw_id for msg in bus.rx_frames)
+            elif bus._ucanret != retSystec["USBCAN_WARN_NODATA"]:
+                errors.append(("rx", bus._ucanret))
+
+    def control():
+        while len(received) < nb and not errors:
+            if bus.can_get_status()._ucanret:
+                errors.append(("ctl", bus._ucanret))
+    threads = [threading.Thread(target=fct) for fct in (sender, reader, control)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(20)
+    finally:
+        sys.setswitchinterval(interval)
+    assert not errors
+    assert received == [0x100 + idx for idx in range(batch)] * (nb // batch)     # order kept, nothing lost
+    assert bus.traffic.totals[0][0] == bus.traffic.totals[0][2] == nb              # rx and tx frames counted
+    bus.can_close()
+
+
+def test_return_code_per_thread(bus, dll):
+    dll.inject(frames(1))
+    assert bus.can_read_msgs(0) == 1
+    other = []
+    worker = threading.Thread(target=lambda: other.append((bus.can_read_msgs(0), bus._ucanret)))
+    worker.start()
+    worker.join()
+    assert other == [(0, retSystec["USBCAN_WARN_NODATA"])]
+    assert bus._ucanret == retSystec["USBCAN_SUCCESSFUL"]     # calling thread code untouched
+
+
+def test_can_frame_round_trip():
+    msg = frames(1, 0x1ABCDEF)[0]
+    msg.b_ff, msg.b_dlc, msg.dw_time = 0x80, 5, 1234
+    frame = CanFrame.from_struct(msg)
+    assert frame == CanFrame(0x1ABCDEF, 0x80, 5, bytes(bytearray(range(5))), 1234)
+    back = frame.to_struct()
+    assert (back.dw_id, back.b_ff, back.b_dlc, back.dw_time) == (0x1ABCDEF, 0x80, 5, 1234)
+    assert back.payload == frame.data
+    assert bytes(bytearray(back.data))[5:] == b"\x00\x00\x00"
+    assert pickle.loads(pickle.dumps(frame)) == frame
+    assert hash(frame) == hash(CanFrame.from_struct(back))
+
+
+def test_can_frame_immutable():
+    frame = CanFrame(1)
+    with pytest.raises(AttributeError):
+        frame.id = 2
+
+
+def test_send_many_default_resubmits(bus, dll):
+    bus.can_set_buffers(tx_entries=100)
+    calls = dll.calls
+    sent = bus.send_many(frames(1200))
+    assert 100 < sent < 1200    # one resubmit pass once dll tx buffer drained, remaining frames left to caller
+    assert dll.calls - calls == 2
+    assert bus._ucanret in (retSystec["USBCAN_WARN_TXLIMIT"], retSystec["USBCAN_ERR_DLL_TXFULL"])
+
+
+class InitRecordingDll(ucanSimDll):
+    """ simulated dll recording (module serial, baud registers) of each channel init """
+    def __init__(self, **kwargs):
+        ucanSimDll.__init__(self, **kwargs)
+        self.inits = []
+
+    def UcanInitCanEx2(self, handle, chan, p_params):
+        params = cast(p_params, POINTER(tUcanInitCanParam))[0]
+        module = self._module(handle)
+        self.inits.append((module.serial if module else None, (params.m_bBTR0, params.m_bBTR1, params.m_dwBaudrate)))
+        return ucanSimDll.UcanInitCanEx2(self, handle, chan, p_params)
+
+
+def test_cached_discovery_applied_to_same_module_only():
+    clear_hw_cache()
+    dll = InitRecordingDll(modules=2)
+    first = ucanSystec(dll=dll, device_nr=1)
+    baud = dll.inits[-1][1]
+    first.can_close()
+    _hw_cache[0x1001]["baud"] = (0x12, 0x34, 0x5678)    # cached registers of module 1 only
+    bus = ucanSystec(dll=dll, serial=0x1001)            # any module: module 0 opened
+    assert bus.serial == 0x1000
+    assert dll.inits[1:] == [(0x1000, baud)]            # discovered speed, never module 1 cached registers
+    assert not bus.failures()
+    bus.can_close()
+    bus = ucanSystec(dll=dll, device_nr=1, serial=0x1001)
+    assert dll.inits[-1] == (0x1001, (0x12, 0x34, 0x5678))
+    bus.can_close()
+    clear_hw_cache()
+
+
+class TracingDll(ucanSimDll):
+    """ simulated dll recording names of called entry points """
+    def __getattribute__(self, name):
+        if name.startswith("Ucan"):
+            ucanSimDll.__getattribute__(self, "trace").append(name)
+        return ucanSimDll.__getattribute__(self, name)
+
+    def __init__(self, **kwargs):
+        self.trace = []
+        ucanSimDll.__init__(self, **kwargs)
+
+
+def test_cached_discovery_saves_round_trip():
+    clear_hw_cache()
+    dll = TracingDll()
+    ucanSystec(dll=dll).can_close()
+    assert dll.trace[:4] == ["UcanInitHardwareEx", "UcanGetHardwareInfoEx2", "UcanInitCanEx2",
+                             "UcanGetHardwareInfoEx2"]
+    del dll.trace[:]
+    bus = ucanSystec(dll=dll, serial=0x1000)
+    assert dll.trace == ["UcanInitHardwareEx", "UcanGetHardwareInfoEx2", "UcanInitCanEx2"]
+    bus.can_close()
+    clear_hw_cache()
+
+
+def test_reopen_keeps_configured_speed():
+    clear_hw_cache()
+    dll = InitRecordingDll()
+    bus = ucanSystec(dll=dll)
+    bus.can_set_speed(500000)
+    bus.can_init_can(1)
+    baud = (bus.params.m_bBTR0, bus.params.m_bBTR1, bus.params.m_dwBaudrate)
+    del dll.inits[:]
+    bus.reopen()
+    assert (bus.params.m_bBTR0, bus.params.m_bBTR1, bus.params.m_dwBaudrate) == baud
+    assert [init[1] for init in dll.inits] == [baud, (bus.chan_params[1].m_bBTR0, bus.chan_params[1].m_bBTR1,
+                                                      bus.chan_params[1].m_dwBaudrate)]
+    assert bus.chan_init == {0, 1}
+    bus.can_close()
+    other = ucanSystec(dll=dll, serial=0x1000)      # speed set after opening cached too
+    assert dll.inits[-1][1] == baud
+    other.can_close()
+    clear_hw_cache()
+
+
+class RaisingDll(ucanSimDll):
+    """ simulated dll failing hardware init once with an unexpected exception """
+    def __init__(self, **kwargs):
+        ucanSimDll.__init__(self, **kwargs)
+        self.fail = True
+
+    def UcanInitHardwareEx(self, p_handle, nbr, callback, arg):
+        if self.fail:
+            self.fail = False
+            raise RuntimeError("driver failure")
+        return ucanSimDll.UcanInitHardwareEx(self, p_handle, nbr, callback, arg)
+
+
+def test_lazy_open_retried_after_exception():
+    bus = ucanSystec(dll=RaisingDll(), lazy=True)
+    with pytest.raises(RuntimeError):
+        bus.can_get_status()
+    assert bus._lazy
+    bus.can_get_status()
+    assert bus.is_initialised()
+    bus.can_close()
+
+
+def wait_for(cond, timeout=2.0):
+    """ :return: True once cond() is true (False after timeout) """
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_reader_event_driven(bus, dll):
+    seen, status = [], []
+    reader = ucanReader(bus, on_frames=lambda frames: seen.extend(msg.dw_id for msg in frames))
+    reader.subscribe(on_status=lambda st: status.append(st.m_wCanStatus))
+    dll.inject(frames(2))       # pending before start: drained on start
+    reader.start()
+    assert wait_for(lambda: len(seen) == 2)
+    dll.inject(frames(3, 0x200))
+    assert wait_for(lambda: len(seen) == 5)
+    assert seen == [0x100, 0x101, 0x200, 0x201, 0x202]
+    dll.set_status(statusSystec["USBCAN_CANERR_BUSLIGHT"])
+    assert wait_for(lambda: status == [statusSystec["USBCAN_CANERR_BUSLIGHT"]])
+    reader.stop(2)
+    assert not reader._thread.is_alive()
+    assert reader._on_event not in bus._event_listeners
+    dll.inject(frames(1))
+    time.sleep(0.05)
+    assert len(seen) == 5       # stopped: no more frames handed to consumers
+
+
+def test_reader_unsubscribe(bus, dll):
+    seen = []
+
+    def consumer(frames):
+        seen.extend(msg.dw_id for msg in frames)
+    reader = ucanReader(bus, on_frames=consumer)
+    dll.inject(frames(1))
+    reader.drain()
+    reader.unsubscribe(on_frames=consumer)
+    dll.inject(frames(1, 0x200))
+    assert reader.drain() == 1
+    assert seen == [0x100]
+
+
+def test_reader_failing_consumer(bus, dll):
+    seen = []
+
+    def failing(frames):
+        raise ValueError(len(frames))
+    reader = ucanReader(bus, on_frames=failing)
+    reader.subscribe(lambda frames: seen.extend(msg.dw_id for msg in frames))
+    dll.inject(frames(3))
+    assert reader.drain() == 3
+    assert seen == [0x100, 0x101, 0x102]
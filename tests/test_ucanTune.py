@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanTune.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN dll buffers auto-tuning tests
+"""
+
+import threading
+
+from ucanSystec import ucanSystec, ucanSimDll, ucanBufferTuner, retSystec
+from ucanSystec.ucanTune import _Tuned
+
+
+class PendingFailingDll(ucanSimDll):
+    """ simulated dll whose pending reads raise on demand """
+    def __init__(self, **kwargs):
+        ucanSimDll.__init__(self, **kwargs)
+        self.pending_error = False
+
+    def UcanGetMsgPending(self, handle, nbr, flags, p_count):
+        if self.pending_error:
+            raise OSError("driver failure")
+        return ucanSimDll.UcanGetMsgPending(self, handle, nbr, flags, p_count)
+
+
+def test_grow_on_overrun(bus):
+    tuner = ucanBufferTuner(bus, window=0.0, quiet=0.0)
+    tuner.step()
+    bus.traffic.code(0, retSystec["USBCAN_WARN_DLL_RXOVERRUN"])
+    tuner.step()    # window evaluated, then applied on quiet bus
+    assert tuner.actions and tuner.actions[-1].rx_to == 1024
+    assert tuner.settings()[0] == (1024, 500)
+
+
+def test_failing_action_consumer(bus):
+    seen = []
+
+    def failing(action):
+        raise ValueError(action)
+    tuner = ucanBufferTuner(bus, on_action=failing)
+    tuner.subscribe(seen.append)
+    state = _Tuned(0, 0, 0.0)
+    state.target = (256, 256, "test")
+    tuner._apply(0, state, 0.0)
+    assert len(seen) == 1 and seen[0].rx_to == 256 and seen[0].ret == 0
+
+
+def test_pending_failure():
+    dll = PendingFailingDll()
+    bus = ucanSystec(dll=dll)
+    tuner = ucanBufferTuner(bus)
+    dll.pending_error = True
+    tuner.step()    # sample skipped
+    assert tuner._chans[0].rx_peak == 0
+    bus.can_close()
+
+
+def test_not_applied_while_traffic_flows(bus):
+    tuner = ucanBufferTuner(bus, window=60.0, quiet=0.0)
+    tuner.step()
+    tuner._chans[0].target = (1024, 500, "test")
+    for _ in range(3):
+        bus.traffic.rx(0, 10, 80)   # fast reader: frames read between samples, dll buffers seen empty
+        bus.traffic.tx(0, 1, 8)
+        tuner.step()
+        assert not tuner.actions
+    tuner.step()    # no frame since last sample: quiet
+    assert [action.rx_to for action in tuner.actions] == [1024]
+
+
+def test_counts_read_under_stats_lock(bus):
+    tuner = ucanBufferTuner(bus)
+    bus.traffic.code(0, retSystec["USBCAN_WARN_DLL_RXOVERRUN"])
+    with bus.traffic._lock:
+        reader = threading.Thread(target=lambda: tuner._counts(0))
+        reader.start()
+        reader.join(0.05)
+        assert reader.is_alive()    # waits for counters updates in progress
+    reader.join(1)
+    assert tuner._counts(0) == (1, 0)
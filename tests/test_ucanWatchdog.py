@@ -0,0 +1,66 @@
+# -*- coding:utf-8 -*-
+"""
+test_ucanWatchdog.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN status watchdog tests
+"""
+
+import time
+
+from ucanSystec import ucanSystec, ucanSimDll, ucanWatchdog, statusSystec
+
+
+class StatusFailingDll(ucanSimDll):
+    """ simulated dll whose status reads raise on demand """
+    def __init__(self, **kwargs):
+        ucanSimDll.__init__(self, **kwargs)
+        self.status_error = False
+
+    def UcanGetStatusEx(self, handle, nbr, p_status):
+        if self.status_error:
+            raise OSError("driver failure")
+        return ucanSimDll.UcanGetStatusEx(self, handle, nbr, p_status)
+
+
+def failing(event):
+    """ consumer raising on each event """
+    raise ValueError(event)
+
+
+def test_transitions_published(bus, dll):
+    events = []
+    dog = ucanWatchdog(bus, on_event=failing)
+    dog.subscribe(events.append)
+    dll.set_status(statusSystec["USBCAN_CANERR_BUSHEAVY"], tx_err=130)
+    assert dog.poll() == statusSystec["USBCAN_CANERR_BUSHEAVY"]
+    dll.set_status(0)
+    dog.poll()
+    assert [(evt.name, evt.active) for evt in events] == [("USBCAN_CANERR_BUSHEAVY", True),
+                                                          ("USBCAN_CANERR_BUSHEAVY", False)]
+    assert events[0].tx_err == 130
+
+
+def test_busoff_recovery(bus, dll):
+    events = []
+    dog = ucanWatchdog(bus, recover=True, on_event=events.append)
+    dll.set_status(statusSystec["USBCAN_CANERR_BUSOFF"])
+    dog.poll()
+    assert dog.resets == 1 and events[-1].name == "USBCAN_RESET"
+    assert dog.poll() == 0     # simulated reset clears status
+
+
+def test_status_read_failure():
+    dll = StatusFailingDll()
+    bus = ucanSystec(dll=dll)
+    dog = ucanWatchdog(bus, period=0.01)
+    dll.status_error = True
+    assert dog.poll() is None
+    dog.start()
+    time.sleep(0.05)
+    dll.status_error = False
+    polls = dog.polls
+    time.sleep(0.05)
+    assert dog._thread.is_alive() and dog.polls > polls
+    dog.stop()
+    bus.can_close()
@@ -6,4 +6,43 @@ Author: SMFSW
 SystecUSBCAN package init
 """
 
+from sys import version_info
+
 from .ucanSystec import *
+from .ucanStats import *
+from .ucanClock import *
+from .ucanSim import *
+from .ucanDemux import *
+from .ucanPool import *
+from .ucanFilter import *
+from .ucanSched import *
+from .ucanWatchdog import *
+from .ucanHotplug import *
+from .ucanTune import *
+from .ucanCapture import *
+from .ucanReplay import *
+from .ucanDbc import *
+
+# heavy imports (numpy, asyncio, shared memory) done on first access of their names
+_lazy_modules = {'ucanNumpy': ('struct_dtype', 'can_msg_dtype', 'can_msg_payload_dtype',
+                               'frames_array', 'frames_view', 'payload_view', 'read_array'),
+                 'ucanAsync': ('AsyncUcanSystec',),
+                 'ucanShm': ('ucanShmWriter', 'ucanShmReader')}
+
+if version_info >= (3, 7):
+    def __getattr__(name):
+        """ import lazily exported names on first access (PEP 562) """
+        import importlib
+        for module, names in _lazy_modules.items():
+            if name in names:
+                value = getattr(importlib.import_module("." + module, __name__), name)
+                globals()[name] = value
+                return value
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    def __dir__():
+        return sorted(list(globals()) + [name for names in _lazy_modules.values() for name in names])
+else:
+    from .ucanNumpy import *
+    if version_info >= (3, 6):
+        from .ucanAsync import *
@@ -0,0 +1,177 @@
+# -*- coding:utf-8 -*-
+"""
+ucanAsync.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN asyncio front-end
+"""
+
+import asyncio
+import collections
+import threading
+from ctypes import sizeof
+
+from .ucanSystec import ucanReader, tCanMsgStruct, eventSystec, retSystec, retSystecNames
+
+__all__ = ['AsyncUcanSystec']
+
+# dll codes meaning tx buffer is full (request kept and retried), any other code ends the request
+_TX_BACKPRESSURE = (retSystec["USBCAN_ERR_DLL_TXFULL"], retSystec["USBCAN_WARN_TXLIMIT"])
+
+
+class AsyncUcanSystec(object):
+    """ asyncio front-end for ucanSystec
+    A single I/O thread drives the dll: received frames and send completions cross the loop boundary by batches. """
+    def __init__(self, bus, loop=None, rx_queue=64, max_tx_pending=None):
+        """ instance init (shall be done from a coroutine of the running loop when loop is not given)
+        :param bus: ucanSystec instance
+        :param loop: asyncio loop to deliver frames to (running loop if None)
+        :param rx_queue: max number of batches queued per frames iterator (oldest batches dropped when full)
+        :param max_tx_pending: max number of frames not yet accepted by the dll (dll tx buffer size if None) """
+        self.bus = bus
+        self.loop = loop or asyncio.get_running_loop()
+        self.rx_queue = rx_queue
+        self.max_tx_pending = max_tx_pending or bus.params.m_wNrOfTxBufferEntries
+        self.dropped = 0            # batches dropped because of slow iterators
+        self._subscribers = {}      # channel: list of asyncio queues
+        self._tx_requests = collections.deque()     # [chan, frames, offset, future]
+        self._tx_pending = 0
+        self._tx_room = asyncio.Event()
+        self._tx_room.set()
+        self._wake = threading.Event()
+        self._reader = ucanReader(bus, on_frames=self._rx_batch)
+        self._running = True
+        self.bus.add_event_listener(self._on_event)
+        self._thread = threading.Thread(target=self._run, name="AsyncUcanSystec")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _on_event(self, event, chan):
+        """ dll events listener: wakes I/O thread """
+        if event == eventSystec["USBCAN_EVENT_RECEIVE"]:
+            self._wake.set()
+
+    def _rx_batch(self, frames):
+        """ I/O thread: copy batch out of the reused rx buffer and hand it to the loop (one hop per batch) """
+        batch = (tCanMsgStruct * len(frames)).from_buffer_copy(frames)
+        self.loop.call_soon_threadsafe(self._deliver, self.bus.rx_chan.value, batch)
+
+    def _deliver(self, chan, batch):
+        """ loop thread: dispatch batch to frames iterators """
+        for key in (chan, 255):
+            for queue in self._subscribers.get(key, ()):
+                if queue.full():
+                    queue.get_nowait()
+                    self.dropped += 1
+                queue.put_nowait(batch)
+
+    def _tx_done(self, future, reserved, sent, ret=0):
+        """ loop thread: complete a send request and release its tx room
+        :param future: request future
+        :param reserved: number of frames of the request (accounted as pending)
+        :param sent: number of frames accepted by the dll
+        :param ret: dll error code ending the request before all frames were accepted (0 otherwise) """
+        self._tx_pending -= reserved
+        if self._tx_pending < self.max_tx_pending:
+            self._tx_room.set()
+        if future.done():
+            return
+        if ret:
+            future.set_exception(OSError(ret, "UcanWriteCanMsgEx failed: {} ({} of {} frames accepted)".format(
+                retSystecNames.get(ret, hex(ret)), sent, reserved)))
+        else:
+            future.set_result(sent)
+
+    def _tx_process(self):
+        """ I/O thread: submit pending send requests
+        :return: True if dll tx buffer is full (requests left) """
+        while self._tx_requests:
+            req = self._tx_requests[0]
+            chan, frames, offset, future = req
+            # single dll write: the I/O thread never sleeps on a full tx buffer (reception keeps going)
+            sent = self.bus.send_many((tCanMsgStruct * (len(frames) - offset)).from_buffer(
+                frames, offset * sizeof(tCanMsgStruct)), chan, timeout=None)
+            ret = self.bus._ucanret if sent >= 0 else -1    # -1: dll call raised
+            req[2] += max(sent, 0)
+            if req[2] < len(frames):
+                if ret in _TX_BACKPRESSURE:
+                    return True     # dll tx buffer full, retry later (backpressure)
+            else:
+                ret = 0
+            self._tx_requests.popleft()
+            self.loop.call_soon_threadsafe(self._tx_done, future, len(frames), req[2], ret)
+        return False
+
+    def _run(self):
+        """ I/O thread: sleeps until a dll event or a send request occurs """
+        tx_full = False
+        while self._running:
+            self._wake.wait(0.001 if tx_full else None)
+            self._wake.clear()
+            if not self._running:
+                break
+            self._reader.drain()
+            tx_full = self._tx_process()
+
+    async def send_many(self, frames, chan=0):
+        """ send messages (waits for room when too many frames are pending)
+        :param frames: sequence of tCanMsgStruct (copied)
+        :param chan: module channel
+        :return: number of messages accepted by the dll (OSError raised with dll code on errors other than full
+        dll tx buffer) """
+        frames = (tCanMsgStruct * len(frames))(*frames)
+        while self._tx_pending >= self.max_tx_pending:
+            self._tx_room.clear()
+            await self._tx_room.wait()
+        self._tx_pending += len(frames)
+        future = self.loop.create_future()
+        self._tx_requests.append([chan, frames, 0, future])
+        self._wake.set()
+        return await future
+
+    async def send(self, frame, chan=0):
+        """ send a message
+        :param frame: tCanMsgStruct (copied)
+        :param chan: module channel
+        :return: number of messages accepted by the dll """
+        return await self.send_many((frame,), chan)
+
+    async def frames(self, chan=255):
+        """ asynchronous iterator over received frames
+        :param chan: module channel (frames from any channel if set to 255)
+        :return: received frames (tCanMsgStruct) """
+        async for batch in self.batches(chan):
+            for frame in batch:
+                yield frame
+
+    async def batches(self, chan=255):
+        """ asynchronous iterator over received batches of frames
+        :param chan: module channel (frames from any channel if set to 255)
+        :return: received batches (tCanMsgStruct ctypes arrays) """
+        queue = asyncio.Queue(self.rx_queue)
+        self._subscribers.setdefault(chan, []).append(queue)
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            self._subscribers[chan].remove(queue)
+
+    def close(self):
+        """ Stop I/O thread and end frames iterators (bus is left open) """
+        if self._running:
+            self._running = False
+            self.bus.remove_event_listener(self._on_event)
+            self._wake.set()
+            self._thread.join()
+            for queues in self._subscribers.values():
+                for queue in queues:
+                    if queue.full():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+            for _, _, _, future in self._tx_requests:
+                if not future.done():
+                    future.cancel()
+            self._tx_requests.clear()
@@ -0,0 +1,478 @@
+# -*- coding:utf-8 -*-
+"""
+ucanCapture.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN binary capture (raw frame records written by a background thread, rotation, offline ASC export,
+memory-mapped reader with time and identifier indexes)
+"""
+
+import os
+import time
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque
+from ctypes import Structure, c_ubyte, c_long, c_int64, addressof, sizeof, string_at
+
+from .ucanSystec import tCanMsgStruct, ucanReader
+from .ucanClock import clock_ns
+from .ucanFilter import USBCAN_MSG_FF_EXT, USBCAN_MSG_FF_RTR
+
+__all__ = ['tCaptureRecord', 'CAPTURE_MAGIC', 'capture_header', 'iter_capture', 'export_asc', 'ucanRecorder',
+           'ucanCaptureReader']
+
+logger = logging.getLogger(__name__)
+
+_clock = getattr(time, "monotonic", time.time)
+# wall clock: read once per recording as header reference (records use monotonic clock_ns)
+_time_ns = getattr(time, "time_ns", lambda: int(time.time() * 1000000000))
+
+CAPTURE_MAGIC = b"UCANCAP\x00"
+_CAPTURE_VERSION = 2
+# file header: magic, version, message size, record size, reserved, file start as wall clock ns since epoch and as
+# host clock_ns at the same instant (single wall clock reference: records are stamped with monotonic clock_ns)
+_HEADER = struct.Struct("<8sHHHHqq")
+
+
+class tCaptureRecord(Structure):
+    """ Capture record: raw dll frame, module channel and host reception time (clock_ns, monotonic, native order) """
+    _pack_ = 1
+    _fields_ = [("msg", tCanMsgStruct), ("chan", c_ubyte), ("ns", c_int64)]
+
+
+_MSG_SIZE = sizeof(tCanMsgStruct)
+_REC_SIZE = sizeof(tCaptureRecord)
+_NS_OFFSET = tCaptureRecord.ns.offset
+
+
+def _first_ns(records):
+    """ :return: host time of first record of a raw records buffer """
+    return struct.unpack_from("=q", records, _NS_OFFSET)[0]
+
+
+def capture_header(path):
+    """ Read capture file header
+    :param path: capture file path
+    :return: (file start as wall clock ns since epoch, file start as host clock_ns), records wall clock time is
+    start_ns + record.ns - host_ns """
+    with open(path, "rb") as f:
+        magic, version, msg_size, rec_size, _, start_ns, host_ns = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != CAPTURE_MAGIC or version != _CAPTURE_VERSION or (msg_size, rec_size) != (_MSG_SIZE, _REC_SIZE):
+        raise ValueError("{} is not a compatible ucanSystec capture".format(path))
+    return start_ns, host_ns
+
+
+def iter_capture(path, nb_rec=4096):
+    """ Iterate over capture records by blocks (sequential read, see ucanCaptureReader for random access)
+    :param path: capture file path
+    :param nb_rec: max number of records per block
+    :return: tCaptureRecord ctypes arrays (new array for each block) """
+    capture_header(path)
+    with open(path, "rb") as f:
+        f.seek(_HEADER.size)
+        while True:
+            data = f.read(nb_rec * _REC_SIZE)
+            nb = len(data) // _REC_SIZE     # truncated last record (capture interrupted) ignored
+            if not nb:
+                break
+            yield (tCaptureRecord * nb).from_buffer_copy(data[:nb * _REC_SIZE])
+
+
+def export_asc(path, out_path, origin=None):
+    """ Export a capture to Vector ASC text format (offline, never on reception path)
+    :param path: capture file path
+    :param out_path: ASC file path
+    :param origin: time origin (host clock_ns of records timeline), file start if None
+    :return: number of frames exported """
+    start_ns, host_ns = capture_header(path)
+    origin = host_ns if origin is None else origin
+    date = time.strftime("%a %b %d %I:%M:%S %p %Y", time.localtime((start_ns + origin - host_ns) / 1e9))
+    nb = 0
+    with open(out_path, "w") as out:
+        out.write("date {}\nbase hex  timestamps absolute\nno internal events logged\n".format(date))
+        out.write("Begin Triggerblock {}\n".format(date))
+        for block in iter_capture(path):
+            lines = []
+            for rec in block:
+                msg = rec.msg
+                stamp = (rec.ns - origin) / 1e9
+                can_id = ("{:X}x" if msg.b_ff & USBCAN_MSG_FF_EXT else "{:X}").format(msg.dw_id)
+                if msg.b_ff & USBCAN_MSG_FF_RTR:
+                    lines.append("{:>11.6f} {} {:<15} Rx   r\n".format(stamp, rec.chan + 1, can_id))
+                else:
+                    data = " ".join("{:02X}".format(byte) for byte in bytearray(msg.payload))
+                    lines.append("{:>11.6f} {} {:<15} Rx   d {} {}\n".format(stamp, rec.chan + 1, can_id,
+                                                                         msg.b_dlc, data))
+            out.writelines(lines)
+            nb += len(block)
+        out.write("End TriggerBlock\n")
+    return nb
+
+
+# noinspection PyPep8Naming
+class ucanRecorder(object):
+    """ Capture recorder: batches read by a ucanReader are copied once (with channel and host time) and handed to
+    a writer thread building records and writing them by large blocks (reception path never waits for disk).
+    Records are stamped with the monotonic host clock (clock_ns), each file header holds its start both as wall
+    clock and clock_ns (taken once at recording start: wall clock steps never affect a recording).
+    Files rotate on size and/or time: path is used as is without rotation, numbered (name_0000.ext...) otherwise. """
+    def __init__(self, bus, path, reader=None, max_bytes=0, max_time=0, block_size=1 << 20, flush_period=0.5):
+        """ recorder init
+        :param bus: ucanSystec instance
+        :param path: capture file path
+        :param reader: ucanReader to subscribe to (own reader started with recorder if None)
+        :param max_bytes: file size triggering rotation (0 for none)
+        :param max_time: file duration in s triggering rotation (0 for none)
+        :param block_size: bytes accumulated before each file write
+        :param flush_period: time in s after which accumulated records are written anyway """
+        self.bus = bus
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_time = max_time
+        self.block_size = block_size
+        self.flush_period = flush_period
+        self.files = []             # capture files written
+        self.recorded = 0           # records written
+        self.max_backlog = 0        # max batches waiting for writer thread
+        self._own_reader = reader is None
+        self._reader = reader or ucanReader(bus)
+        self._batches = deque()     # (channel, host ns, raw frames bytes)
+        self._wake = threading.Event()
+        self._file = None
+        self._file_size = 0
+        self._file_start = 0.0
+        self._epoch = (0, 0)        # recording start (wall clock ns since epoch, clock_ns)
+        self._running = False
+        self._thread = None
+
+    def record(self, frames, chan=None):
+        """ Queue a batch of frames (ucanReader consumer: single copy, no formatting)
+        :param frames: tCanMsgStruct ctypes array
+        :param chan: module channel (channel of last read of calling thread if None) """
+        self._batches.append((self.bus.rx_chan.value if chan is None else chan, clock_ns(),
+                              string_at(addressof(frames), len(frames) * _MSG_SIZE)))
+        if len(self._batches) > self.max_backlog:
+            self.max_backlog = len(self._batches)
+        self._wake.set()
+
+    @staticmethod
+    def _records(chan, ns, data):
+        """ :return: records built from a batch (byte columns interleaved by slice assignments, not per frame) """
+        nb = len(data) // _MSG_SIZE
+        out = bytearray(nb * _REC_SIZE)
+        for col in range(_MSG_SIZE):
+            out[col::_REC_SIZE] = data[col::_MSG_SIZE]
+        tail = struct.pack("=Bq", chan, ns)
+        for col, byte in enumerate(bytearray(tail)):
+            out[_MSG_SIZE + col::_REC_SIZE] = bytes(bytearray((byte,))) * nb
+        return out
+
+    def _filename(self):
+        """ :return: next capture file path """
+        if not self.max_bytes and not self.max_time:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return "{}_{:04d}{}".format(root, len(self.files), ext)
+
+    def _open(self, host_ns):
+        """ start a new capture file
+        :param host_ns: file start written in header (clock_ns, wall clock derived from recording start) """
+        name = self._filename()
+        self._file = open(name, "wb")
+        start_ns = self._epoch[0] + host_ns - self._epoch[1]
+        self._file.write(_HEADER.pack(CAPTURE_MAGIC, _CAPTURE_VERSION, _MSG_SIZE, _REC_SIZE, 0, start_ns, host_ns))
+        self._file_size = _HEADER.size
+        self._file_start = _clock()
+        self.files.append(name)
+        logger.info("Capture file %s opened.", name)
+
+    def _write(self, block):
+        """ write records block (rotating files on record boundaries) """
+        view = memoryview(block)
+        while view:
+            if self._file is None:   # recording start for first file, first record time for next ones
+                self._open(self._epoch[1] if not self.files else _first_ns(view))
+            nb = len(view)
+            if self.max_bytes:
+                nb = min(nb, max((self.max_bytes - self._file_size) // _REC_SIZE, 1) * _REC_SIZE)
+            self._file.write(view[:nb])
+            self._file_size += nb
+            self.recorded += nb // _REC_SIZE
+            view = view[nb:]
+            if (self.max_bytes and self._file_size + _REC_SIZE > self.max_bytes) or \
+                    (self.max_time and _clock() - self._file_start >= self.max_time):
+                self._close_file()
+
+    def _close_file(self):
+        """ close current capture file """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        """ writer thread: builds records, writes them by blocks """
+        block = bytearray()
+        last = _clock()
+        last_ns = 0
+        while self._running or self._batches:
+            self._wake.wait(self.flush_period)
+            self._wake.clear()
+            while self._batches:
+                chan, ns, data = self._batches.popleft()
+                last_ns = max(ns, last_ns)  # batches of concurrent readers may be queued out of stamps order
+                block += self._records(chan, last_ns, data)
+                if len(block) >= self.block_size:
+                    self._write(block)
+                    block = bytearray()
+                    last = _clock()
+            if block and (_clock() - last >= self.flush_period or not self._running):
+                self._write(block)
+                block = bytearray()
+                last = _clock()
+            if self._file is not None and self.max_time and _clock() - self._file_start >= self.max_time:
+                self._close_file()
+        self._close_file()
+
+    def start(self):
+        """ Start writer thread (and own reader)
+        :return: ucanRecorder object """
+        if not self._running:
+            self._running = True
+            self._epoch = (_time_ns(), clock_ns())
+            self._reader.subscribe(on_frames=self.record)
+            self._thread = threading.Thread(target=self._run, name="ucanRecorder")
+            self._thread.daemon = True
+            self._thread.start()
+            if self._own_reader:
+                self._reader.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ Stop recording (own reader stopped, queued batches written before writer thread ends)
+        :param timeout: time in s to wait for threads to end """
+        if self._running:
+            if self._own_reader:
+                self._reader.stop(timeout)
+            self._reader.unsubscribe(on_frames=self.record)
+            self._running = False
+            self._wake.set()
+            self._thread.join(timeout)
+
+
+# index file (host cache, native order): magic, version, time index step, capture size, number of records, capture
+# mtime (ns), crc32 of capture header and last record, number of time index entries, number of identifiers;
+# then time index (q), then per identifier key: key, count (q), indexes (I)
+_INDEX_MAGIC = b"UCANIDX\x00"
+_INDEX_VERSION = 2
+_INDEX_HEADER = struct.Struct("=8sHHIqqqIqq")
+_INDEX_ENTRY = struct.Struct("=qq")
+_ID_OFFSET = tCaptureRecord.msg.offset + tCanMsgStruct.dw_id.offset
+_ID_TYPE = {4: "i", 8: "q"}[sizeof(c_long)]    # dw_id is a c_long
+_FF_OFFSET = tCaptureRecord.msg.offset + tCanMsgStruct.b_ff.offset
+_EXT_KEY = 0x80000000   # identifiers index key bit of extended frames (standard and extended ids kept apart)
+
+
+def _id_key(can_id, extended=None):
+    """ :param can_id: CAN identifier
+    :param extended: extended frame identifier (True if can_id does not fit 11 bits when None)
+    :return: identifiers index key """
+    if extended is None:
+        extended = can_id > 0x7FF
+    return can_id | _EXT_KEY if extended else can_id
+
+
+# noinspection PyPep8Naming
+class ucanCaptureReader(object):
+    """ Capture reader: file memory-mapped (copy on write, nothing loaded), records accessed as zero-copy ctypes views.
+    A sparse time index (host ns of one record out of step) and a per identifier record indexes table are built on
+    first opening (single scan by byte columns) and persisted in path.idx (rebuilt when capture size, number of
+    records, modification time or header and last record checksum differ). Standard and extended identifiers are
+    indexed apart. Views are valid while reader is open. """
+    def __init__(self, path, step=1024, index=True):
+        """ reader init
+        :param path: capture file path
+        :param step: number of records between two time index entries
+        :param index: load (or build and persist) indexes """
+        self.path = path
+        self.start_ns, self.host_ns = capture_header(path)     # file start (wall clock ns since epoch, clock_ns)
+        self.step = step
+        self._f = open(path, "rb")
+        stat = os.fstat(self._f.fileno())
+        size = stat.st_size
+        self.size = size
+        self.mtime_ns = getattr(stat, "st_mtime_ns", int(stat.st_mtime * 1000000000))
+        self.nb_rec = (size - _HEADER.size) // _REC_SIZE
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_COPY) if self.nb_rec else None
+        self.times = array("q")     # host ns of records 0, step, 2 * step...
+        self.ids = {}               # identifier key (see select): array of record indexes (ascending)
+        if index and self.nb_rec:
+            if not self._load_index():
+                self.build_index()
+                self.save_index()
+
+    def __len__(self):
+        return self.nb_rec
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """ Release mapping (kept until last view is released when views are still referenced) """
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:     # views still alive: mapping released with them
+                pass
+            self._mm = None
+        self._f.close()
+
+    def to_epoch(self, ns):
+        """ :param ns: record host time (clock_ns)
+        :return: wall clock ns since epoch """
+        return self.start_ns + ns - self.host_ns
+
+    def from_epoch(self, epoch_ns):
+        """ :param epoch_ns: wall clock ns since epoch
+        :return: record host time (clock_ns, see find and select) """
+        return self.host_ns + epoch_ns - self.start_ns
+
+    # ---------- zero-copy access ----------
+    def record(self, idx):
+        """ :param idx: record index
+        :return: tCaptureRecord view """
+        return tCaptureRecord.from_buffer(self._mm, _HEADER.size + idx * _REC_SIZE)
+
+    def records(self, first=0, last=None):
+        """ :param first: first record index
+        :param last: record index after last one (end of capture if None)
+        :return: tCaptureRecord ctypes array view on records [first, last) """
+        last = self.nb_rec if last is None else min(last, self.nb_rec)
+        return (tCaptureRecord * max(last - first, 0)).from_buffer(self._mm, _HEADER.size + first * _REC_SIZE)
+
+    def blocks(self, nb_rec=4096, t1=None, t2=None):
+        """ Iterate over records by slices
+        :param nb_rec: max number of records per slice
+        :param t1: first record host time in ns (capture start if None, see from_epoch)
+        :param t2: record host time in ns ending iteration (excluded, capture end if None)
+        :return: tCaptureRecord ctypes array views """
+        first, last = self.span(t1, t2)
+        for idx in range(first, last, nb_rec):
+            yield self.records(idx, min(idx + nb_rec, last))
+
+    def span(self, t1=None, t2=None):
+        """ :param t1: first record host time in ns (capture start if None, see from_epoch)
+        :param t2: record host time in ns (excluded, capture end if None)
+        :return: (first, last) record indexes of time range """
+        return (0 if t1 is None else self.find(t1)), (self.nb_rec if t2 is None else self.find(t2))
+
+    def find(self, ns):
+        """ :param ns: record host time in ns (see from_epoch)
+        :return: index of first record at or after ns (sparse index bisection, then bisection of one step: records
+        stamps never decrease, monotonic clock and writer order) """
+        if not self.nb_rec:
+            return 0
+        if not self.times:
+            self.build_index(ids=False)
+        block = max(bisect_left(self.times, ns) - 1, 0)
+        first = block * self.step
+        last = min(first + 2 * self.step, self.nb_rec)
+        return first + bisect_left(self._column(first, last - first, _NS_OFFSET, "q"), ns)
+
+    def select(self, can_id, t1=None, t2=None, extended=None):
+        """ Records of an identifier within a time range
+        :param can_id: CAN identifier
+        :param t1: first record host time in ns (capture start if None, see from_epoch)
+        :param t2: record host time in ns (excluded, capture end if None)
+        :param extended: extended frames identifier (True if can_id does not fit 11 bits when None)
+        :return: memoryview on record indexes (zero-copy slice of identifier index, see record) """
+        indexes = self.ids.get(_id_key(can_id, extended))
+        if indexes is None:
+            return memoryview(array("I"))
+        first, last = self.span(t1, t2)
+        return memoryview(indexes)[bisect_left(indexes, first):bisect_left(indexes, last)]
+
+    def frames(self, can_id, t1=None, t2=None, extended=None):
+        """ Iterate over records of an identifier within a time range (see select)
+        :return: tCaptureRecord views """
+        for idx in self.select(can_id, t1, t2, extended):
+            yield self.record(idx)
+
+    # ---------- indexes ----------
+    def _column(self, first, nb, offset, typecode):
+        """ :return: array of one field of records [first, first + nb) (extracted by byte columns) """
+        col = array(typecode)
+        size = col.itemsize
+        start = _HEADER.size + first * _REC_SIZE
+        data = self._mm[start + offset:start + nb * _REC_SIZE]
+        out = bytearray(nb * size)
+        for byte in range(size):
+            out[byte::size] = data[byte::_REC_SIZE]
+        col.frombytes(bytes(out))
+        return col
+
+    def build_index(self, ids=True, chunk=1 << 16):
+        """ Build time index (and identifiers index) with a single scan
+        :param ids: build identifiers index too
+        :param chunk: number of records extracted at once """
+        self.times = array("q")
+        table = {}
+        for first in range(0, self.nb_rec, chunk):
+            nb = min(chunk, self.nb_rec - first)
+            stamps = self._column(first, nb, _NS_OFFSET, "q")
+            self.times.extend(stamps[(-first) % self.step::self.step])
+            if ids:
+                columns = zip(self._column(first, nb, _ID_OFFSET, _ID_TYPE), self._column(first, nb, _FF_OFFSET, "B"))
+                for idx, (can_id, ff) in enumerate(columns, first):
+                    key = can_id | _EXT_KEY if ff & USBCAN_MSG_FF_EXT else can_id
+                    entry = table.get(key)
+                    if entry is None:
+                        entry = table[key] = array("I")
+                    entry.append(idx)
+        if ids:
+            self.ids = table
+
+    def _index_path(self):
+        return self.path + ".idx"
+
+    def _checksum(self):
+        """ :return: crc32 of capture header and last record """
+        last = _HEADER.size + (self.nb_rec - 1) * _REC_SIZE
+        return zlib.crc32(self._mm[last:last + _REC_SIZE], zlib.crc32(self._mm[:_HEADER.size])) & 0xFFFFFFFF
+
+    def save_index(self):
+        """ Persist indexes next to capture file (path.idx) """
+        with open(self._index_path(), "wb") as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, 0, self.step, self.size, self.nb_rec,
+                                       self.mtime_ns, self._checksum(), len(self.times), len(self.ids)))
+            self.times.tofile(f)
+            for key, indexes in self.ids.items():
+                f.write(_INDEX_ENTRY.pack(key, len(indexes)))
+                indexes.tofile(f)
+
+    def _load_index(self):
+        """ :return: True if persisted indexes match capture file (and were loaded) """
+        try:
+            with open(self._index_path(), "rb") as f:
+                magic, version, _, step, size, nb_rec, mtime_ns, crc, nb_times, nb_ids = _INDEX_HEADER.unpack(
+                    f.read(_INDEX_HEADER.size))
+                if magic != _INDEX_MAGIC or version != _INDEX_VERSION or (step, size, nb_rec, mtime_ns, crc) != \
+                        (self.step, self.size, self.nb_rec, self.mtime_ns, self._checksum()):
+                    return False
+                self.times = array("q")
+                self.times.fromfile(f, nb_times)
+                self.ids = {}
+                for _ in range(nb_ids):
+                    key, count = _INDEX_ENTRY.unpack(f.read(_INDEX_ENTRY.size))
+                    indexes = self.ids[key] = array("I")
+                    indexes.fromfile(f, count)
+            return True
+        except (IOError, OSError, EOFError, struct.error):
+            return False
@@ -0,0 +1,120 @@
+# -*- coding:utf-8 -*-
+"""
+ucanClock.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN device clock model (32 bits ms counter unwrapped to 64 bits, linear device to host time mapping)
+"""
+
+import time
+from array import array
+from collections import deque
+
+__all__ = ['clock_ns', 'ucanClockModel']
+
+# host reference clock for all adapters (monotonic, ns)
+clock_ns = getattr(time, "perf_counter_ns", lambda: int(time.perf_counter() * 1000000000))
+
+_WRAP = 0x100000000
+_HALF = 0x80000000
+_NS_PER_MS = 1000000
+
+
+# noinspection PyPep8Naming
+class ucanClockModel(object):
+    """ Device clock model of one adapter: dw_time (32 bits ms counter) unwrapped to 64 bits, then mapped to host
+    clock_ns with a line fitted on the lower envelope of (device time, host read time) samples: only the least delayed
+    sample of each bucket of device time is kept (USB and scheduling delays only ever add), so the fit follows device
+    clock drift without being biased by read latency. Adapters mapped by their own model share the host timeline. """
+    def __init__(self, bucket=1000, buckets=60):
+        """ model init
+        :param bucket: device time in ms covered by each envelope sample
+        :param buckets: number of envelope samples fitted (sliding window of bucket * buckets ms) """
+        self.bucket = bucket
+        self.buckets = buckets
+        self.reset()
+
+    def reset(self):
+        """ Forget device clock (module reopened: device counter restarted) """
+        self.last_ms = None         # last (highest) unwrapped device time seen
+        self.rate = float(_NS_PER_MS)   # host ns per device ms
+        self.offset = None          # host ns at device time 0
+        self.samples = 0
+        self._envelope = deque()    # [bucket index, device ms, host ns - nominal device ns] least delayed samples
+
+    @property
+    def ready(self):
+        """ :return: True once device time can be mapped to host time """
+        return self.offset is not None
+
+    def unwrap(self, dw_time):
+        """ :param dw_time: 32 bits device time in ms
+        :return: 64 bits device time in ms (closest to last device time seen) """
+        ref = self.last_ms
+        if ref is None:
+            return dw_time
+        value = (ref - (ref % _WRAP)) + dw_time
+        if value - ref > _HALF:
+            value -= _WRAP
+        elif ref - value > _HALF:
+            value += _WRAP
+        return value
+
+    def update(self, dw_time, host_ns):
+        """ Add a sample (device time of last frame read, host time right after read)
+        :param dw_time: 32 bits device time in ms
+        :param host_ns: host time in ns (clock_ns)
+        :return: 64 bits device time in ms """
+        ms = self.unwrap(dw_time)
+        if self.last_ms is None or ms > self.last_ms:
+            self.last_ms = ms
+        self.samples += 1
+        index = ms // self.bucket
+        delay = host_ns - ms * _NS_PER_MS
+        envelope = self._envelope
+        if envelope and envelope[-1][0] == index:
+            if delay >= envelope[-1][2]:
+                return ms
+            envelope[-1] = [index, ms, delay]
+        elif envelope and index < envelope[-1][0]:
+            return ms   # late sample from an older bucket
+        else:
+            envelope.append([index, ms, delay])
+            while len(envelope) > self.buckets:
+                envelope.popleft()
+        self._fit()
+        return ms
+
+    def _fit(self):
+        """ least squares line through envelope samples (relative to first one for precision) """
+        envelope = self._envelope
+        ms0, delay0 = envelope[0][1], envelope[0][2]
+        if len(envelope) < 2:
+            self.rate = float(_NS_PER_MS)
+            self.offset = delay0
+            return
+        xs = [ms - ms0 for _, ms, _ in envelope]
+        ys = [delay - delay0 for _, _, delay in envelope]
+        nb = float(len(xs))
+        mx, my = sum(xs) / nb, sum(ys) / nb
+        sxx = sum((x - mx) * (x - mx) for x in xs)
+        slope = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx if sxx else 0.0
+        self.rate = _NS_PER_MS + slope
+        # host = delay0 + my + slope * (ms - ms0 - mx) + ms * 1e6
+        self.offset = delay0 + my - slope * (ms0 + mx)
+
+    def to_host(self, ms):
+        """ :param ms: 64 bits device time in ms (fractional allowed)
+        :return: host time estimate in ns (clock_ns timeline) """
+        return int(self.offset + self.rate * ms)
+
+    def stamp(self, frames):
+        """ Timestamps of a batch of frames (device counter truncates to the ms: frames stamped at tick middle)
+        :param frames: sequence of tCanMsgStruct
+        :return: (array of 64 bits device times in ms, array of host times in ns) """
+        unwrap = self.unwrap
+        device = array("q", [unwrap(frame.dw_time) for frame in frames])
+        if not self.ready:
+            return device, array("q", [0] * len(device))
+        offset, rate = self.offset + self.rate * 0.5, self.rate
+        return device, array("q", [int(offset + rate * ms) for ms in device])
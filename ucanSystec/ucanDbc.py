@@ -0,0 +1,350 @@
+# -*- coding:utf-8 -*-
+"""
+ucanDbc.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN DBC signals decoding/encoding (per identifier compiled decoders, numpy batch mode)
+"""
+
+import re
+import struct
+import logging
+from ctypes import addressof, memmove, string_at
+
+from .ucanSystec import tCanMsgStruct, _CAN_DATA_OFFSET
+from .ucanFilter import USBCAN_MSG_FF_STD, USBCAN_MSG_FF_EXT
+from .ucanCapture import _id_key, _EXT_KEY
+
+__all__ = ['DbcSignal', 'DbcMessage', 'ucanDbc']
+
+logger = logging.getLogger(__name__)
+
+_LE = struct.Struct("<Q")
+_BE = struct.Struct(">Q")
+
+_DBC_EXT_FLAG = 0x80000000      # extended identifier flag in DBC message identifiers
+
+_RE_MSG = re.compile(r"^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)\s+(\w+)")
+_RE_SIG = re.compile(r"^SG_\s+(\w+)\s*(M|m\d+M?)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*\(\s*([^,]+),\s*([^)]+)\)\s*"
+                     r"\[\s*([^|]*)\|\s*([^\]]*)\]\s*\"([^\"]*)\"\s*(.*)$")
+_RE_VAL = re.compile(r"^VAL_\s+(\d+)\s+(\w+)\s+(.*);")
+_RE_CHOICE = re.compile(r"(-?\d+)\s+\"([^\"]*)\"")
+
+
+def _number(text):
+    """ :return: int if text is an integer literal, float otherwise """
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+class DbcSignal(object):
+    """ DBC signal definition (with its position in the 64 bits payload word of its byte order) """
+    def __init__(self, name, start, length, little_endian=True, signed=False, factor=1, offset=0,
+                 minimum=0, maximum=0, unit="", mux=None, receivers=()):
+        """ signal init
+        :param name: signal name
+        :param start: DBC start bit (lsb for little endian, msb in DBC sawtooth numbering for big endian)
+        :param length: length in bits
+        :param little_endian: Intel byte order (Motorola if False)
+        :param signed: two's complement raw value
+        :param factor: physical value = raw * factor + offset
+        :param offset: physical value offset
+        :param minimum: physical minimum
+        :param maximum: physical maximum
+        :param unit: physical unit
+        :param mux: None for plain signals, "M" for the multiplexer, multiplexer value for multiplexed signals
+        :param receivers: receiving nodes """
+        self.name = name
+        self.start = start
+        self.length = length
+        self.little_endian = little_endian
+        self.signed = signed
+        self.factor = factor
+        self.offset = offset
+        self.minimum = minimum
+        self.maximum = maximum
+        self.unit = unit
+        self.mux = mux
+        self.receivers = tuple(receivers)
+        self.choices = {}   # raw value: description (VAL_)
+        self.mask = (1 << length) - 1
+        if little_endian:
+            self.shift = start
+        else:   # msb position counted from payload first bit (big endian word), then lsb shift
+            self.shift = 63 - ((start // 8) * 8 + (7 - start % 8) + length - 1)
+        if self.shift < 0 or self.shift + length > 64:
+            raise ValueError("Signal {} does not fit in 8 bytes payload".format(name))
+
+    @property
+    def scaled(self):
+        """ :return: True if raw value is transformed (factor or offset) """
+        return self.factor != 1 or self.offset != 0
+
+    def __repr__(self):
+        return "DbcSignal({!r}, {}|{}@{}{} ({},{}) {!r})".format(self.name, self.start, self.length,
+                                                                 int(self.little_endian), "-" if self.signed else "+",
+                                                                 self.factor, self.offset, self.unit)
+
+
+class DbcMessage(object):
+    """ DBC message definition, decode and encode compiled from its signals """
+    def __init__(self, can_id, name, dlc=8, sender="", extended=False, signals=()):
+        """ message init
+        :param can_id: CAN identifier (dw_id, without DBC extended flag)
+        :param name: message name
+        :param dlc: data length code
+        :param sender: sending node
+        :param extended: 29 bits identifier
+        :param signals: DbcSignal sequence """
+        self.can_id = can_id
+        self.name = name
+        self.dlc = dlc
+        self.sender = sender
+        self.extended = extended
+        self.signals = list(signals)
+        self.decode = None      # payload (8 bytes) -> dict of physical values
+        self.encode = None      # dict of physical values -> payload (8 bytes)
+        self.compile()
+
+    @property
+    def multiplexer(self):
+        """ :return: multiplexer DbcSignal (None if message is not multiplexed) """
+        for sig in self.signals:
+            if sig.mux == "M":
+                return sig
+        return None
+
+    def compile(self):
+        """ Generate decode and encode functions (straight line code: no loop over signals at run time) """
+        namespace = {"_le": _LE.unpack, "_be": _BE.unpack, "_ple": _LE.pack, "_pbe": _BE.pack}
+        exec(self._decoder_source(), namespace)
+        exec(self._encoder_source(), namespace)
+        self.decode = namespace["decode"]
+        self.encode = namespace["encode"]
+
+    @staticmethod
+    def _extract(sig):
+        """ :return: expression of signal physical value from le/be words """
+        expr = "(({} >> {}) & {:#x})".format("le" if sig.little_endian else "be", sig.shift, sig.mask)
+        if sig.signed:
+            expr = "_s({}, {:#x}, {:#x})".format(expr, 1 << (sig.length - 1), 1 << sig.length)
+        if sig.scaled:
+            expr = "{} * {!r} + {!r}".format(expr, sig.factor, sig.offset)
+        return expr
+
+    def _decoder_source(self):
+        """ :return: decode function source """
+        words = set(sig.little_endian for sig in self.signals)
+        lines = ["def _s(raw, sign, span):", "    return raw - span if raw & sign else raw",
+                 "def decode(data):"]
+        if True in words:
+            lines.append("    le = _le(data)[0]")
+        if False in words:
+            lines.append("    be = _be(data)[0]")
+        plain = [sig for sig in self.signals if not isinstance(sig.mux, int)]
+        lines.append("    out = {" + ", ".join("{!r}: {}".format(sig.name, self._extract(sig)) for sig in plain) + "}")
+        mux = self.multiplexer
+        if mux is not None:
+            cases = sorted(set(sig.mux for sig in self.signals if isinstance(sig.mux, int)))
+            lines.append("    mux = out[{!r}]".format(mux.name))
+            for idx, case in enumerate(cases):
+                lines.append("    {} mux == {}:".format("if" if not idx else "elif", case))
+                for sig in self.signals:
+                    if sig.mux == case:
+                        lines.append("        out[{!r}] = {}".format(sig.name, self._extract(sig)))
+        lines.append("    return out")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _insert(sig, indent):
+        """ :return: statements merging signal raw value into le/be words """
+        raw = "values.get({!r}, {!r})".format(sig.name, sig.offset)
+        if sig.scaled:
+            raw = "int(round(({} - {!r}) / {!r}))".format(raw, sig.offset, sig.factor)
+        else:
+            raw = "int({})".format(raw)
+        word = "le" if sig.little_endian else "be"
+        return ["{}{} |= ({} & {:#x}) << {}".format(indent, word, raw, sig.mask, sig.shift)]
+
+    def _encoder_source(self):
+        """ :return: encode function source """
+        lines = ["def encode(values):", "    le = be = 0"]
+        mux = self.multiplexer
+        for sig in self.signals:
+            if not isinstance(sig.mux, int):
+                lines.extend(self._insert(sig, "    "))
+        if mux is not None:
+            cases = sorted(set(sig.mux for sig in self.signals if isinstance(sig.mux, int)))
+            lines.append("    mux = int(values.get({!r}, 0))".format(mux.name))
+            for idx, case in enumerate(cases):
+                lines.append("    {} mux == {}:".format("if" if not idx else "elif", case))
+                lines.extend(line for sig in self.signals if sig.mux == case for line in self._insert(sig, "        "))
+        lines.append("    return _ple(le | _le(_pbe(be))[0])")
+        return "\n".join(lines) + "\n"
+
+    def to_struct(self, values, msg=None):
+        """ Encode a frame ready for can_send_msg / send_many
+        :param values: dict of physical values (missing signals encoded as their offset, i.e. raw 0)
+        :param msg: tCanMsgStruct to fill (new one if None)
+        :return: tCanMsgStruct """
+        msg = tCanMsgStruct() if msg is None else msg
+        msg.dw_id = self.can_id
+        msg.b_ff = USBCAN_MSG_FF_EXT if self.extended else USBCAN_MSG_FF_STD
+        msg.b_dlc = self.dlc
+        memmove(addressof(msg) + _CAN_DATA_OFFSET, self.encode(values), 8)
+        return msg
+
+    def __repr__(self):
+        return "DbcMessage({:#x}, {!r}, {} signals)".format(self.can_id, self.name, len(self.signals))
+
+
+# noinspection PyPep8Naming
+class ucanDbc(object):
+    """ DBC database: messages keyed by identifier key (dw_id, extended flag bit set for 29 bits identifiers as in DBC
+    files) with compiled decoders, decoding restricted to subscribed identifiers.
+    Only classic CAN (8 bytes) and simple multiplexing (one multiplexer per message) are handled. """
+    def __init__(self, path=None, text=None, encoding="latin-1"):
+        """ database init
+        :param path: DBC file path
+        :param text: DBC content (instead of path)
+        :param encoding: DBC file encoding """
+        self.messages = {}      # identifier key: DbcMessage
+        self.names = {}         # message name: DbcMessage
+        self.decoders = {}      # identifier key: decode function of subscribed messages
+        if path is not None:
+            with open(path, "rb") as f:
+                text = f.read().decode(encoding)
+        if text is not None:
+            self.parse(text)
+
+    def parse(self, text):
+        """ Add messages of a DBC content (all messages subscribed)
+        :param text: DBC content
+        :return: ucanDbc object """
+        msg = None
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith("BO_ "):
+                match = _RE_MSG.match(line)
+                if match:
+                    dbc_id = int(match.group(1))
+                    msg = DbcMessage(dbc_id & ~_DBC_EXT_FLAG, match.group(2), int(match.group(3)), match.group(4),
+                                     bool(dbc_id & _DBC_EXT_FLAG))
+                    self.messages[_id_key(msg.can_id, msg.extended)] = msg
+                    self.names[msg.name] = msg
+            elif line.startswith("SG_ ") and msg is not None:
+                match = _RE_SIG.match(line)
+                if not match:
+                    logger.warning("Message %s: signal not supported (ignored): %s", msg.name, line)
+                elif match.group(2) not in (None, "M") and match.group(2).endswith("M"):    # m<value>M
+                    logger.warning("Message %s: signal %s uses extended multiplexing, not supported (ignored).",
+                                   msg.name, match.group(1))
+                else:
+                    name, mux, start, length, order, sign, factor, offset, mini, maxi, unit, receivers = match.groups()
+                    if mux:
+                        mux = "M" if mux == "M" else int(mux[1:])
+                    msg.signals.append(DbcSignal(name, int(start), int(length), order == "1", sign == "-",
+                                                 _number(factor), _number(offset), _number(mini or "0"),
+                                                 _number(maxi or "0"), unit, mux, receivers.replace(",", " ").split()))
+            elif line.startswith("VAL_ "):
+                match = _RE_VAL.match(line)
+                target = self.messages.get(int(match.group(1))) if match else None    # DBC id is identifier key
+                for sig in target.signals if target else ():
+                    if sig.name == match.group(2):
+                        sig.choices = dict((int(raw), desc) for raw, desc in _RE_CHOICE.findall(match.group(3)))
+            elif not line.startswith("SG_"):
+                msg = None  # end of message block
+        for msg in self.messages.values():
+            msg.compile()
+        return self.subscribe()
+
+    def message(self, key, extended=None):
+        """ :param key: CAN identifier (or identifier key) or message name
+        :param extended: 29 bits identifier (standard message first, then extended one if None)
+        :return: DbcMessage """
+        if key in self.names:
+            return self.names[key]
+        if extended is None:
+            return self.messages[key] if key in self.messages else self.messages[key | _EXT_KEY]
+        return self.messages[_id_key(key, extended)]
+
+    def subscribe(self, *keys):
+        """ Restrict decoding to some messages
+        :param keys: CAN identifiers (or identifier keys) or message names (all messages if none given)
+        :return: ucanDbc object """
+        msgs = [self.message(key) for key in keys] if keys else self.messages.values()
+        self.decoders = dict((_id_key(msg.can_id, msg.extended), msg.decode) for msg in msgs)
+        return self
+
+    def decode(self, frame):
+        """ Decode a frame
+        :param frame: tCanMsgStruct
+        :return: dict of physical values (None if identifier is not subscribed) """
+        decoder = self.decoders.get(frame.dw_id | _EXT_KEY if frame.b_ff & USBCAN_MSG_FF_EXT else frame.dw_id)
+        if decoder is None:
+            return None
+        return decoder(string_at(addressof(frame) + _CAN_DATA_OFFSET, 8))
+
+    def decode_frames(self, frames):
+        """ Decode subscribed frames of a batch (e.g. ucanSystec.rx_frames)
+        :param frames: tCanMsgStruct sequence
+        :return: list of (frame index, dw_id, dict of physical values) """
+        decoders = self.decoders
+        out = []
+        for idx, frame in enumerate(frames):
+            decoder = decoders.get(frame.dw_id | _EXT_KEY if frame.b_ff & USBCAN_MSG_FF_EXT else frame.dw_id)
+            if decoder is not None:
+                out.append((idx, frame.dw_id, decoder(string_at(addressof(frame) + _CAN_DATA_OFFSET, 8))))
+        return out
+
+    def wrap(self, on_values):
+        """ :param on_values: function called with a list of (frame index, dw_id, values) per batch
+        :return: frames consumer (e.g. ucanReader consumer) """
+        def decoded(frames):
+            """ decoding consumer """
+            values = self.decode_frames(frames)
+            if values:
+                on_values(values)
+        return decoded
+
+    def encode(self, key, values, extended=None):
+        """ Encode a frame (ready for can_send_msg / send_many)
+        :param key: CAN identifier (or identifier key) or message name
+        :param values: dict of physical values
+        :param extended: 29 bits identifier (see message)
+        :return: tCanMsgStruct """
+        return self.message(key, extended).to_struct(values)
+
+    def decode_array(self, array, key=None):
+        """ Decode a structured array of frames column-wise (requires numpy, see ucanNumpy)
+        :param array: numpy array of can_msg_dtype
+        :param key: CAN identifier (or identifier key) or message name (all subscribed identifiers present in array
+        if None)
+        :return: dict of signal name: numpy array (rows of key frames, NaN where multiplexer value differs),
+        or dict of identifier key: such dict when key is None """
+        import numpy as np
+        from .ucanNumpy import payload_view
+        extended = (array['b_ff'] & USBCAN_MSG_FF_EXT) != 0
+        if key is None:
+            present = np.unique(array['dw_id'].astype(np.uint32) | np.where(extended, _EXT_KEY, 0).astype(np.uint32))
+            return dict((int(id_key), self.decode_array(array, int(id_key)))
+                        for id_key in present if int(id_key) in self.decoders)
+        msg = self.message(key)
+        payload = np.ascontiguousarray(payload_view(array[(array['dw_id'] == msg.can_id) & (extended == msg.extended)]))
+        words = {True: payload.view("<u8").ravel(), False: payload.view(">u8").ravel().astype(np.uint64)}
+        columns = {}
+        for sig in msg.signals:
+            raw = (words[sig.little_endian] >> np.uint64(sig.shift)) & np.uint64(sig.mask)
+            if sig.signed:
+                raw = raw.astype(np.int64)
+                raw = np.where(raw & (1 << (sig.length - 1)), raw - (1 << sig.length), raw) if sig.length < 64 \
+                    else raw
+            columns[sig.name] = raw * sig.factor + sig.offset if sig.scaled else raw
+        mux = msg.multiplexer
+        if mux is not None:
+            for sig in msg.signals:
+                if isinstance(sig.mux, int):
+                    columns[sig.name] = np.where(columns[mux.name] == sig.mux, columns[sig.name], np.nan)
+        return columns
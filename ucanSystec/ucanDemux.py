@@ -0,0 +1,82 @@
+# -*- coding:utf-8 -*-
+"""
+ucanDemux.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN multi-channel demultiplexing reader
+"""
+
+import logging
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue   # python 2
+
+from .ucanSystec import ucanReader, tCanMsgStruct
+
+__all__ = ['ucanDemuxReader']
+
+logger = logging.getLogger(__name__)
+
+
+# noinspection PyPep8Naming
+class ucanDemuxReader(ucanReader):
+    """ Single reader draining all channels of a module (chan=255 batched reads) into per channel consumers
+    Each dll read returns frames of one channel, given back by the dll through the channel pointer (bus.rx_chan). """
+    def __init__(self, bus, nb_msg=0, queue_size=0, on_status=None):
+        """ reader init
+        :param bus: ucanSystec instance
+        :param nb_msg: max number of messages per dll read (whole bus rx_buffer if set to 0)
+        :param queue_size: max number of batches per channel queue (oldest batches dropped when full, 0 for unbounded)
+        :param on_status: function called with module status (tStatusStruct) on status events """
+        ucanReader.__init__(self, bus, 255, nb_msg, on_frames=self._demux, on_status=on_status)
+        self.queue_size = queue_size
+        self.queues = {}        # channel: queue of batches (tCanMsgStruct ctypes arrays)
+        self.dropped = {}       # channel: number of batches dropped
+        self.unclaimed = {}     # channel: number of frames read without queue nor consumer (discarded)
+        self._chan_cb = {}      # channel: list of functions
+
+    def queue(self, chan):
+        """ Get (created on first call) the queue of received batches of a channel
+        :param chan: module channel
+        :return: queue.Queue of tCanMsgStruct ctypes arrays (copies) """
+        if chan not in self.queues:
+            self.dropped[chan] = 0
+            self.queues[chan] = queue.Queue(self.queue_size)
+        return self.queues[chan]
+
+    def subscribe_chan(self, chan, on_frames):
+        """ Add consumer of a channel frames batches
+        :param chan: module channel
+        :param on_frames: function called with each batch of frames of channel (view valid until function returns) """
+        self._chan_cb[chan] = self._chan_cb.get(chan, []) + [on_frames]
+
+    def _demux(self, frames):
+        """ dispatch batch to consumers of the channel it was read from """
+        chan = self.bus.rx_chan.value
+        consumers = self._chan_cb.get(chan, ())
+        for fct in consumers:
+            try:
+                fct(frames)
+            except Exception:
+                logger.exception("Channel %d frames consumer %r failed.", chan, fct)
+        chan_queue = self.queues.get(chan)
+        if chan_queue is None:
+            if not consumers:
+                if chan not in self.unclaimed:
+                    self.unclaimed[chan] = 0
+                    logger.warning("Channel %d frames discarded: no queue nor consumer (see unclaimed).", chan)
+                self.unclaimed[chan] += len(frames)
+        else:
+            batch = (tCanMsgStruct * len(frames)).from_buffer_copy(frames)
+            while True:
+                try:
+                    chan_queue.put_nowait(batch)
+                    break
+                except queue.Full:
+                    try:
+                        chan_queue.get_nowait()
+                        self.dropped[chan] += 1
+                    except queue.Empty:
+                        pass
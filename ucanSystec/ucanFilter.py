@@ -0,0 +1,187 @@
+# -*- coding:utf-8 -*-
+"""
+ucanFilter.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN acceptance filter compiler (SJA1000 AMR/ACR single filter) with exact software second stage
+"""
+
+from bisect import bisect_right
+
+__all__ = ['USBCAN_MSG_FF_STD', 'USBCAN_MSG_FF_EXT', 'USBCAN_MSG_FF_RTR', 'USBCAN_AMR_ALL', 'USBCAN_ACR_ALL',
+           'ucanFilter']
+
+USBCAN_MSG_FF_STD = 0x00    # standard CAN frame (11 bits identifier)
+USBCAN_MSG_FF_EXT = 0x80    # extended CAN frame (29 bits identifier)
+USBCAN_MSG_FF_RTR = 0x40    # remote transmission request frame
+
+USBCAN_AMR_ALL = 0xFFFFFFFF     # AMR for mode "receive all CAN messages"
+USBCAN_ACR_ALL = 0x00000000     # ACR for mode "receive all CAN messages"
+
+_STD_SHIFT, _STD_BITS = 21, 11  # ACR0/ACR1 bits 31..21: ID10..ID0 (RTR and data bytes bits left don't care)
+_EXT_SHIFT, _EXT_BITS = 3, 29   # ACR0..ACR3 bits 31..3: ID28..ID0 (RTR bit left don't care)
+
+
+def _merge(ranges):
+    """ :return: sorted list of merged (low, high) inclusive ranges """
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def _cover(ranges, bits):
+    """ :return: (code, care mask) of the tightest bit pattern covering all ranges of bits wide identifiers """
+    full = (1 << bits) - 1
+    code, care = None, full
+    for low, high in ranges:
+        prefix = full
+        while (low & prefix) != (high & prefix):    # common prefix of range bounds
+            prefix = (prefix << 1) & full
+        if code is None:
+            code, care = low & prefix, prefix
+        else:
+            care &= prefix & ~(code ^ low)
+            code &= care
+    return (code or 0) & care, care
+
+
+def _count(care, bits):
+    """ :return: number of identifiers matched by a care mask """
+    return 1 << (bits - bin(care & ((1 << bits) - 1)).count("1"))
+
+
+# noinspection PyPep8Naming
+class ucanFilter(object):
+    """ Acceptance filter: tightest hardware AMR/ACR pair for a set of identifiers, exact software second stage """
+    def __init__(self, ids=(), ranges=(), ext_ids=(), ext_ranges=()):
+        """ filter init
+        :param ids: standard identifiers
+        :param ranges: standard identifiers inclusive ranges ((low, high), ...)
+        :param ext_ids: extended identifiers
+        :param ext_ranges: extended identifiers inclusive ranges ((low, high), ...) """
+        self.std = _merge([(i & 0x7FF, i & 0x7FF) for i in ids] + [(lo & 0x7FF, hi & 0x7FF) for lo, hi in ranges])
+        self.ext = _merge([(i & 0x1FFFFFFF, i & 0x1FFFFFFF) for i in ext_ids] +
+                          [(lo & 0x1FFFFFFF, hi & 0x1FFFFFFF) for lo, hi in ext_ranges])
+
+        # software stage: bitmap for standard identifiers, bisect on merged ranges for extended ones
+        self._std_map = bytearray(0x800)
+        for low, high in self.std:
+            self._std_map[low:high + 1] = b"\x01" * (high - low + 1)
+        self._ext_low = [low for low, _ in self.ext]
+        self._ext_high = [high for _, high in self.ext]
+        self._all = not self.std and not self.ext     # no identifier given: receive all CAN messages
+
+        self.amr, self.acr = self._compile()
+
+    def _compile(self):
+        """ :return: (AMR, ACR) tightest hardware filter (AMR bit set: don't care) """
+        if self._all:
+            return USBCAN_AMR_ALL, USBCAN_ACR_ALL
+        patterns = []   # (code, care) in 32 bits register space
+        if self.std:
+            code, care = _cover(self.std, _STD_BITS)
+            patterns.append((code << _STD_SHIFT, care << _STD_SHIFT))
+        if self.ext:
+            code, care = _cover(self.ext, _EXT_BITS)
+            patterns.append((code << _EXT_SHIFT, care << _EXT_SHIFT))
+        code, care = patterns[0]
+        for pat_code, pat_care in patterns[1:]:     # standard and extended mixed: both share the registers
+            care &= pat_care & ~(code ^ pat_code)
+            code &= care
+        return ~care & 0xFFFFFFFF, code & care
+
+    @property
+    def hw_std_accepted(self):
+        """ :return: number of standard identifiers passing the hardware filter """
+        return _count(~self.amr >> _STD_SHIFT, _STD_BITS)
+
+    @property
+    def hw_ext_accepted(self):
+        """ :return: number of extended identifiers passing the hardware filter """
+        return _count(~self.amr >> _EXT_SHIFT, _EXT_BITS)
+
+    @property
+    def wanted(self):
+        """ :return: (standard, extended) numbers of wanted identifiers """
+        return sum(hi - lo + 1 for lo, hi in self.std), sum(hi - lo + 1 for lo, hi in self.ext)
+
+    def fp_ratio_std(self):
+        """ :return: ratio of standard identifiers passing the hardware filter that are not wanted """
+        accepted = self.hw_std_accepted
+        return float(accepted - self.wanted[0]) / accepted
+
+    def fp_ratio_ext(self):
+        """ :return: ratio of extended identifiers passing the hardware filter that are not wanted """
+        accepted = self.hw_ext_accepted
+        return float(accepted - self.wanted[1]) / accepted
+
+    def fp_ratio(self):
+        """ :return: ratio of identifiers passing the hardware filter that are not wanted
+                     (over frame types having wanted identifiers) """
+        if self._all:
+            return 0.0
+        std, ext = self.wanted
+        accepted = (self.hw_std_accepted if std or not ext else 0) + (self.hw_ext_accepted if ext else 0)
+        return float(accepted - std - ext) / accepted
+
+    def estimate(self, id_counts):
+        """ Estimate traffic reduction from an observed traffic sample
+        :param id_counts: dict of frames counts keyed by (identifier, extended) from a bus capture
+        :return: dict of "hw_pass" (ratio of frames crossing USB) and "sw_pass" (ratio of frames kept) """
+        total = float(sum(id_counts.values())) or 1.0
+        hw = sum(nb for (can_id, ext), nb in id_counts.items() if self.hw_match(can_id, ext))
+        sw = sum(nb for (can_id, ext), nb in id_counts.items() if self.match(can_id, ext))
+        return {"hw_pass": hw / total, "sw_pass": sw / total}
+
+    def hw_match(self, can_id, ext=False):
+        """ :return: True if identifier passes the hardware filter """
+        reg = (can_id << _EXT_SHIFT) if ext else (can_id << _STD_SHIFT)
+        return not ((reg ^ self.acr) & ~self.amr & (0xFFFFFFF8 if ext else 0xFFE00000))
+
+    def match(self, can_id, ext=False):
+        """ :return: True if identifier is wanted (exact software filter) """
+        if self._all:
+            return True
+        if not ext:
+            return self._std_map[can_id & 0x7FF] == 1
+        idx = bisect_right(self._ext_low, can_id) - 1
+        return idx >= 0 and can_id <= self._ext_high[idx]
+
+    def match_frame(self, frame):
+        """ :param frame: tCanMsgStruct
+        :return: True if frame is wanted (exact software filter) """
+        return self.match(frame.dw_id, frame.b_ff & USBCAN_MSG_FF_EXT)
+
+    def filter(self, frames):
+        """ Drop hardware filter false positives
+        :param frames: tCanMsgStruct sequence
+        :return: list of wanted frames """
+        if self._all:
+            return list(frames)
+        std_map, ext_flag, match = self._std_map, USBCAN_MSG_FF_EXT, self.match
+        return [frame for frame in frames
+                if (match(frame.dw_id, True) if frame.b_ff & ext_flag else std_map[frame.dw_id & 0x7FF])]
+
+    def wrap(self, on_frames):
+        """ :param on_frames: frames consumer (e.g. ucanReader consumer)
+        :return: consumer called with wanted frames only """
+        def filtered(frames):
+            """ software second stage consumer """
+            kept = self.filter(frames)
+            if kept:
+                on_frames(kept)
+        return filtered
+
+    def apply(self, bus, chan=0):
+        """ Apply hardware filter to a channel (through can_init_can)
+        :param bus: ucanSystec instance
+        :param chan: module channel
+        :return: ucanSystec object """
+        return bus.can_set_acceptance(self.amr, self.acr, chan)
+
+    def __str__(self):
+        return "AMR {:#010x}  ACR {:#010x}  false positives {:.2%}".format(self.amr, self.acr, self.fp_ratio())
@@ -0,0 +1,184 @@
+# -*- coding:utf-8 -*-
+"""
+ucanHotplug.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN hot-plug connection manager (connect control events, modules reopened with their configuration)
+"""
+
+import time
+import logging
+import threading
+from collections import namedtuple
+from ctypes import c_ulong, c_void_p, addressof, memmove, sizeof
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue   # python 2
+
+from .ucanSystec import (tUcanInitCanParam, eventSystec, retSystec, retSystecNames, cyclicSystec, load_dll,
+                         _FUNCTYPE)
+from .ucanPool import enumerate_devices
+
+__all__ = ['tConnectControlFktEx', 'ucanConnectEvent', 'ucanConnectionManager']
+
+logger = logging.getLogger(__name__)
+
+_clock = getattr(time, "monotonic", time.time)
+
+# void tConnectControlFktEx(DWORD dwEvent_p, DWORD dwParam_p, void* pArg_p)
+tConnectControlFktEx = _FUNCTYPE(None, c_ulong, c_ulong, c_void_p)
+
+# connected: False on disconnection, True once reopened and restored (gap: time in s without module, 0 on disconnection)
+ucanConnectEvent = namedtuple("ucanConnectEvent", "bus serial connected gap time")
+
+_LOST = (retSystec["USBCAN_ERR_DISCONNECT"], retSystec["USBCAN_ERR_ILLHANDLE"], retSystec["USBCAN_ERR_IOFAILED"])
+
+
+class _Managed(object):
+    """ managed module state (configuration saved on disconnection) """
+    def __init__(self, bus):
+        self.bus = bus
+        self.lost = None        # disconnection time (None while connected)
+        self.params = []        # channels configuration
+        self.chans = ()         # initialized channels
+        self.cyclic = {}        # channel: (cyclic list, flags)
+
+
+# noinspection PyPep8Naming
+class ucanConnectionManager(object):
+    """ Connection manager: registers the dll connect control callback, tears managed modules down on disconnection
+    and reopens them (same serial) on connection with their speed, filters, buffers sizes and cyclic lists.
+    Dll events are handled by a worker thread (no polling, no dll call from the dll callback thread). """
+    def __init__(self, dll=None, on_event=None):
+        """ manager init
+        :param dll: loaded dll (shared one if None)
+        :param on_event: function called with each ucanConnectEvent (from worker thread) """
+        self.dll = dll or load_dll()
+        self._managed = {}      # serial: _Managed
+        self._event_cb = [on_event] if on_event else []
+        self._events = queue.Queue()
+        self._callback = tConnectControlFktEx(self._on_connect_event)   # reference kept while registered
+        self._running = False
+        self._thread = None
+
+    def subscribe(self, on_event):
+        """ Add a consumer of connection events
+        :param on_event: function called with each ucanConnectEvent (from worker thread) """
+        self._event_cb = self._event_cb + [on_event]
+
+    def manage(self, bus):
+        """ Manage an opened module
+        :param bus: ucanSystec instance
+        :return: ucanSystec object """
+        self._managed[bus.serial] = _Managed(bus)
+        return bus
+
+    def unmanage(self, bus):
+        """ Stop managing a module
+        :param bus: ucanSystec instance """
+        self._managed.pop(bus.serial, None)
+
+    def connected(self, bus):
+        """ :return: False while a managed module is disconnected """
+        managed = self._managed.get(bus.serial)
+        return managed is None or managed.lost is None
+
+    def _on_connect_event(self, event, param, arg):
+        """ dll connect control callback (called from dll thread): handed to worker thread """
+        self._events.put((event, param))
+
+    def _publish(self, event):
+        """ hand event to consumers (a failing consumer never stops the manager) """
+        for fct in self._event_cb:
+            try:
+                fct(event)
+            except Exception:
+                logger.exception("Connection event consumer %r failed.", fct)
+
+    def _teardown(self, managed):
+        """ save module configuration and release it """
+        bus = managed.bus
+        managed.lost = _clock()
+        managed.params = [tUcanInitCanParam.from_buffer_copy(params) for params in bus.chan_params]
+        managed.chans = sorted(bus.chan_init)
+        managed.cyclic = dict((chan, (frames, bus.cyclic_flags.get(chan, cyclicSystec["USBCAN_CYCLIC_FLAG_STOP"])))
+                              for chan, frames in bus.cyclic.items())
+        bus.chan_init.clear()
+        bus.can_deinit_hw()     # required after a fatal disconnection, handle released
+        bus._handle.value = -1
+        logger.warning("Systec module %#x disconnected.", bus.serial)
+        self._publish(ucanConnectEvent(bus, bus.serial, False, 0.0, managed.lost))
+
+    def _restore(self, managed, device_nr):
+        """ reopen module and restore its configuration
+        :return: True if module is back """
+        bus = managed.bus
+        bus.device_nr = device_nr
+        for chan, params in enumerate(managed.params):     # speed, filters and buffers sizes (before any init)
+            memmove(addressof(bus.chan_params[chan]), addressof(params), sizeof(tUcanInitCanParam))
+        bus.reopen(managed.chans)   # each saved channel initialized once, with its saved configuration
+        if not bus.is_initialised():
+            logger.error("Systec module %#x reconnection failed (%s).", bus.serial,
+                         retSystecNames.get(bus.init_ret, hex(bus.init_ret)))
+            return False
+        for chan, (frames, flags) in managed.cyclic.items():
+            bus.can_define_cyclic(frames, chan)
+            if flags & cyclicSystec["USBCAN_CYCLIC_FLAG_START"]:
+                bus.can_enable_cyclic(chan, flags)
+        now = _clock()
+        gap, managed.lost = now - managed.lost, None
+        logger.warning("Systec module %#x reconnected after %.3fs.", bus.serial, gap)
+        self._publish(ucanConnectEvent(bus, bus.serial, True, gap, now))
+        return True
+
+    def handle(self, event, param=0):
+        """ Handle a connect control event (done by worker thread)
+        :param event: event code (see eventSystec)
+        :param param: event parameter (module handle for USBCAN_EVENT_FATALDISCON) """
+        if event == eventSystec["USBCAN_EVENT_FATALDISCON"]:
+            for managed in list(self._managed.values()):
+                if managed.lost is None and managed.bus._handle.value == param:
+                    self._teardown(managed)
+        elif event == eventSystec["USBCAN_EVENT_DISCONNECT"]:
+            for managed in list(self._managed.values()):    # check modules whose loss was not notified
+                if managed.lost is None and managed.bus.can_get_hw_infos() in _LOST:
+                    self._teardown(managed)
+        elif event == eventSystec["USBCAN_EVENT_CONNECT"]:
+            lost = dict((serial, managed) for serial, managed in self._managed.items() if managed.lost is not None)
+            if lost:
+                for device in enumerate_devices(self.dll):
+                    if device.serial in lost:
+                        self._restore(lost[device.serial], device.device_nr)
+
+    def _run(self):
+        """ worker thread: sleeps until a connect control event occurs """
+        while self._running:
+            event, param = self._events.get()
+            if event is None:
+                break
+            self.handle(event, param)
+
+    def start(self):
+        """ Register connect control callback and start worker thread
+        :return: ucanConnectionManager object """
+        if not self._running:
+            ret = self.dll.UcanInitHwConnectControlEx(self._callback, None)
+            if ret:
+                logger.error("!FAIL! UcanInitHwConnectControlEx = %s (%#x)", retSystecNames.get(ret, hex(ret)), ret)
+                return self
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="ucanConnectionManager")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ Unregister connect control callback and stop worker thread
+        :param timeout: time in s to wait for thread to end """
+        if self._running:
+            self.dll.UcanDeinitHwConnectControl()
+            self._running = False
+            self._events.put((None, None))
+            self._thread.join(timeout)
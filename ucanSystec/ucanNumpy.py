@@ -0,0 +1,93 @@
+# -*- coding:utf-8 -*-
+"""
+ucanNumpy.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN NumPy structured arrays support (optional, requires numpy)
+"""
+
+from ctypes import sizeof
+
+from .ucanSystec import tCanMsgStruct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None   # numpy is an optional dependency
+
+__all__ = ['struct_dtype', 'can_msg_dtype', 'can_msg_payload_dtype',
+           'frames_array', 'frames_view', 'payload_view', 'read_array']
+
+
+def struct_dtype(struct):
+    """ NumPy dtype mirroring a packed ctypes structure (same field names, offsets and item size)
+    :param struct: ctypes Structure class
+    :return: numpy dtype """
+    if np is None:
+        raise ImportError("numpy is required for structured arrays support")
+    return np.dtype({'names': [name for name, _ in struct._fields_],
+                     'formats': [np.dtype(ctype) for _, ctype in struct._fields_],
+                     'offsets': [getattr(struct, name).offset for name, _ in struct._fields_],
+                     'itemsize': sizeof(struct)})
+
+
+if np is not None:
+    can_msg_dtype = struct_dtype(tCanMsgStruct)
+    # same layout with payload as a single (8,) bytes column
+    can_msg_payload_dtype = np.dtype({'names': ['dw_id', 'b_ff', 'b_dlc', 'b_data', 'dw_time'],
+                                      'formats': [can_msg_dtype['dw_id'], can_msg_dtype['b_ff'],
+                                                  can_msg_dtype['b_dlc'], (np.uint8, (8,)),
+                                                  can_msg_dtype['dw_time']],
+                                      'offsets': [tCanMsgStruct.dw_id.offset, tCanMsgStruct.b_ff.offset,
+                                                  tCanMsgStruct.b_dlc.offset, tCanMsgStruct.b_data0.offset,
+                                                  tCanMsgStruct.dw_time.offset],
+                                      'itemsize': sizeof(tCanMsgStruct)})
+else:
+    can_msg_dtype = None
+    can_msg_payload_dtype = None
+
+
+def frames_array(nb_msg):
+    """ Allocate a structured array of frames (can be filled in place with read_array)
+    :param nb_msg: number of frames
+    :return: numpy array of can_msg_dtype """
+    if np is None:
+        raise ImportError("numpy is required for structured arrays support")
+    return np.zeros(nb_msg, dtype=can_msg_dtype)
+
+
+def frames_view(frames):
+    """ Zero-copy structured array view over a tCanMsgStruct ctypes array (e.g. ucanSystec.rx_frames)
+    :param frames: tCanMsgStruct ctypes array
+    :return: numpy array of can_msg_dtype sharing frames memory """
+    if np is None:
+        raise ImportError("numpy is required for structured arrays support")
+    return np.frombuffer(frames, dtype=can_msg_dtype)
+
+
+def payload_view(array):
+    """ Zero-copy (n, 8) view over payload bytes of a structured array of frames
+    :param array: numpy array of can_msg_dtype
+    :return: numpy uint8 array of shape (n, 8) """
+    return array.view(can_msg_payload_dtype)['b_data']
+
+
+def read_array(bus, array, chan=255, offset=0):
+    """ Fill a structured array in place with received frames (batched dll reads, no per frame python object)
+    :param bus: ucanSystec instance
+    :param array: contiguous numpy array of can_msg_dtype
+    :param chan: module channel (get messages from any channel if set to 255)
+    :param offset: index of first frame to fill in array
+    :return: number of frames filled (stops when array is full or no more data is pending) """
+    size = len(array) - offset
+    if size <= 0:
+        return 0
+    buf = (tCanMsgStruct * size).from_buffer(array, offset * array.itemsize)
+    filled = 0
+    while filled < size:
+        nb = bus.can_read_msgs(chan, buf=(tCanMsgStruct * (size - filled)).from_buffer(
+            buf, filled * sizeof(tCanMsgStruct)))
+        if nb <= 0:
+            break
+        filled += nb
+    return filled
@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+"""
+ucanPool.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN multi-device pool (USB-CANmodul racks)
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from ctypes import POINTER, c_int, c_ulong, c_void_p
+
+from .ucanSystec import ucanSystec, tUcanHardwareInfoEx, retSystec, retSystecNames, load_dll, _FUNCTYPE
+from .ucanDemux import ucanDemuxReader
+
+__all__ = ['tUcanEnumCallback', 'ucanDevice', 'ucanOpenResult', 'enumerate_devices', 'ucanPool']
+
+logger = logging.getLogger(__name__)
+
+# void tUcanEnumCallback(DWORD dwIndex_p, BOOL fIsUsed_p, tUcanHardwareInfoEx* pHwInfoEx_p,
+#                        tUcanHardwareInitInfo* pInitInfo_p, void* pArg_p)
+tUcanEnumCallback = _FUNCTYPE(None, c_ulong, c_int, POINTER(tUcanHardwareInfoEx), c_void_p, c_void_p)
+
+ucanDevice = namedtuple("ucanDevice", "device_nr serial product_code used")
+# ret: dll return code of hardware init, error: return code name (None if opened), bus: ucanSystec (None if failed)
+ucanOpenResult = namedtuple("ucanOpenResult", "device_nr serial ret error bus")
+
+
+def enumerate_devices(dll=None, used=False):
+    """ Enumerate connected modules (UcanEnumerateHardware)
+    :param dll: loaded dll (shared one if None)
+    :param used: also enumerate modules already in use
+    :return: list of ucanDevice """
+    devices = []
+
+    def on_device(index, is_used, hw_infos, init_infos, arg):
+        """ enumeration callback """
+        infos = hw_infos[0]
+        devices.append(ucanDevice(infos.m_bDeviceNr, infos.m_dwSerialNr, infos.m_dwProductCode, bool(is_used)))
+
+    callback = tUcanEnumCallback(on_device)
+    (dll or load_dll()).UcanEnumerateHardware(callback, None, used, 0, 255, 0, 0xFFFFFFFF, 0, 0xFFFFFFFF)
+    return devices
+
+
+# noinspection PyPep8Naming
+class ucanPool(object):
+    """ Pool of modules sharing one loaded dll, opened in parallel, each with its own reader """
+    def __init__(self, dll=None, verbose=False, rx_batch=64, readers=True, retries=3):
+        """ pool init
+        :param dll: loaded dll (shared one if None)
+        :param verbose: print failing dll calls
+        :param rx_batch: number of frames preallocated for batched reads per module
+        :param readers: create a ucanDemuxReader per opened module
+        :param retries: number of attempts per module when dll is busy """
+        self.dll = dll or load_dll()
+        self.verb = verbose
+        self.rx_batch = rx_batch
+        self.use_readers = readers
+        self.retries = retries
+        self.buses = {}     # device nr: ucanSystec
+        self.readers = {}   # device nr: ucanDemuxReader
+        self._lock = threading.Lock()
+
+    def enumerate(self, used=False):
+        """ :param used: also enumerate modules already in use
+        :return: list of ucanDevice """
+        return enumerate_devices(self.dll, used)
+
+    def _open_one(self, device_nr, serial):
+        """ open a module (run in its own thread)
+        :return: ucanOpenResult """
+        ret = retSystec["USBCAN_ERR_BUSY"]
+        try:
+            for _ in range(self.retries):
+                bus = ucanSystec(self.verb, self.dll, self.rx_batch, device_nr, serial=serial)
+                ret = bus.init_ret
+                if ret != retSystec["USBCAN_ERR_BUSY"]:
+                    break
+        except Exception as e:     # structured result, never raised from worker threads
+            logger.error("Opening module %s raised %r", device_nr, e)
+            return ucanOpenResult(device_nr, serial, -1, repr(e), None)
+        if ret or not bus.is_initialised():
+            return ucanOpenResult(device_nr, serial, ret, retSystecNames.get(ret, hex(ret)), None)
+        with self._lock:
+            self.buses[device_nr] = bus
+            if self.use_readers:
+                self.readers[device_nr] = ucanDemuxReader(bus)
+        return ucanOpenResult(device_nr, bus.hw_infos.m_dwSerialNr, ret, None, bus)
+
+    def open(self, devices=None, serials=None):
+        """ Open modules in parallel (bring-up time is the one of the slowest module)
+        :param devices: device numbers to open (all enumerated free modules if both devices and serials are None)
+        :param serials: serial numbers to open
+        :return: list of ucanOpenResult (in requested order) """
+        targets = [(nbr, None) for nbr in (devices or ())]
+        if serials or devices is None:
+            known = dict((dev.serial, dev) for dev in self.enumerate(used=True))
+            if serials is None:
+                targets = [(dev.device_nr, dev.serial) for dev in known.values() if not dev.used]
+            for serial in serials or ():
+                dev = known.get(serial)
+                targets.append((dev.device_nr if dev else None, serial))
+
+        results = [None] * len(targets)
+
+        def worker(idx, device_nr, serial):
+            """ open thread """
+            if device_nr is None:
+                results[idx] = ucanOpenResult(None, serial, retSystec["USBCAN_ERR_ILLHW"], "USBCAN_ERR_ILLHW", None)
+            else:
+                results[idx] = self._open_one(device_nr, serial)
+
+        threads = [threading.Thread(target=worker, args=(idx, nbr, serial), name="ucanPool-{}".format(nbr))
+                   for idx, (nbr, serial) in enumerate(targets)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def start_readers(self):
+        """ Start readers of opened modules
+        :return: dict of readers (device nr: ucanDemuxReader) """
+        for reader in self.readers.values():
+            reader.start()
+        return self.readers
+
+    def close(self):
+        """ Stop readers and close all opened modules """
+        for reader in self.readers.values():
+            reader.stop()
+        for bus in self.buses.values():
+            bus.can_close()
+        self.readers.clear()
+        self.buses.clear()
@@ -0,0 +1,225 @@
+# -*- coding:utf-8 -*-
+"""
+ucanReplay.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN trace replay (absolute timeline, batched writes, speed factor, identifier remapping, looping)
+"""
+
+import time
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from ctypes import Array, addressof, memmove, sizeof
+
+from .ucanSystec import tCanMsgStruct, CanFrame
+from .ucanCapture import tCaptureRecord
+
+__all__ = ['ucanReplayReport', 'ucanReplay']
+
+logger = logging.getLogger(__name__)
+
+# monotonic clock with the best resolution (time.monotonic ticks by 15ms on windows)
+_clock = getattr(time, "perf_counter", time.time)
+
+_MSG_SIZE = sizeof(tCanMsgStruct)
+
+# replay outcome: timing errors percentiles and max in s over all sent frames (absolute values: frames of a window
+# go out ahead of their due time, see ucanReplay.errors for signed send time - due time)
+ucanReplayReport = namedtuple('ucanReplayReport', ['sent', 'dropped', 'batches', 'loops', 'duration',
+                                                   'p50', 'p90', 'p99', 'max'])
+
+
+def _percentile(values, ratio):
+    """ :return: value at ratio of sorted values (nearest rank) """
+    return values[min(int(ratio * len(values)), len(values) - 1)] if values else 0.0
+
+
+# noinspection PyPep8Naming
+class ucanReplay(object):
+    """ Trace replay: frames copied once into a contiguous buffer with their time offsets, then sent on an absolute
+    timeline (no drift): frames due within the same window go out in a single dll write. Waits sleep coarsely then
+    spin for the last spin seconds. Timing errors of every frame are kept for the report.
+    Unthrottled replay (speed 0) writes chunks of dll tx buffer size, each resubmitted until accepted (or tx_timeout).
+    """
+    def __init__(self, bus, frames=None, chan=None, speed=1.0, remap=None, loops=1, loop_gap=0.0, window=0.0005,
+                 spin=0.002, tx_timeout=1.0, on_done=None):
+        """ replay init
+        :param bus: ucanSystec instance
+        :param frames: trace (see load)
+        :param chan: module channel for all frames (recorded channel of capture records if None, 0 otherwise)
+        :param speed: speed factor (2.0 replays twice as fast, 0 sends as fast as the module accepts)
+        :param remap: dict of CAN identifiers replaced (recorded identifier: replayed identifier)
+        :param loops: number of trace repetitions (0 loops until stopped)
+        :param loop_gap: time in s (trace time) between last frame of a loop and first frame of next one
+        :param window: time in s frames are grouped over (frames due within window sent in one write)
+        :param spin: time in s busy-waited before due time (sleep precision compensation)
+        :param tx_timeout: time in s unthrottled replay keeps resubmitting a chunk the module does not accept
+        :param on_done: function called with ucanReplayReport at end of threaded replay """
+        if chan is not None and not 0 <= chan < len(bus.chan_params):
+            raise ValueError("Channel {} not available on module".format(chan))
+        self.bus = bus
+        self.chan = chan
+        self.speed = speed
+        self.remap = remap or {}
+        self.loops = loops
+        self.loop_gap = loop_gap
+        self.window = window
+        self.spin = spin
+        self.tx_timeout = tx_timeout
+        self.errors = array("d")    # timing error of each sent frame (s, send time - due time)
+        self.report = None
+        self._done_cb = on_done
+        self._frames = (tCanMsgStruct * 0)()
+        self._offsets = array("d")  # trace time of each frame (s from first frame)
+        self._chans = b""
+        self._running = False
+        self._stop_evt = threading.Event()    # set by stop (wakes up waits)
+        self._thread = None
+        if frames is not None:
+            self.load(frames)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def load(self, frames):
+        """ Load a trace (timestamps: host ns of capture records, unwrapped dw_time in ms otherwise)
+        :param frames: iterable of tCaptureRecord (or tCaptureRecord arrays as given by ucanCaptureReader.blocks),
+        tCanMsgStruct or CanFrame
+        :raise ValueError: recorded channel not available on module """
+        msgs, offsets, chans = [], array("d"), bytearray()
+        first = None
+        wrap, last_ms = 0, None
+        for item in frames:
+            if isinstance(item, Array) and item._type_ is tCaptureRecord:
+                records = item
+            else:
+                records = (item,)
+            for frame in records:
+                if isinstance(frame, tCaptureRecord):
+                    msg, stamp, unit, chan = frame.msg, frame.ns, 1e-9, frame.chan
+                else:
+                    msg = frame.to_struct() if isinstance(frame, CanFrame) else frame
+                    if last_ms is not None and msg.dw_time + wrap < last_ms - 0x80000000:
+                        wrap += 0x100000000     # 32 bits ms counter wrapped
+                    last_ms = msg.dw_time + wrap
+                    stamp, unit, chan = last_ms, 1e-3, 0
+                if first is None:
+                    first = stamp
+                msgs.append(msg)
+                offsets.append((stamp - first) * unit)  # integer difference first (no precision loss on large ns)
+                chans.append(chan if self.chan is None else self.chan)
+        if chans and max(chans) >= len(self.bus.chan_params):
+            raise ValueError("Channel {} not available on module".format(max(chans)))
+        buf = (tCanMsgStruct * len(msgs))()
+        for idx, msg in enumerate(msgs):
+            memmove(addressof(buf) + idx * _MSG_SIZE, addressof(msg), _MSG_SIZE)
+            if buf[idx].dw_id in self.remap:
+                buf[idx].dw_id = self.remap[buf[idx].dw_id]
+        self._frames, self._offsets, self._chans = buf, offsets, bytes(chans)
+        return self
+
+    def _send(self, first, last, due_base, scale, timeout):
+        """ send frames [first, last) (one write per channel run)
+        :param timeout: time in s frames not accepted are resubmitted (see ucanSystec.send_many)
+        :return: number of frames sent """
+        chans = self._chans
+        sent = 0
+        idx = first
+        while idx < last:
+            chan = chans[idx]
+            if chans.count(chans[idx:idx + 1], idx, last) == last - idx:    # usual case: single channel
+                end = last
+            else:
+                end = idx + 1
+                while end < last and chans[end] == chan:
+                    end += 1
+            nb = end - idx
+            done = self.bus.send_many((tCanMsgStruct * nb).from_buffer(self._frames, idx * _MSG_SIZE), chan,
+                                      timeout=timeout)
+            now = _clock()
+            self.errors.extend(now - (due_base + self._offsets[pos] * scale) for pos in range(idx, idx + done))
+            sent += done
+            idx = end
+        return sent
+
+    def _wait(self, due):
+        """ wait until due (coarse sleep interrupted by stop, then spin) """
+        delay = due - _clock()
+        if delay > self.spin:
+            self._stop_evt.wait(delay - self.spin)
+        while _clock() < due and self._running:
+            pass
+
+    def run(self):
+        """ Replay trace (blocking)
+        :return: ucanReplayReport """
+        self._running = True
+        self._stop_evt.clear()
+        nb_frames = len(self._offsets)
+        scale = 1.0 / self.speed if self.speed > 0 else 0.0
+        span = (self._offsets[-1] if nb_frames else 0.0) + self.loop_gap
+        sent = dropped = batches = loops = 0
+        self.errors = array("d")
+        start = base = _clock()
+        while self._running and nb_frames and (not self.loops or loops < self.loops):
+            idx = 0
+            while self._running and idx < nb_frames:
+                if scale:
+                    self._wait(base + self._offsets[idx] * scale)
+                    if not self._running:   # stopped while waiting: frame not due yet
+                        break
+                    # all frames due before end of current window
+                    end = max(bisect_right(self._offsets, (_clock() + self.window - base) / scale, idx), idx + 1)
+                    done = self._send(idx, end, base, scale, self.window)
+                else:   # as fast as accepted: dll tx buffer sized chunks
+                    end = min(idx + max(self.bus.chan_params[self._chans[idx]].m_wNrOfTxBufferEntries, 1), nb_frames)
+                    done = self._send(idx, end, base, scale, self.tx_timeout)
+                sent += done
+                dropped += end - idx - done
+                batches += 1
+                idx = end
+            loops += 1
+            base += span * scale
+        self._running = False
+        errors = sorted(abs(error) for error in self.errors)
+        self.report = ucanReplayReport(sent, dropped, batches, loops, _clock() - start,
+                                       _percentile(errors, 0.5), _percentile(errors, 0.9), _percentile(errors, 0.99),
+                                       errors[-1] if errors else 0.0)
+        if dropped:
+            logger.warning("Replay: %d frames not accepted by module.", dropped)
+        return self.report
+
+    def _run(self):
+        """ replay thread """
+        report = self.run()
+        if self._done_cb:
+            self._done_cb(report)
+
+    def start(self):
+        """ Start replay thread
+        :return: ucanReplay object """
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="ucanReplay")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """ Wait for end of threaded replay
+        :param timeout: time in s to wait
+        :return: ucanReplayReport (None if still running) """
+        if self._thread:
+            self._thread.join(timeout)
+        return None if self._running else self.report
+
+    def stop(self, timeout=None):
+        """ Stop replay (report built with frames sent so far)
+        :param timeout: time in s to wait for thread to end """
+        self._running = False
+        self._stop_evt.set()
+        if self._thread:
+            self._thread.join(timeout)
@@ -0,0 +1,200 @@
+# -*- coding:utf-8 -*-
+"""
+ucanSched.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN occupancy aware transmit scheduler (priorities and per identifier rate limits)
+"""
+
+import time
+import heapq
+import threading
+
+from .ucanSystec import tCanMsgStruct, CanFrame, pendingSystec, retSystec
+
+__all__ = ['ucanTxScheduler']
+
+_clock = getattr(time, "monotonic", time.time)
+
+_TX_PENDING = pendingSystec["USBCAN_PENDING_FLAG_TX_DLL"] | pendingSystec["USBCAN_PENDING_FLAG_TX_FW"]
+
+
+# noinspection PyPep8Naming
+class ucanTxScheduler(object):
+    """ Transmit scheduler: frames queued by priority (CAN identifier by default, lowest first as on bus arbitration),
+    submitted by batches sized from module tx buffers occupancy so that they stay full without overflowing """
+    def __init__(self, bus, chan=0, capacity=0, max_batch=64, poll=0.001):
+        """ scheduler init
+        :param bus: ucanSystec instance
+        :param chan: module channel
+        :param capacity: tx buffers entries to keep filled (channel m_wNrOfTxBufferEntries if set to 0)
+        :param max_batch: max number of frames per dll write
+        :param poll: time in s between occupancy checks when tx buffers are full """
+        self.bus = bus
+        self.chan = chan
+        self.capacity = capacity or bus.chan_params[chan].m_wNrOfTxBufferEntries
+        self.max_batch = max_batch
+        self.poll = poll
+        self.room = self.capacity       # capacity estimate (lowered on tx full feedback, then raised back)
+        self.sent = 0
+        self.deferred = 0               # frames held back by rate limits
+        self.tx_full = 0                # batches partially refused by the dll
+        self._queue = []                # heap of (priority, seq, tCanMsgStruct)
+        self._held = []                 # heap of (ready time, seq, priority, tCanMsgStruct) (rate limited)
+        self._limits = {}               # identifier: [min interval in s, next allowed time]
+        self._seq = 0
+        self._buf = (tCanMsgStruct * max_batch)()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._running = False
+        self._thread = None
+
+    @property
+    def pending(self):
+        """ :return: number of frames waiting in scheduler """
+        return len(self._queue) + len(self._held)
+
+    def set_rate(self, can_id, rate=None):
+        """ Limit transmission rate of an identifier (frames above limit are delayed, never dropped)
+        :param can_id: CAN identifier
+        :param rate: max frames per s (no limit if None) """
+        with self._lock:
+            if rate:
+                self._limits[can_id] = [1.0 / rate, self._limits.get(can_id, [0, 0.0])[1]]
+            else:
+                self._limits.pop(can_id, None)
+
+    def enqueue(self, frame, priority=None):
+        """ Queue a frame for transmission (never blocks)
+        :param frame: tCanMsgStruct (copied) or CanFrame
+        :param priority: explicit priority (lowest sent first), CAN identifier if None """
+        msg = frame.to_struct() if isinstance(frame, CanFrame) else tCanMsgStruct.from_buffer_copy(frame)
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._queue, (msg.dw_id if priority is None else priority, self._seq, msg))
+            self._idle.clear()
+        self._wake.set()
+
+    def enqueue_many(self, frames, priority=None):
+        """ Queue frames for transmission (never blocks)
+        :param frames: sequence of tCanMsgStruct (copied) or CanFrame
+        :param priority: explicit priority for all frames (lowest sent first), CAN identifier if None """
+        msgs = [frame.to_struct() if isinstance(frame, CanFrame) else tCanMsgStruct.from_buffer_copy(frame)
+                for frame in frames]
+        with self._lock:
+            for msg in msgs:
+                self._seq += 1
+                heapq.heappush(self._queue, (msg.dw_id if priority is None else priority, self._seq, msg))
+            self._idle.clear()
+        self._wake.set()
+
+    def _pick(self, nb_max, now):
+        """ :return: list of (priority, seq, msg) to send (up to nb_max, rate limited frames moved to held heap),
+        rate limits are only advanced by _commit once frames are accepted by the dll """
+        picked = []
+        claimed = {}    # identifier: next allowed time if picked frames are accepted
+        with self._lock:
+            while self._held and self._held[0][0] <= now:
+                _, seq, priority, msg = heapq.heappop(self._held)
+                heapq.heappush(self._queue, (priority, seq, msg))
+            while self._queue and len(picked) < nb_max:
+                priority, seq, msg = heapq.heappop(self._queue)
+                limit = self._limits.get(msg.dw_id)
+                if limit:
+                    ready = claimed.get(msg.dw_id, limit[1])
+                    if ready > now:
+                        heapq.heappush(self._held, (ready, seq, priority, msg))
+                        self.deferred += 1
+                        continue
+                    claimed[msg.dw_id] = now + limit[0]
+                picked.append((priority, seq, msg))
+        return picked
+
+    def _commit(self, entries, now):
+        """ advance rate limits of identifiers of frames accepted by the dll """
+        with self._lock:
+            for _, _, msg in entries:
+                limit = self._limits.get(msg.dw_id)
+                if limit:
+                    limit[1] = now + limit[0]
+
+    def _requeue(self, entries):
+        """ put back frames refused by the dll (same priority and order) """
+        with self._lock:
+            for entry in entries:
+                heapq.heappush(self._queue, entry)
+
+    def _timeout(self, now):
+        """ :return: time in s to wait for next event """
+        if self._queue:
+            return self.poll
+        if self._held:
+            return max(self._held[0][0] - now, 0.0)
+        return None
+
+    def step(self):
+        """ Submit one batch according to tx buffers occupancy (done by scheduler thread)
+        :return: number of frames accepted by the dll """
+        pending = self.bus.can_get_msg_pending(self.chan, _TX_PENDING)
+        if pending == -1 or self.bus._ucanret:
+            return 0    # occupancy unknown (dll failure), checked again on next poll
+        free = min(self.room - pending.value, self.max_batch)
+        if free <= 0 or not self._queue and not self._held:
+            return 0
+        now = _clock()
+        entries = self._pick(free, now)
+        if not entries:
+            return 0
+        for idx, (_, _, msg) in enumerate(entries):
+            self._buf[idx] = msg
+        # single dll write: frames refused are requeued, the scheduler thread never sleeps inside a step
+        sent = max(self.bus.send_many((tCanMsgStruct * len(entries)).from_buffer(self._buf), self.chan,
+                                      timeout=None), 0)
+        self._commit(entries[:sent], now)
+        self.sent += sent
+        if sent < len(entries):
+            if self.bus._ucanret in (retSystec["USBCAN_ERR_DLL_TXFULL"], retSystec["USBCAN_WARN_TXLIMIT"]):
+                self.tx_full += 1
+                self.room = max(pending.value + sent, 1)    # buffers smaller than expected (shared, firmware...)
+            self._requeue(entries[sent:])
+        elif self.room < self.capacity:
+            self.room += 1
+        return sent
+
+    def _run(self):
+        """ scheduler thread: sleeps until frames are queued, polls occupancy while tx buffers are full """
+        while self._running:
+            sent = self.step()
+            with self._lock:
+                if not self._queue and not self._held:
+                    self._idle.set()
+                timeout = self._timeout(_clock())
+            if not sent or timeout is None:
+                self._wake.wait(timeout)
+                self._wake.clear()
+
+    def flush(self, timeout=None):
+        """ Wait for all queued frames to be handed to the dll
+        :param timeout: time in s to wait
+        :return: True if scheduler queue is empty """
+        return self._idle.wait(timeout)
+
+    def start(self):
+        """ Start scheduler thread
+        :return: ucanTxScheduler object """
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="ucanTxScheduler")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ Stop scheduler thread (queued frames are kept)
+        :param timeout: time in s to wait for thread to end """
+        if self._running:
+            self._running = False
+            self._wake.set()
+            self._thread.join(timeout)
@@ -0,0 +1,297 @@
+# -*- coding:utf-8 -*-
+"""
+ucanShm.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN shared memory fan-out (one owner process, many consumer processes, requires python >= 3.8)
+Rings are not locked: records are published by plain stores whose ordering is only guaranteed on x86/x64 (TSO)
+"""
+
+import os
+import platform
+from sys import version_info
+import time
+import threading
+from itertools import groupby
+from ctypes import c_uint32, c_uint64, c_ubyte, addressof, memmove, memset, sizeof
+from multiprocessing import shared_memory, resource_tracker
+
+from .ucanSystec import tCanMsgStruct, ucanReader, logger
+
+__all__ = ['ucanShmWriter', 'ucanShmReader']
+
+_MAGIC = 0x4E414355     # "UCAN"
+_VERSION = 1
+_HEADER = 128           # header size (counters on their own cache lines)
+_MSG_SIZE = sizeof(tCanMsgStruct)
+
+# header layout (u32 words): magic, version, message size, capacity, tx rings
+_OFS_BEGIN = 64         # u64 sequence of last record being written (claimed before copy)
+_OFS_WRITE = 72         # u64 sequence of last record written (published after copy)
+_OFS_READ = 96          # u64 sequence of last record read (tx rings only, single consumer)
+
+# stores seen by other processes in program order (records copy before sequence publication)
+_TSO = platform.machine().lower() in ("x86", "i386", "i486", "i586", "i686", "x86_64", "amd64")
+# python < 3.13 registers attached blocks to resource tracker (no track parameter)
+_TRACKED = os.name == "posix" and version_info < (3, 13)
+
+
+def _pow2(size):
+    """ :return: power of 2 greater or equal to size """
+    return 1 << max(int(size) - 1, 1).bit_length()
+
+
+def _tracked_name(shm):
+    """ :return: name shared memory block is registered with to resource tracker """
+    return "/" + shm.name
+
+
+def _attach(name):
+    """ :return: existing shared memory block (not unlinked when attaching process exits) """
+    if version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    shm = shared_memory.SharedMemory(name)
+    if _TRACKED:    # tracker would unlink the block when consumer exits (see _Ring.close for owner side)
+        resource_tracker.unregister(_tracked_name(shm), "shared_memory")
+    return shm
+
+
+class _Ring(object):
+    """ Shared memory ring of raw tCanMsgStruct records with a parallel channel byte per record
+    Single producer: claims records (begin sequence), copies them, then publishes them (write sequence).
+    Readers copy records and check afterwards that they were not overwritten meanwhile (no lock).
+    No memory barrier is issued: the protocol relies on stores being seen in program order (x86/x64 TSO), on weakly
+    ordered CPUs (ARM...) a reader may see a sequence before the records it publishes. """
+    def __init__(self, name, capacity=0, tx_rings=0, create=False):
+        if create:
+            capacity = _pow2(capacity)
+            self.shm = shared_memory.SharedMemory(name, create=True, size=_HEADER + capacity * (_MSG_SIZE + 1))
+            header = (c_uint32 * 5).from_buffer(self.shm.buf)
+            header[:] = [_MAGIC, _VERSION, _MSG_SIZE, capacity, tx_rings]
+            del header
+        else:
+            self.shm = _attach(name)
+            magic, version, msg_size, capacity, tx_rings = (c_uint32 * 5).from_buffer_copy(self.shm.buf[:20])
+            if magic != _MAGIC or version != _VERSION or msg_size != _MSG_SIZE:
+                self.shm.close()
+                raise ValueError("{} is not a compatible ucanSystec ring".format(name))
+        self.name = name
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.tx_rings = tx_rings
+        self._begin = c_uint64.from_buffer(self.shm.buf, _OFS_BEGIN)
+        self._write = c_uint64.from_buffer(self.shm.buf, _OFS_WRITE)
+        self._read = c_uint64.from_buffer(self.shm.buf, _OFS_READ)
+        self._msgs = (tCanMsgStruct * capacity).from_buffer(self.shm.buf, _HEADER)
+        self._chans = (c_ubyte * capacity).from_buffer(self.shm.buf, _HEADER + capacity * _MSG_SIZE)
+        self._msgs_addr = addressof(self._msgs)
+        self._chans_addr = addressof(self._chans)
+
+    def put(self, frames, nb_msg, chan, src_first=0):
+        """ producer: copy nb_msg records from a tCanMsgStruct ctypes array (at most 2 copies, none per frame) """
+        seq = self._write.value
+        self._begin.value = seq + nb_msg    # claimed
+        pos = seq & self.mask
+        first = min(nb_msg, self.capacity - pos)
+        src = addressof(frames) + src_first * _MSG_SIZE
+        memmove(self._msgs_addr + pos * _MSG_SIZE, src, first * _MSG_SIZE)
+        memset(self._chans_addr + pos, chan, first)
+        if nb_msg > first:
+            memmove(self._msgs_addr, src + first * _MSG_SIZE, (nb_msg - first) * _MSG_SIZE)
+            memset(self._chans_addr, chan, nb_msg - first)
+        self._write.value = seq + nb_msg    # published
+
+    def get(self, seq, nb_msg, frames, chans):
+        """ reader: copy nb_msg records from seq into frames/chans
+        :return: number of leading records overwritten during copy (invalid) """
+        pos = seq & self.mask
+        first = min(nb_msg, self.capacity - pos)
+        dst = addressof(frames)
+        memmove(dst, self._msgs_addr + pos * _MSG_SIZE, first * _MSG_SIZE)
+        memmove(addressof(chans), self._chans_addr + pos, first)
+        if nb_msg > first:
+            memmove(dst + first * _MSG_SIZE, self._msgs_addr, (nb_msg - first) * _MSG_SIZE)
+            memmove(addressof(chans) + first, self._chans_addr, nb_msg - first)
+        return max(min(self._begin.value - self.capacity - seq, nb_msg), 0)
+
+    def close(self, unlink=False):
+        """ release mapping (and remove block) """
+        del self._begin, self._write, self._read, self._msgs, self._chans   # exported buffers released first
+        self.shm.close()
+        if unlink:
+            if _TRACKED:    # consumers sharing owner tracker unregistered the block when attaching
+                resource_tracker.register(_tracked_name(self.shm), "shared_memory")
+            self.shm.unlink()
+
+
+# noinspection PyPep8Naming
+class ucanShmWriter(object):
+    """ Owner process side: received frames published to shared memory ring "name" (batch copies only),
+    transmission requests of consumer processes read from rings "name_tx0".."name_txN-1" and sent to the module """
+    def __init__(self, bus, name, capacity=4096, tx_rings=1, tx_capacity=1024, poll=0.001):
+        """ writer init (shared memory blocks created)
+        :param bus: ucanSystec instance
+        :param name: shared memory ring name (consumers attach with it)
+        :param capacity: ring size in frames (rounded up to a power of 2)
+        :param tx_rings: number of transmission rings (one per transmitting consumer process)
+        :param tx_capacity: transmission rings size in frames (rounded up to a power of 2)
+        :param poll: time in s between two transmission rings checks when idle """
+        if not _TSO:
+            logger.warning("Shared memory ring %s used on %s: records ordering not guaranteed (x86/x64 only).",
+                           name, platform.machine())
+        self.bus = bus
+        self.name = name
+        self.poll = poll
+        self.published = 0
+        self.tx_sent = 0
+        self.ring = _Ring(name, capacity, tx_rings, create=True)
+        self.tx = [_Ring("{}_tx{}".format(name, idx), tx_capacity, create=True) for idx in range(tx_rings)]
+        self._tx_buf = (tCanMsgStruct * self.tx[0].capacity)() if self.tx else None
+        self._tx_chans = (c_ubyte * self.tx[0].capacity)() if self.tx else None
+        self._reader = ucanReader(bus, on_frames=self.publish)
+        self._running = False
+        self._thread = None
+
+    def publish(self, frames, chan=None):
+        """ Publish a batch of frames (ucanReader consumer)
+        :param frames: tCanMsgStruct ctypes array
+        :param chan: module channel (channel of last read of calling thread if None) """
+        nb_msg = len(frames)
+        chan = self.bus.rx_chan.value if chan is None else chan
+        skip = max(nb_msg - self.ring.capacity, 0)   # batch larger than ring: oldest frames never visible
+        self.ring.put(frames, nb_msg - skip, chan, skip)
+        self.published += nb_msg
+
+    def _tx_process(self, ring):
+        """ send pending requests of a transmission ring
+        :return: number of frames sent """
+        seq, end = ring._read.value, ring._write.value
+        nb_msg = min(end - seq, ring.capacity)
+        if not nb_msg:
+            return 0
+        ring.get(seq, nb_msg, self._tx_buf, self._tx_chans)    # single producer never overwrites unread records
+        chans = bytes(self._tx_chans[:nb_msg])
+        if chans.count(chans[0]) == nb_msg:     # usual case: single channel, one dll write
+            runs = [(chans[0], nb_msg)]
+        else:
+            runs = [(chan, len(list(group))) for chan, group in groupby(chans)]
+        sent = 0
+        for chan, size in runs:
+            done = self.bus.send_many((tCanMsgStruct * size).from_buffer(self._tx_buf, sent * _MSG_SIZE), chan)
+            sent += done
+            if done < size:
+                break   # tx buffers full, rest sent later
+        ring._read.value = seq + sent
+        self.tx_sent += sent
+        return sent
+
+    def _run(self):
+        """ transmission thread: forwards consumers requests """
+        while self._running:
+            if not sum(self._tx_process(ring) for ring in self.tx):
+                time.sleep(self.poll)
+
+    def start(self):
+        """ Start reception (ucanReader) and transmission threads
+        :return: ucanShmWriter object """
+        if not self._running:
+            self._running = True
+            self._reader.start()
+            if self.tx:
+                self._thread = threading.Thread(target=self._run, name="ucanShmWriter")
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ Stop threads
+        :param timeout: time in s to wait for threads to end """
+        if self._running:
+            self._running = False
+            self._reader.stop(timeout)
+            if self._thread:
+                self._thread.join(timeout)
+
+    def close(self):
+        """ Stop threads and remove shared memory blocks """
+        self.stop()
+        for ring in [self.ring] + self.tx:
+            ring.close(unlink=True)
+        logger.info("Shared memory ring %s removed.", self.name)
+
+
+# noinspection PyPep8Naming
+class ucanShmReader(object):
+    """ Consumer process side: reads frames published by a ucanShmWriter at its own pace (overruns detected and
+    counted per reader), optionally sends frames through one of the writer transmission rings """
+    def __init__(self, name, tx=None, nb_msg=256, from_start=False):
+        """ reader init (shared memory blocks attached)
+        :param name: shared memory ring name
+        :param tx: index of the transmission ring used by this reader (exclusive, None if not transmitting)
+        :param nb_msg: max number of frames per read
+        :param from_start: read oldest frames still in ring instead of frames published from now on """
+        self.ring = _Ring(name)
+        self.tx = _Ring("{}_tx{}".format(name, tx)) if tx is not None else None
+        self.lost = 0           # frames overwritten before being read
+        self.seq = self.ring._write.value
+        if from_start:
+            self.seq = max(self.seq - self.ring.capacity, 0)
+        self.frames = (tCanMsgStruct * nb_msg)()
+        self.chans = (c_ubyte * nb_msg)()
+
+    @property
+    def pending(self):
+        """ :return: number of frames published and not read yet (overwritten ones included) """
+        return self.ring._write.value - self.seq
+
+    def read(self):
+        """ Copy next frames (one or two copies per batch, none per frame)
+        :return: number of frames read (valid frames in self.frames, their channels in self.chans) """
+        ring = self.ring
+        end = ring._write.value
+        if end - self.seq > ring.capacity:     # overrun: reader too slow
+            self.lost += end - self.seq - ring.capacity
+            self.seq = end - ring.capacity
+        nb_msg = min(end - self.seq, len(self.frames))
+        if not nb_msg:
+            return 0
+        bad = ring.get(self.seq, nb_msg, self.frames, self.chans)
+        self.seq += nb_msg
+        if bad:     # overwritten while copying
+            self.lost += bad
+            nb_msg -= bad
+            memmove(addressof(self.frames), addressof(self.frames) + bad * _MSG_SIZE, nb_msg * _MSG_SIZE)
+            memmove(addressof(self.chans), addressof(self.chans) + bad, nb_msg)
+        return nb_msg
+
+    def batches(self, timeout=None, poll=0.001):
+        """ Iterate over batches of received frames
+        :param timeout: time in s without frames ending iteration (never ends if None)
+        :param poll: time in s between two checks when no frame is pending
+        :return: (tCanMsgStruct ctypes array view, channels bytes) valid until next iteration """
+        idle = 0.0
+        while timeout is None or idle < timeout:
+            nb_msg = self.read()
+            if nb_msg:
+                idle = 0.0
+                yield (tCanMsgStruct * nb_msg).from_buffer(self.frames), bytes(self.chans[:nb_msg])
+            else:
+                time.sleep(poll)
+                idle += poll
+
+    def send_many(self, frames, chan=0):
+        """ Queue frames for transmission by the owner process
+        :param frames: tCanMsgStruct ctypes array
+        :param chan: module channel
+        :return: number of frames queued (room left in transmission ring) """
+        ring = self.tx
+        nb_msg = min(len(frames), ring.capacity - (ring._write.value - ring._read.value))
+        if nb_msg > 0:
+            ring.put(frames, nb_msg, chan)
+        return max(nb_msg, 0)
+
+    def close(self):
+        """ Detach shared memory blocks """
+        self.ring.close()
+        if self.tx:
+            self.tx.close()
@@ -0,0 +1,548 @@
+# -*- coding:utf-8 -*-
+"""
+ucanSim.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN in-process simulated Usbcan dll (benchmarks, tests and development without hardware)
+"""
+
+import math
+import time
+import random
+import threading
+from collections import deque
+from ctypes import c_byte, c_ubyte, c_long, c_ulong, POINTER, addressof, byref, cast, memmove, sizeof
+
+from .ucanSystec import (tCanMsgStruct, tUcanHardwareInfoEx, tUcanInitCanParam, tUcanChannelInfo,
+                         tUcanMsgCountInfo, tStatusStruct, retSystec, eventSystec, cyclicSystec,
+                         USBCAN_PRODCODE_PID_ADVANCED_G4, USBCAN_MAX_CYCCANMSG)
+
+__all__ = ['ucanSimDll']
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+def _deref(arg, ctype):
+    """ :return: pointer to ctype from a byref() argument, a ctypes instance or array """
+    return cast(arg, POINTER(ctype))
+
+
+class _SimChannel(object):
+    """ simulated CAN channel state """
+    def __init__(self):
+        self.init = False
+        self.params = tUcanInitCanParam()
+        self.rx_queue = deque()     # explicitly injected (or looped back) frames
+        self.rx_gen = 0.0           # frames generated at rx_rate not yet read
+        self.rx_stamp = _clock()
+        self.rx_overrun = False
+        self.tx_fill = 0.0          # frames in dll tx buffer
+        self.tx_stamp = _clock()
+        self.sent = 0
+        self.received = 0
+        self.status = 0
+        self.tx_err = 0
+        self.rx_err = 0
+        self.cyclic = []            # cyclic CAN messages list
+        self.cyclic_flags = 0
+        self.cyclic_due = []        # per message frames due (parallel mode) or list position (sequential mode)
+        self.cyclic_sent = 0
+
+
+class _SimModule(object):
+    """ simulated USB-CANmodul state """
+    def __init__(self, handle, device_nr, serial, product_code, nb_chan):
+        self.handle = handle
+        self.device_nr = device_nr
+        self.serial = serial
+        self.product_code = product_code
+        self.channels = [_SimChannel() for _ in range(nb_chan)]
+        self.opened = False
+        self.present = True         # plugged in
+        self.callback = None
+        self.clock = None           # (host start, device ms at start, drift ppm, delay, jitter) when stamping frames
+
+
+# noinspection PyPep8Naming
+class ucanSimDll(object):
+    """ In-process simulated Usbcan dll (same entry points as the Windows dll, ucanSystec dll parameter) """
+    def __init__(self, modules=1, nb_chan=2, product_code=USBCAN_PRODCODE_PID_ADVANCED_G4,
+                 latency=0.0, rx_rate=0.0, tx_rate=8000.0, loopback=False, events=False, event_period=0.001,
+                 blocking=False):
+        """ simulated dll init
+        :param modules: number of simulated modules (device numbers 0..n-1, serial numbers 0x1000 + n)
+        :param nb_chan: number of channels per module
+        :param product_code: modules product code
+        :param latency: time in s spent in each dll call (busy wait)
+        :param rx_rate: frames per s received on each initialized channel
+        :param tx_rate: frames per s drained from dll tx buffer (~8000 at 1Mbit/s)
+        :param loopback: transmitted frames are received back on the same channel
+        :param events: call registered callbacks (USBCAN_EVENT_RECEIVE) from a simulation thread (running while a
+        module is opened)
+        :param event_period: time in s between two receive events checks
+        :param blocking: latency spent sleeping (GIL released as for real dll calls through ctypes) """
+        self._name = "ucanSimDll"
+        self.modules = [_SimModule(nbr, nbr, 0x1000 + nbr, product_code, nb_chan) for nbr in range(modules)]
+        self.latency = latency
+        self.blocking = blocking
+        self.rx_rate = rx_rate
+        self.tx_rate = tx_rate
+        self.loopback = loopback
+        self.events = events
+        self.event_period = event_period
+        self.calls = 0
+        self.rx_template = (tCanMsgStruct * 1024)()     # generated frames pattern
+        for idx, msg in enumerate(self.rx_template):
+            msg.dw_id, msg.b_dlc = 0x100 + (idx & 0xFF), 8
+            for byte in range(8):
+                setattr(msg, "b_data{}".format(byte), (idx + byte) & 0xFF)
+        self._lock = threading.Lock()
+        self._connect_cb = None     # connect control callback (UcanInitHwConnectControlEx)
+        self._events = None         # events thread
+
+    # ---------- simulation helpers ----------
+    def _call(self):
+        """ account dll call and spend configured latency """
+        self.calls += 1
+        if self.latency and self.blocking:
+            time.sleep(self.latency)
+        elif self.latency:
+            end = _clock() + self.latency
+            while _clock() < end:
+                pass
+
+    def _module(self, handle):
+        """ :return: opened module from handle (None if invalid or unplugged) """
+        nbr = getattr(handle, "value", handle)
+        if 0 <= nbr < len(self.modules) and self.modules[nbr].opened and self.modules[nbr].present:
+            return self.modules[nbr]
+        return None
+
+    def _update(self, chan):
+        """ generate received frames and drain tx buffer according to elapsed time """
+        now = _clock()
+        if self.rx_rate:
+            chan.rx_gen += (now - chan.rx_stamp) * self.rx_rate
+            size = chan.params.m_wNrOfRxBufferEntries or 4096
+            if chan.rx_gen + len(chan.rx_queue) > size:
+                chan.rx_gen = max(size - len(chan.rx_queue), 0)
+                chan.rx_overrun = True
+        chan.rx_stamp = now
+        chan.tx_fill = max(chan.tx_fill - (now - chan.tx_stamp) * self.tx_rate, 0.0)
+        if chan.cyclic_flags & cyclicSystec["USBCAN_CYCLIC_FLAG_START"] and chan.cyclic:
+            self._cyclic(chan, (now - chan.tx_stamp) * 1000.0)
+        chan.tx_stamp = now
+
+    @staticmethod
+    def _cyclic(chan, elapsed):
+        """ account cyclic CAN messages sent by firmware during elapsed ms (echoes queued for reception) """
+        echo = not chan.cyclic_flags & cyclicSystec["USBCAN_CYCLIC_FLAG_NOECHO"]
+        seq = chan.cyclic_flags & cyclicSystec["USBCAN_CYCLIC_FLAG_SEQUMODE"]
+        for idx, msg in enumerate(chan.cyclic):
+            if chan.cyclic_flags & (1 << idx):  # locked
+                continue
+            chan.cyclic_due[idx] += elapsed / (max(msg.dw_time, 1) * (len(chan.cyclic) if seq else 1))
+            nb = int(chan.cyclic_due[idx])
+            chan.cyclic_due[idx] -= nb
+            chan.cyclic_sent += nb
+            chan.sent += nb
+            if echo:
+                chan.rx_queue.extend(tCanMsgStruct.from_buffer_copy(msg) for _ in range(nb))
+
+    def _pending(self, chan):
+        """ :return: number of frames waiting to be read on channel """
+        return len(chan.rx_queue) + int(chan.rx_gen)
+
+    def _start_events(self):
+        """ start events thread if enabled and not running (called with lock held when a module is opened) """
+        if self.events and self._events is None:
+            self._events = threading.Thread(target=self._run_events, name="ucanSimDll")
+            self._events.daemon = True
+            self._events.start()
+
+    def _run_events(self):
+        """ simulation thread: fires receive events when frames are pending, ends once no module is opened """
+        while True:
+            time.sleep(self.event_period)
+            with self._lock:
+                if not any(module.opened for module in self.modules):
+                    self._events = None     # started again on next module opening
+                    return
+            for module in self.modules:
+                if module.opened and module.callback:
+                    for nbr, chan in enumerate(module.channels):
+                        if chan.init:
+                            with self._lock:
+                                self._update(chan)
+                                pending = self._pending(chan)
+                            if pending:
+                                module.callback(module.handle, eventSystec["USBCAN_EVENT_RECEIVE"], nbr, None)
+
+    def inject(self, frames, device_nr=0, chan=0):
+        """ Queue frames for reception (fires a receive event if a callback is registered)
+        :param frames: tCanMsgStruct sequence (copied)
+        :param device_nr: simulated module number
+        :param chan: module channel """
+        module = self.modules[device_nr]
+        with self._lock:
+            module.channels[chan].rx_queue.extend(tCanMsgStruct.from_buffer_copy(msg) for msg in frames)
+        if module.opened and module.callback:
+            module.callback(module.handle, eventSystec["USBCAN_EVENT_RECEIVE"], chan, None)
+
+    def set_clock(self, device_nr=0, start_ms=0, drift_ppm=0.0, delay=0.0005, jitter=0.002):
+        """ Stamp frames read from a module with its device clock (dw_time 32 bits ms counter, wraps)
+        :param device_nr: simulated module number
+        :param start_ms: device time in ms now
+        :param drift_ppm: device clock drift in ppm (positive: device clock faster than host one)
+        :param delay: min time in s between frame reception and its read (usb and scheduling delays)
+        :param jitter: max extra random delay in s """
+        self.modules[device_nr].clock = (_clock(), start_ms, drift_ppm, delay, jitter)
+
+    def _stamp(self, module, msgs, nb):
+        """ stamp read frames with module device time of their (simulated) reception """
+        start, start_ms, drift_ppm, delay, jitter = module.clock
+        now = _clock() - delay - random.random() * jitter
+        device_ms = int(start_ms + (now - start) * 1000.0 * (1.0 + drift_ppm * 1e-6)) & 0xFFFFFFFF
+        for idx in range(nb):
+            msgs[idx].dw_time = device_ms
+
+    def set_status(self, status, device_nr=0, chan=0, tx_err=None, rx_err=None):
+        """ Set simulated CAN status and error counters (fires a status event if a callback is registered)
+        :param status: CAN status (see statusSystec)
+        :param device_nr: simulated module number
+        :param chan: module channel
+        :param tx_err: tx error counter
+        :param rx_err: rx error counter """
+        module = self.modules[device_nr]
+        channel = module.channels[chan]
+        channel.status = status
+        channel.tx_err = channel.tx_err if tx_err is None else tx_err
+        channel.rx_err = channel.rx_err if rx_err is None else rx_err
+        if module.opened and module.callback:
+            module.callback(module.handle, eventSystec["USBCAN_EVENT_STATUS"], chan, None)
+
+    def unplug(self, device_nr=0):
+        """ Simulate module disconnection (fires USBCAN_EVENT_FATALDISCON with module handle if the module is in use,
+        USBCAN_EVENT_DISCONNECT otherwise, to the connect control callback)
+        :param device_nr: simulated module number """
+        module = self.modules[device_nr]
+        module.present = False
+        with self._lock:
+            for chan in module.channels:
+                chan.init = False
+                chan.rx_queue.clear()
+                chan.rx_gen, chan.tx_fill, chan.cyclic, chan.cyclic_flags = 0.0, 0.0, [], 0
+        if self._connect_cb:
+            if module.opened:
+                self._connect_cb(eventSystec["USBCAN_EVENT_FATALDISCON"], module.handle, None)
+            else:
+                self._connect_cb(eventSystec["USBCAN_EVENT_DISCONNECT"], 0, None)
+
+    def plug(self, device_nr=0):
+        """ Simulate module connection (fires USBCAN_EVENT_CONNECT to the connect control callback)
+        :param device_nr: simulated module number """
+        self.modules[device_nr].present = True
+        if self._connect_cb:
+            self._connect_cb(eventSystec["USBCAN_EVENT_CONNECT"], 0, None)
+
+    # ---------- dll entry points ----------
+    def UcanGetVersionEx(self, ver_type):
+        self._call()
+        return 0x00030005   # v5.0r3
+
+    def UcanEnumerateHardware(self, callback, arg, used, nbr_low, nbr_high, serial_low, serial_high,
+                              code_low, code_high):
+        self._call()
+        nb = 0
+        for module in self.modules:
+            if module.present and (used or not module.opened) and nbr_low <= module.device_nr <= nbr_high and \
+                    serial_low <= module.serial <= serial_high and code_low <= module.product_code <= code_high:
+                hw = tUcanHardwareInfoEx(sizeof(tUcanHardwareInfoEx), module.handle if module.opened else 0,
+                                         module.device_nr, module.serial, 0x00030005, module.product_code)
+                callback(nb, module.opened, byref(hw), None, arg)
+                nb += 1
+        return nb
+
+    def UcanInitHardware(self, p_handle, nbr, callback):
+        return self.UcanInitHardwareEx(p_handle, nbr, None, None)
+
+    def UcanInitHardwareEx(self, p_handle, nbr, callback, arg):
+        self._call()
+        for module in self.modules:
+            if nbr in (255, module.device_nr) and module.present:
+                if module.opened:
+                    if nbr != 255:
+                        return retSystec["USBCAN_ERR_HWINUSE"]
+                    continue
+                with self._lock:
+                    module.opened = True
+                    module.callback = callback
+                    self._start_events()
+                _deref(p_handle, c_byte)[0] = module.handle
+                return retSystec["USBCAN_SUCCESSFUL"]
+        return retSystec["USBCAN_ERR_ILLHW"]
+
+    def UcanDeinitHardware(self, handle):
+        self._call()
+        nbr = getattr(handle, "value", handle)
+        module = self.modules[nbr] if 0 <= nbr < len(self.modules) and self.modules[nbr].opened else None
+        if module is None:  # unplugged modules still have to be deinitialized
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        for chan in module.channels:
+            chan.init = False
+        with self._lock:
+            module.opened = False   # events thread ends with last opened module
+            module.callback = None
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanInitHwConnectControlEx(self, callback, arg):
+        self._call()
+        self._connect_cb = callback
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanDeinitHwConnectControl(self):
+        self._call()
+        self._connect_cb = None
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanGetHardwareInfoEx2(self, handle, p_hw, p_chan0, p_chan1):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        hw = _deref(p_hw, tUcanHardwareInfoEx)[0]
+        hw.m_UcanHandle, hw.m_bDeviceNr, hw.m_dwSerialNr = module.handle, module.device_nr, module.serial
+        hw.m_dwFwVersionEx, hw.m_dwProductCode = 0x00030005, module.product_code
+        for nbr, p_info in enumerate((p_chan0, p_chan1)):
+            if p_info is not None and nbr < len(module.channels):
+                chan = module.channels[nbr]
+                info = _deref(p_info, tUcanChannelInfo)[0]
+                info.m_bMode, info.m_bBTR0, info.m_bBTR1 = chan.params.m_bMode, chan.params.m_bBTR0, chan.params.m_bBTR1
+                info.m_bOCR, info.m_dwAMR, info.m_dwACR = chan.params.m_bOCR, chan.params.m_dwAMR, chan.params.m_dwACR
+                info.m_dwBaudrate, info.m_fCanIsInit, info.m_wCanStatus = chan.params.m_dwBaudrate, chan.init, chan.status
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanInitCanEx2(self, handle, chan, p_params):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        if chan >= len(module.channels):
+            return retSystec["USBCAN_ERR_ILLCHANNEL"]
+        channel = module.channels[chan]
+        if channel.init:
+            return retSystec["USBCAN_ERRCMD_ALREADYINIT"]
+        memmove(byref(channel.params), p_params, sizeof(tUcanInitCanParam))
+        channel.init = True
+        channel.rx_stamp = channel.tx_stamp = _clock()
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanInitCan(self, handle, btr0, btr1, amr, acr):
+        params = tUcanInitCanParam(sizeof(tUcanInitCanParam), 0, btr0, btr1, 0x1A, amr, acr, 0, 4096, 4096)
+        return self.UcanInitCanEx2(handle, 0, byref(params))
+
+    def UcanDeinitCanEx(self, handle, chan):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        module.channels[chan].init = False
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanDeinitCan(self, handle):
+        return self.UcanDeinitCanEx(handle, 0)
+
+    def UcanResetCanEx(self, handle, chan, flags):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        channel = module.channels[chan]
+        channel.rx_queue.clear()
+        channel.rx_gen, channel.tx_fill, channel.status, channel.tx_err, channel.rx_err = 0.0, 0.0, 0, 0, 0
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanReadCanMsgEx(self, handle, p_chan, p_msgs, p_count):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        p_nbr = _deref(p_chan, c_ubyte)
+        with self._lock:
+            if p_nbr[0] == 255:    # first channel with pending frames (or first initialized one)
+                inits = [idx for idx, chan in enumerate(module.channels) if chan.init]
+                for idx in inits:
+                    self._update(module.channels[idx])
+                pendings = [idx for idx in inits if self._pending(module.channels[idx])]
+                nbr = (pendings or inits or [0])[0]
+            else:
+                nbr = p_nbr[0]
+            if nbr >= len(module.channels):
+                return retSystec["USBCAN_ERR_ILLCHANNEL"]
+            chan = module.channels[nbr]
+            if not chan.init:
+                return retSystec["USBCAN_ERR_CANNOTINIT"]
+            self._update(chan)
+            wanted = 1 if p_count is None else _deref(p_count, c_ulong)[0]
+            msgs = _deref(p_msgs, tCanMsgStruct)
+            nb = 0
+            while nb < wanted and chan.rx_queue:
+                msgs[nb] = chan.rx_queue.popleft()
+                nb += 1
+            gen = min(wanted - nb, int(chan.rx_gen))
+            while gen:
+                idx = chan.received % len(self.rx_template)
+                chunk = min(gen, len(self.rx_template) - idx)
+                memmove(addressof(msgs.contents) + nb * sizeof(tCanMsgStruct),
+                        addressof(self.rx_template) + idx * sizeof(tCanMsgStruct), chunk * sizeof(tCanMsgStruct))
+                chan.received += chunk
+                chan.rx_gen -= chunk
+                nb += chunk
+                gen -= chunk
+            if p_count is not None:
+                _deref(p_count, c_ulong)[0] = nb
+            p_nbr[0] = nbr
+            if not nb:
+                return retSystec["USBCAN_WARN_NODATA"]
+            if module.clock:
+                self._stamp(module, msgs, nb)
+            if chan.rx_overrun:
+                chan.rx_overrun = False
+                return retSystec["USBCAN_WARN_DLL_RXOVERRUN"]
+            return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanWriteCanMsgEx(self, handle, nbr, p_msgs, p_count):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        if nbr >= len(module.channels):
+            return retSystec["USBCAN_ERR_ILLCHANNEL"]
+        chan = module.channels[nbr]
+        if not chan.init:
+            return retSystec["USBCAN_ERR_CANNOTINIT"]
+        with self._lock:
+            self._update(chan)
+            wanted = 1 if p_count is None else _deref(p_count, c_ulong)[0]
+            room = int((chan.params.m_wNrOfTxBufferEntries or 4096) - chan.tx_fill)
+            nb = max(min(wanted, room), 0)
+            if p_count is not None:
+                _deref(p_count, c_ulong)[0] = nb
+            if not nb:
+                return retSystec["USBCAN_ERR_DLL_TXFULL"]
+            chan.tx_fill += nb
+            chan.sent += nb
+            if self.loopback:
+                msgs = _deref(p_msgs, tCanMsgStruct)
+                chan.rx_queue.extend(tCanMsgStruct.from_buffer_copy(msgs[idx]) for idx in range(nb))
+        if self.loopback and module.callback:
+            module.callback(module.handle, eventSystec["USBCAN_EVENT_RECEIVE"], nbr, None)
+        return retSystec["USBCAN_WARN_TXLIMIT"] if nb < wanted else retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanGetMsgPending(self, handle, nbr, flags, p_count):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        chan = module.channels[nbr]
+        with self._lock:
+            self._update(chan)
+            flags = getattr(flags, "value", flags)
+            _deref(p_count, c_ulong)[0] = (self._pending(chan) if flags & 0x0F else 0) + \
+                (int(math.ceil(chan.tx_fill)) if flags & 0xF0 else 0)     # frame being sent still counted
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanGetMsgCountInfoEx(self, handle, nbr, p_info):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        chan = module.channels[nbr]
+        info = _deref(p_info, tUcanMsgCountInfo)[0]
+        info.m_wSentMsgCount, info.m_wRecvdMsgCount = chan.sent & 0xFFFF, chan.received & 0xFFFF
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanGetStatusEx(self, handle, nbr, p_status):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        status = _deref(p_status, tStatusStruct)[0]
+        status.m_wCanStatus, status.m_wUsbStatus = module.channels[nbr].status, 0
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanGetCanErrorCounterEx(self, handle, nbr, p_tx, p_rx):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        _deref(p_tx, c_long)[0] = module.channels[nbr].tx_err
+        _deref(p_rx, c_long)[0] = module.channels[nbr].rx_err
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanSetDeviceNr(self, handle, num):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        module.device_nr = num
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanSetBaudrateEx(self, handle, nbr, btr0, btr1, baudrate):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        params = module.channels[nbr].params
+        params.m_bBTR0, params.m_bBTR1, params.m_dwBaudrate = btr0, btr1, baudrate
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanSetTxTimeout(self, handle, nbr, timeout):
+        self._call()
+        return retSystec["USBCAN_SUCCESSFUL"] if self._module(handle) else retSystec["USBCAN_ERR_ILLHANDLE"]
+
+    def UcanDefineCyclicCanMsg(self, handle, nbr, p_msgs, count):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        chan = module.channels[nbr]
+        if chan.cyclic_flags & cyclicSystec["USBCAN_CYCLIC_FLAG_START"]:
+            return retSystec["USBCAN_ERRCMD_RUNNING"]
+        if count > USBCAN_MAX_CYCCANMSG:
+            return retSystec["USBCAN_ERRCMD_ILLIDX"]
+        msgs = _deref(p_msgs, tCanMsgStruct)
+        with self._lock:
+            chan.cyclic = [tCanMsgStruct.from_buffer_copy(msgs[idx]) for idx in range(count)]
+            chan.cyclic_due = [0.0] * count
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanReadCyclicCanMsg(self, handle, nbr, p_msgs, p_count):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        chan = module.channels[nbr]
+        msgs = _deref(p_msgs, tCanMsgStruct)
+        for idx, msg in enumerate(chan.cyclic):
+            msgs[idx] = msg
+        _deref(p_count, c_ulong)[0] = len(chan.cyclic)
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanEnableCyclicCanMsg(self, handle, nbr, flags):
+        self._call()
+        module = self._module(handle)
+        if module is None:
+            return retSystec["USBCAN_ERR_ILLHANDLE"]
+        chan = module.channels[nbr]
+        if not chan.init:
+            return retSystec["USBCAN_ERRCMD_NOTINIT"]
+        with self._lock:
+            self._update(chan)
+            chan.cyclic_flags = getattr(flags, "value", flags)
+            chan.cyclic_due = [0.0] * len(chan.cyclic)
+        return retSystec["USBCAN_SUCCESSFUL"]
+
+    def UcanGetFwVersion(self, handle):
+        self._call()
+        return 0x00030005
@@ -0,0 +1,172 @@
+# -*- coding:utf-8 -*-
+"""
+ucanStats.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN per channel traffic statistics
+"""
+
+import time
+import threading
+from collections import deque
+
+__all__ = ['ucanStats']
+
+_clock = getattr(time, "monotonic", time.time)
+
+# totals fields order (per channel)
+RX_FRAMES, RX_BYTES, TX_FRAMES, TX_BYTES, TX_ERR, RX_ERR = range(6)
+_FIELDS = ("rx_frames", "rx_bytes", "tx_frames", "tx_bytes", "tx_errors", "rx_errors")
+
+
+# noinspection PyPep8Naming
+class ucanStats(object):
+    """ Always-on per channel traffic counters (updated per batch) with sliding window rates
+    Counters are updated from reception, transmission and control threads: updates hold a lock (once per batch). """
+    def __init__(self, code_names=None, windows=(1, 10, 60)):
+        """ instance init
+        :param code_names: dict of return code names (code: name) used for snapshots and rendering
+        :param windows: sliding windows in s for rates computation """
+        self.code_names = code_names or {}
+        self.windows = tuple(sorted(windows))
+        self.totals = {}        # channel: list of counters (see _FIELDS)
+        self.codes = {}         # (channel, code): count
+        self._err_last = {}     # channel: (tx, rx) last error counters read
+        self._history = deque()     # (time, {channel: totals copy})
+        self._lock = threading.Lock()   # counters read-modify-write
+
+    def _chan(self, chan):
+        """ :return: counters list of channel (created on first use, called with lock held) """
+        try:
+            return self.totals[chan]
+        except KeyError:
+            return self.totals.setdefault(chan, [0] * len(_FIELDS))
+
+    def rx(self, chan, nb_msg, nb_bytes):
+        """ account received frames
+        :param chan: module channel
+        :param nb_msg: number of frames
+        :param nb_bytes: payload bytes """
+        with self._lock:
+            cnt = self._chan(chan)
+            cnt[RX_FRAMES] += nb_msg
+            cnt[RX_BYTES] += nb_bytes
+
+    def tx(self, chan, nb_msg, nb_bytes):
+        """ account transmitted frames (accepted by the dll)
+        :param chan: module channel
+        :param nb_msg: number of frames
+        :param nb_bytes: payload bytes """
+        with self._lock:
+            cnt = self._chan(chan)
+            cnt[TX_FRAMES] += nb_msg
+            cnt[TX_BYTES] += nb_bytes
+
+    def code(self, chan, ret):
+        """ account a non successful dll return code (overruns, tx full...)
+        :param chan: module channel
+        :param ret: dll return code """
+        key = (chan, ret)
+        with self._lock:
+            self.codes[key] = self.codes.get(key, 0) + 1
+
+    def err_cnt(self, chan, tx_err, rx_err):
+        """ account CAN error counters deltas (counters going down are not accounted)
+        :param chan: module channel
+        :param tx_err: tx error counter read from module
+        :param rx_err: rx error counter read from module """
+        with self._lock:
+            cnt = self._chan(chan)
+            last_tx, last_rx = self._err_last.get(chan, (0, 0))
+            if tx_err > last_tx:
+                cnt[TX_ERR] += tx_err - last_tx
+            if rx_err > last_rx:
+                cnt[RX_ERR] += rx_err - last_rx
+            self._err_last[chan] = (tx_err, rx_err)
+
+    def counters(self, chan, codes=()):
+        """ Consistent read of one channel counters
+        :param chan: module channel
+        :param codes: dll return codes to count
+        :return: (totals copy (see _FIELDS), tuple of codes counts) """
+        with self._lock:
+            return (list(self.totals.get(chan, [0] * len(_FIELDS))),
+                    tuple(self.codes.get((chan, ret), 0) for ret in codes))
+
+    def sample(self, now=None):
+        """ Record totals for sliding window rates (done by snapshot, can be called periodically for steadier rates)
+        :param now: sample time (clock now if None)
+        :return: sample time """
+        now = _clock() if now is None else now
+        with self._lock:
+            self._record(now)
+        return now
+
+    def _record(self, now):
+        """ add totals copy to rates history, samples older than largest window dropped (called with lock held)
+        :return: totals copy """
+        totals = dict((chan, list(cnt)) for chan, cnt in self.totals.items())
+        self._history.append((now, totals))
+        horizon = now - self.windows[-1]
+        while len(self._history) > 2 and self._history[1][0] <= horizon:
+            self._history.popleft()
+        return totals
+
+    @staticmethod
+    def _rates(history, now, chan, cnt, window):
+        """ :return: per second rates of channel counters over window (from newest sample at or before window start,
+        oldest sample if history is shorter than window: elapsed time may exceed window when sampled sparsely) """
+        start = None
+        for stamp, totals in history:
+            if stamp >= now or (start is not None and stamp > now - window):
+                break
+            start = (stamp, totals.get(chan, [0] * len(_FIELDS)))
+        if start is None:
+            return dict((name, 0.0) for name in _FIELDS)
+        dt = now - start[0]
+        return dict((name, (cnt[idx] - start[1][idx]) / dt) for idx, name in enumerate(_FIELDS))
+
+    def snapshot(self):
+        """ Cheap snapshot of counters
+        :return: dict of channels: {"totals": {...}, "codes": {name: count}, "rates": {window: {...}}} """
+        now = _clock()
+        with self._lock:
+            totals = self._record(now)
+            history = list(self._history)
+            codes = list(self.codes.items())
+        snap = {}
+        for chan, cnt in totals.items():
+            snap[chan] = {"totals": dict(zip(_FIELDS, cnt)),
+                          "codes": {},
+                          "rates": dict((window, self._rates(history, now, chan, cnt, window))
+                                        for window in self.windows)}
+        for (chan, ret), nb in codes:
+            snap.setdefault(chan, {"totals": dict.fromkeys(_FIELDS, 0), "codes": {}, "rates": {}})
+            snap[chan]["codes"][self.code_names.get(ret, hex(ret))] = nb
+        return snap
+
+    def prometheus(self, prefix="ucan", labels=None):
+        """ Prometheus text exposition of a snapshot
+        :param prefix: metrics names prefix
+        :param labels: dict of extra labels (e.g. {"serial": "..."})
+        :return: metrics text """
+        extra = "".join(',{}="{}"'.format(key, val) for key, val in sorted((labels or {}).items()))
+        snap = self.snapshot()
+        lines = []
+        for name in _FIELDS:
+            lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+            for chan in sorted(snap):
+                lines.append('{}_{}_total{{channel="{}"{}}} {}'.format(prefix, name, chan, extra,
+                                                                      snap[chan]["totals"][name]))
+        lines.append("# TYPE {}_return_codes_total counter".format(prefix))
+        for chan in sorted(snap):
+            for code, nb in sorted(snap[chan]["codes"].items()):
+                lines.append('{}_return_codes_total{{channel="{}",code="{}"{}}} {}'.format(prefix, chan, code,
+                                                                                           extra, nb))
+        for name in _FIELDS:
+            lines.append("# TYPE {}_{}_per_second gauge".format(prefix, name))
+            for chan in sorted(snap):
+                for window, rates in sorted(snap[chan]["rates"].items()):
+                    lines.append('{}_{}_per_second{{channel="{}",window="{}"{}}} {}'.format(
+                        prefix, name, chan, window, extra, rates[name]))
+        return "\n".join(lines) + "\n"
@@ -25,12 +25,40 @@ SOFTWARE.
 
 import os
 import time
+import ctypes
+import logging
+import threading
+from collections import defaultdict
 from sys import version_info
-from ctypes import *
+from ctypes import (Structure, Array, CFUNCTYPE, c_bool, c_byte, c_ubyte, c_ushort, c_long, c_ulong, c_void_p,
+                    addressof, byref, memmove, memset, sizeof, string_at)
+
+from .ucanStats import ucanStats
+from .ucanClock import ucanClockModel, clock_ns
 
 if version_info > (3,):
     long = int  # workaround for python 3 as long and int are unified
 
+try:
+    WindowsError
+except NameError:
+    WindowsError = OSError  # workaround for non windows platforms (simulated dll)
+
+__all__ = ['USBCAN_PRODCODE_PID_GW001', 'USBCAN_PRODCODE_PID_GW002', 'USBCAN_PRODCODE_PID_MULTIPORT',
+           'USBCAN_PRODCODE_PID_BASIC', 'USBCAN_PRODCODE_PID_ADVANCED', 'USBCAN_PRODCODE_PID_USBCAN8',
+           'USBCAN_PRODCODE_PID_USBCAN16', 'USBCAN_PRODCODE_PID_RESERVED3', 'USBCAN_PRODCODE_PID_ADVANCED_G4',
+           'USBCAN_PRODCODE_PID_BASIC_G4', 'USBCAN_PRODCODE_PID_RESERVED1', 'USBCAN_PRODCODE_PID_RESERVED2',
+           'USBCAN_PRODCODE_PID_RESERVED4', 'USBCAN_BAUD_USE_BTREX', 'USBCAN_BAUDEX_USE_BTR01',
+           'USBCAN_MAX_CYCCANMSG', 'baudrateSystec', 'eventSystec', 'statusSystec', 'retSystec', 'cyclicSystec',
+           'pendingSystec', 'resetSystec', 'retSystecNames', 'statusSystecNames',
+           'decode_status', 'tCallbackFktEx', 'tCanMsgStruct', 'CanFrame', 'tUcanHardwareInfoEx',
+           'tUcanInitCanParam', 'tUcanChannelInfo', 'tUcanMsgCountInfo', 'tStatusStruct',
+           'load_dll', 'clear_hw_cache', 'can_err_code_wrapper', 'ucanSystec', 'ucanReader']
+
+logger = logging.getLogger(__name__)
+
+_clock = getattr(time, "monotonic", time.time)
+
 
 USBCAN_PRODCODE_PID_GW001 = 0x1100          # order code GW-001 "USB-CANmodul" outdated
 USBCAN_PRODCODE_PID_GW002 = 0x1102          # order code GW-002 "USB-CANmodul" outdated
@@ -169,6 +197,76 @@ retSystec = {
 }
 
 
+# Flags for cyclic CAN messages (UcanEnableCyclicCanMsg)
+cyclicSystec = {
+    "USBCAN_CYCLIC_FLAG_STOP":      0x00000000,     # stops the transmission of cyclic CAN messages
+    "USBCAN_CYCLIC_FLAG_START":     0x80000000,     # global enable of the transmission of cyclic CAN messages
+    "USBCAN_CYCLIC_FLAG_SEQUMODE":  0x40000000,     # list is sent in sequential mode (otherwise in parallel mode)
+    "USBCAN_CYCLIC_FLAG_NOECHO":    0x00010000,     # each sent CAN message is not received back as echo
+}
+cyclicSystec.update(("USBCAN_CYCLIC_FLAG_LOCK_{}".format(idx), 1 << idx) for idx in range(16))  # message idx locked
+
+USBCAN_MAX_CYCCANMSG = 16   # maximum number of cyclic CAN messages per channel
+
+# Flags for UcanResetCanEx (a set USBCAN_RESET_NO_xxx bit keeps the matching part untouched)
+resetSystec = {
+    "USBCAN_RESET_ALL":                 0x00000000,     # reset everything
+    "USBCAN_RESET_NO_STATUS":           0x00000001,     # no CAN status reset
+    "USBCAN_RESET_NO_CANCTRL":          0x00000002,     # no CAN controller reset
+    "USBCAN_RESET_NO_TXCOUNTER":        0x00000004,     # no transmit message counter reset
+    "USBCAN_RESET_NO_RXCOUNTER":        0x00000008,     # no receive message counter reset
+    "USBCAN_RESET_NO_TXBUFFER_CH":      0x00000010,     # no transmit buffer reset at channel level
+    "USBCAN_RESET_NO_TXBUFFER_DLL":     0x00000020,     # no transmit buffer reset at dll level
+    "USBCAN_RESET_NO_TXBUFFER_FW":      0x00000080,     # no transmit buffer reset at firmware level
+    "USBCAN_RESET_NO_RXBUFFER_CH":      0x00000100,     # no receive buffer reset at channel level
+    "USBCAN_RESET_NO_RXBUFFER_DLL":     0x00000200,     # no receive buffer reset at dll level
+    "USBCAN_RESET_NO_RXBUFFER_SYS":     0x00000400,     # no receive buffer reset at kernel driver level
+    "USBCAN_RESET_NO_RXBUFFER_FW":      0x00000800,     # no receive buffer reset at firmware level
+    "USBCAN_RESET_FIRMWARE":            0xFFFFFFFF,     # reset everything and restart firmware
+    "USBCAN_RESET_ONLY_STATUS":         0x0000FFFE,     # reset only the CAN status
+    "USBCAN_RESET_ONLY_CANCTRL":        0x0000FFFD,     # reset only the CAN controller
+}
+
+# Flags for UcanGetMsgPending (buffers where pending messages are counted)
+pendingSystec = {
+    "USBCAN_PENDING_FLAG_RX_DLL":   0x00000001,     # receive buffer of the dll
+    "USBCAN_PENDING_FLAG_RX_SYS":   0x00000002,     # receive buffer of the kernel driver (not supported)
+    "USBCAN_PENDING_FLAG_RX_FW":    0x00000004,     # receive buffer of the module firmware
+    "USBCAN_PENDING_FLAG_TX_DLL":   0x00000010,     # transmit buffer of the dll
+    "USBCAN_PENDING_FLAG_TX_SYS":   0x00000020,     # transmit buffer of the kernel driver (not supported)
+    "USBCAN_PENDING_FLAG_TX_FW":    0x00000040,     # transmit buffer of the module firmware
+}
+
+
+# dll callbacks use stdcall convention (cdecl on non windows platforms, simulated dll)
+_FUNCTYPE = getattr(ctypes, "WINFUNCTYPE", CFUNCTYPE)
+
+# void tCallbackFktEx(tUcanHandle UcanHandle_p, DWORD dwEvent_p, BYTE bChannel_p, void* pArg_p)
+tCallbackFktEx = _FUNCTYPE(None, c_ubyte, c_ulong, c_ubyte, c_void_p)
+
+
+# reverse lookup tables (code: name)
+retSystecNames = dict((code, name) for name, code in retSystec.items())
+statusSystecNames = dict((code, name) for name, code in statusSystec.items())
+_statusBits = sorted((code, name) for name, code in statusSystec.items() if code)
+_statusDecoded = {}     # status: decoded names (filled on first decoding of each status value)
+
+
+def decode_status(status):
+    """ Decode status bitfield
+    :param status: CAN/USB status word (see statusSystec)
+    :return: tuple of set status names (("USBCAN_CANERR_OK",) if no bit set) """
+    try:
+        return _statusDecoded[status]
+    except KeyError:
+        names = tuple(name for code, name in _statusBits if status & code)
+        unknown = status & ~sum(code for code, _ in _statusBits)
+        if unknown:
+            names += ("UNKNOWN_{:#x}".format(unknown),)
+        decoded = _statusDecoded[status] = names or ("USBCAN_CANERR_OK",)
+        return decoded
+
+
 # noinspection PyPep8Naming
 class tCanMsgStruct(Structure):
     """ Systec CAN message structure
@@ -185,11 +283,107 @@ class tCanMsgStruct(Structure):
                 ("dw_time", c_ulong)]
 
     def __str__(self):
-        return "ID {}  Nb {}  Data {} {} {} {} {} {} {} {} - Time {}".format(
-            hex(self.dw_id), self.b_dlc,
-            hex(self.b_data0), hex(self.b_data1), hex(self.b_data2), hex(self.b_data3),
-            hex(self.b_data4), hex(self.b_data5), hex(self.b_data6), hex(self.b_data7),
-            self.dw_time)
+        return "ID {:#x}  Nb {}  Data {:#x} {:#x} {:#x} {:#x} {:#x} {:#x} {:#x} {:#x} - Time {}".format(
+            *((self.dw_id, self.b_dlc) + tuple(self.data) + (self.dw_time,)))
+
+    @property
+    def data(self):
+        """ :return: payload as a c_ubyte * 8 array sharing message memory """
+        return (c_ubyte * 8).from_buffer(self, _CAN_DATA_OFFSET)
+
+    @data.setter
+    def data(self, payload):
+        """ :param payload: payload bytes (up to 8, remaining bytes untouched) """
+        payload = bytes(bytearray(payload))
+        memmove(addressof(self) + _CAN_DATA_OFFSET, payload, min(len(payload), 8))
+
+    @property
+    def payload(self):
+        """ :return: payload bytes (b_dlc first bytes) """
+        return string_at(addressof(self) + _CAN_DATA_OFFSET, min(self.b_dlc, 8))
+
+    def payload_view(self):
+        """ :return: memoryview on the 8 payload bytes (shares message memory) """
+        return memoryview(self.data).cast("B")
+
+
+_CAN_DATA_OFFSET = tCanMsgStruct.b_data0.offset
+_CAN_DLC_OFFSET = tCanMsgStruct.b_dlc.offset
+_CAN_MSG_SIZE = sizeof(tCanMsgStruct)
+
+
+def _payload_bytes(buf, nb_msg, first=0):
+    """ :return: payload bytes count of nb_msg messages of a tCanMsgStruct array (without per message object) """
+    return sum(bytearray(string_at(addressof(buf) + first * _CAN_MSG_SIZE,
+                                   nb_msg * _CAN_MSG_SIZE))[_CAN_DLC_OFFSET::_CAN_MSG_SIZE])
+
+
+class CanFrame(object):
+    """ Immutable compact CAN frame (for frames kept around, see tCanMsgStruct for dll exchanges) """
+    __slots__ = ("id", "ff", "dlc", "data", "time")
+
+    def __init__(self, id=0, ff=0, dlc=0, data=b"", time=0):
+        """ frame init
+        :param id: CAN identifier
+        :param ff: CAN frame format
+        :param dlc: CAN data length code
+        :param data: payload bytes
+        :param time: time in ms """
+        setter = object.__setattr__
+        setter(self, "id", id)
+        setter(self, "ff", ff)
+        setter(self, "dlc", dlc)
+        setter(self, "data", bytes(data))
+        setter(self, "time", time)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CanFrame is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CanFrame is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, CanFrame) and (self.id, self.ff, self.dlc, self.data, self.time) == \
+            (other.id, other.ff, other.dlc, other.data, other.time)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.id, self.ff, self.dlc, self.data, self.time))
+
+    def __reduce__(self):
+        return CanFrame, (self.id, self.ff, self.dlc, self.data, self.time)
+
+    def __repr__(self):
+        return "CanFrame(id={:#x}, ff={:#x}, dlc={}, data={!r}, time={})".format(
+            self.id, self.ff, self.dlc, self.data, self.time)
+
+    @classmethod
+    def from_struct(cls, msg):
+        """ Build frame from a dll message
+        :param msg: tCanMsgStruct
+        :return: CanFrame """
+        return cls(msg.dw_id, msg.b_ff, msg.b_dlc,
+                   string_at(addressof(msg) + _CAN_DATA_OFFSET, min(msg.b_dlc, 8)), msg.dw_time)
+
+    @classmethod
+    def from_structs(cls, msgs):
+        """ Build frames from dll messages
+        :param msgs: tCanMsgStruct sequence (e.g. ucanSystec.rx_frames)
+        :return: list of CanFrame """
+        return [cls.from_struct(msg) for msg in msgs]
+
+    def to_struct(self, msg=None):
+        """ Convert frame to a dll message
+        :param msg: tCanMsgStruct to fill (new one if None)
+        :return: tCanMsgStruct """
+        if msg is None:
+            msg = tCanMsgStruct()
+        msg.dw_id, msg.b_ff, msg.b_dlc, msg.dw_time = self.id, self.ff, self.dlc, self.time
+        memset(addressof(msg) + _CAN_DATA_OFFSET, 0, 8)
+        memmove(addressof(msg) + _CAN_DATA_OFFSET, self.data, min(len(self.data), 8))
+        return msg
 
 
 # noinspection PyPep8Naming
@@ -291,6 +485,40 @@ class tStatusStruct(Structure):
         return "{}  {}".format(self.m_wCanStatus, self.m_wUsbStatus)
 
 
+_dll = None
+_dll_lock = threading.Lock()
+
+
+def load_dll():
+    """ Load Usbcan dll (once, shared by all ucanSystec instances)
+    :return: loaded dll """
+    global _dll
+    with _dll_lock:
+        if _dll is None:
+            # Get platform
+            platform = os.environ.get("PROCESSOR_ARCHITEW6432", os.environ.get("PROCESSOR_ARCHITECTURE"))
+            logger.info("* Platform is : %s", platform)
+
+            # trick for not so clean installs of the driver on 64b machines
+            if os.path.isfile("C:\\Windows\\System32\\Usbcan64.dll"):
+                _dll = ctypes.WinDLL("Usbcan64.dll")
+            else:
+                _dll = ctypes.WinDLL("Usbcan32.dll")
+        return _dll
+
+
+_hw_cache = {}  # serial number: hardware discovery results (see ucanSystec._can_init_hw)
+
+
+def clear_hw_cache(serial=None):
+    """ Forget cached hardware discovery results
+    :param serial: serial number of the module to forget (all modules if None) """
+    if serial is None:
+        _hw_cache.clear()
+    else:
+        _hw_cache.pop(serial, None)
+
+
 def can_err_code_wrapper():
     """ Wrapper decorator for can error codes
     :return: wrapped function (through decorator) """
@@ -304,71 +532,208 @@ def can_err_code_wrapper():
             try:
                 ret = fct(*args, **kwargs)
             except WindowsError as e:
-                print("Raised exception: {}".format(repr(e)))
-                print("DLL is most probably missing")
+                logger.error("Raised exception: %r", e)
+                logger.error("DLL is most probably missing")
             return ret
         return catch
     return wrapper
 
 
-# noinspection PyPep8Naming
-class ucanSystec(object):
-    """ Systec usb-can module class """
-    def __init__(self, verbose=False):
-        """ instance init """
-        self.verb = verbose
-        print("=================== Start Systec Init ===================")
-
-        # Get platform
-        platform = os.environ['PROCESSOR_ARCHITECTURE']
-        try:
-            platform = os.environ["PROCESSOR_ARCHITEW6432"]
-        except KeyError:
-            pass    # key not found, pass
-        print("* Platform is : {}".format(platform))
-
-        # trick for not so clean installs of the driver on 64b machines
-        if os.path.isfile("C:\\Windows\\System32\\Usbcan64.dll"):
-            self.dll = WinDLL("Usbcan64.dll")
-        else:
-            self.dll = WinDLL("Usbcan32.dll")
-        print("** Running DLL : {}".format(self.dll._name))     # shouldn't call _name directly
+class _LazyStatus(object):
+    """ status decoded only when log record is formatted """
+    __slots__ = ("status",)
+
+    def __init__(self, status):
+        self.status = status
+
+    def __str__(self):
+        return "|".join(decode_status(self.status))
+
 
-        self._ucanhandle = c_byte()
+class _ucanThreadState(threading.local):
+    """ per thread dll call buffers and result code (a receive thread and a transmit thread never share them) """
+    def __init__(self, rx_batch):
         self._ucanret = retSystec['USBCAN_ERRCMD_NOTINIT']
-        self._use_ex = True
-        self._hw_gen = ""
         self.tx_err_cnt, self.rx_err_cnt = c_long(0), c_long(0)
         self.msg_pending = c_long(0)
-
         self.msgcount = tUcanMsgCountInfo(0, 0)
         self.status = tStatusStruct(0, 0)
+        self.rxcan = tCanMsgStruct(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        self.txcan = tCanMsgStruct(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        # batched reception buffer (reused across reads)
+        self.rx_buffer = (tCanMsgStruct * max(rx_batch, 1))()
+        self._rx_last = self.rx_buffer
+        self.rx_chan = c_ubyte(0)
+        self._rx_count = c_ulong(0)
+        # batched transmission buffer (reused across writes)
+        self.tx_buffer = (tCanMsgStruct * max(rx_batch, 1))()
+        self._tx_count = c_ulong(0)
+        # cyclic CAN messages list
+        self._cyclic_buffer = (tCanMsgStruct * USBCAN_MAX_CYCCANMSG)()
+        self._cyclic_count = c_ulong(0)
+
+
+def _thread_local(name, doc):
+    """ :return: property on calling thread own value (see _ucanThreadState) """
+    def fget(self):
+        return getattr(self._tls, name)
+
+    def fset(self, value):
+        setattr(self._tls, name, value)
+    return property(fget, fset, doc=doc)
+
+
+# noinspection PyPep8Naming
+class ucanSystec(object):
+    """ Systec usb-can module class """
+    def __init__(self, verbose=False, dll=None, rx_batch=64, device_nr=255, lazy=False, serial=None,
+                 rx_entries=500, tx_entries=500):
+        """ instance init
+        :param verbose: print failing dll calls
+        :param dll: already loaded Usbcan dll (or any object exposing the same entry points), shared one if None
+        :param rx_batch: number of frames preallocated for batched reads
+        :param device_nr: number of the module to open (255 means any)
+        :param lazy: load dll and open module on first use instead of at init
+        :param serial: expected serial number of the module (cached discovery results are used when known)
+        :param rx_entries: number of entries of each channel receive buffer in dll (see ucanBufferTuner)
+        :param tx_entries: number of entries of each channel transmit buffer in dll """
+        self.verb = verbose
+        self._dll = dll
+        self._lazy = lazy
+        self._open_lock = threading.Lock()
+
+        self.device_nr = device_nr
+        self.serial = serial
+        self._handle = c_byte(-1)   # not initialised
+        # calls buffers and result codes are per thread, dll reads, writes and control calls are serialized
+        # independently (full-duplex traffic from separate threads, control calls from any thread)
+        self._tls = _ucanThreadState(rx_batch)
+        self._rx_lock = threading.Lock()
+        self._tx_lock = threading.Lock()
+        self._ctl_lock = threading.RLock()
+        self.init_ret = self._ucanret   # UcanInitHardware return code
+        self.fail_count = defaultdict(int)      # (dll function name, return code): count
+        self.status_count = defaultdict(int)    # status: count
+        self._count_lock = threading.Lock()     # fail_count and status_count updates (any thread)
+        self.traffic = ucanStats(retSystecNames)   # per channel traffic counters
+        self.clock = ucanClockModel()   # device clock (dw_time) to host clock_ns mapping, updated on each read
+        self._use_ex = True
+        self._hw_gen = ""
         self.hw_infos = tUcanHardwareInfoEx(sizeof(tUcanHardwareInfoEx), 0, 0, 0, 0, 0)
         # AMR and ACR for mode "receive all CAN messages".
-        self.params = tUcanInitCanParam(sizeof(tUcanInitCanParam), 0, 0, 0, 0x1A, c_ulong(0xFFFFFFFF), c_ulong(0), 0, 500, 500)
+        self.params = tUcanInitCanParam(sizeof(tUcanInitCanParam), 0, 0, 0, 0x1A, c_ulong(0xFFFFFFFF), c_ulong(0), 0,
+                                        rx_entries, tx_entries)
+        # each channel configured independently (params is channel 0 configuration)
+        self.chan_params = [self.params, tUcanInitCanParam.from_buffer_copy(self.params)]
+        self.chan_init = set()      # initialized channels
         self.chan0_infos = tUcanChannelInfo(sizeof(tUcanChannelInfo), 0, 0, 0, 0, 0, 0, 0, 0, 0)
         self.chan1_infos = tUcanChannelInfo(sizeof(tUcanChannelInfo), 0, 0, 0, 0, 0, 0, 0, 0, 0)
 
-        self.rxcan = tCanMsgStruct(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-        self.txcan = tCanMsgStruct(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-
-        self._can_init_hw()
-
-    def _can_init_hw(self):
-        """ hardware init """
-        print("==================== H/W Systec Init ====================")
-        # Callback for UcanInitHardware() not implemented yet.
-        # This can be done. See ctypes chapter 16.15.1.17. Callback functions
-        # TODO: http:#docs.python.org/release/2.5/lib/ctypes-callback-functions.html
-        self.can_init_hw()
-        self.can_get_hw_infos()     # get hw infos to determine baudrate value to apply
+        # cyclic CAN messages lists (firmware transmission)
+        self.cyclic = {}            # channel: list of (tCanMsgStruct, period in ms) last defined
+        self.cyclic_flags = {}      # channel: last flags given to UcanEnableCyclicCanMsg
+
+        # dll events callback (reference kept for the whole instance life, dll calls it from its own thread)
+        self._event_listeners = []
+        self._event_cb = tCallbackFktEx(self._on_event)
+
+        if not lazy:
+            self._open()
+
+    _ucanret = _thread_local("_ucanret", "last dll return code of calling thread")
+    tx_err_cnt = _thread_local("tx_err_cnt", "tx error counter (last can_get_err_cnt of calling thread)")
+    rx_err_cnt = _thread_local("rx_err_cnt", "rx error counter (last can_get_err_cnt of calling thread)")
+    msg_pending = _thread_local("msg_pending", "pending messages (last can_get_msg_pending of calling thread)")
+    msgcount = _thread_local("msgcount", "messages count (last can_get_msg_count of calling thread)")
+    status = _thread_local("status", "module status (last can_get_status of calling thread)")
+    rxcan = _thread_local("rxcan", "message read by last can_get_msg of calling thread")
+    txcan = _thread_local("txcan", "message sent by last can_send_msg of calling thread")
+    rx_buffer = _thread_local("rx_buffer", "batched reception buffer of calling thread")
+    rx_chan = _thread_local("rx_chan", "channel of last messages read by calling thread")
+    tx_buffer = _thread_local("tx_buffer", "batched transmission buffer of calling thread")
+
+    @property
+    def dll(self):
+        """ Usbcan dll (shared one loaded on first use if none given) """
+        if self._dll is None:
+            self._dll = load_dll()
+        return self._dll
+
+    @dll.setter
+    def dll(self, dll):
+        self._dll = dll
+
+    @property
+    def _ucanhandle(self):
+        """ USB-CAN handle (module opened on first use in lazy mode) """
+        if self._lazy:
+            self._open()
+        return self._handle
+
+    def _open(self, chans=None):
+        """ load dll and open module (once, lazy state restored if opening raises)
+        :param chans: channels initialized with their current configuration (see _can_init_hw) """
+        with self._open_lock:
+            if self._lazy is None:
+                return
+            lazy, self._lazy = self._lazy, None     # opening (or opened)
+            try:
+                logger.info("=================== Start Systec Init ===================")
+                logger.info("** Running DLL : %s", getattr(self.dll, "_name", self.dll))   # shouldn't call _name directly
+                self._can_init_hw(chans)
+            except Exception:
+                self._lazy = lazy
+                raise
+            self._lazy = False
+
+    def _can_init_hw(self, chans=None):
+        """ hardware init (discovery skipped when opened module serial is known from a previous opening: channels
+        infos refresh round trip saved, cached speed applied)
+        :param chans: channels initialized with their current configuration (channel 0 at cached or default speed if
+        None) """
+        logger.info("==================== H/W Systec Init ====================")
+        self.can_init_hw(self.device_nr, callback=self._event_cb)   # dll events dispatched to listeners (see add_event_listener)
+        self.init_ret = self._ucanret
         if not self.is_initialised():
-            # self.can_close()
             return self
-        self.set_hw_gen()
-        self.can_set_speed()
-        self.can_get_hw_infos()     # refresh hw infos to update channels config
-        print("============== Done initialing Systec unit. =============")
+        self.can_get_hw_infos()     # opened module serial first: cached results only apply to the very same module
+        serial = self.hw_infos.m_dwSerialNr
+        cached = None
+        if self.serial is not None and serial != self.serial:
+            logger.info("Opened module is %#x instead of %#x, running discovery.", serial, self.serial)
+        else:
+            cached = _hw_cache.get(serial)
+        self.serial = serial
+        self.set_hw_gen(cached["hw_gen"] if cached else "auto")    # from hw infos read above if not cached
+        if chans is not None:
+            for chan in chans:
+                self.can_init_can(chan)
+        elif cached:
+            self.params.m_bBTR0, self.params.m_bBTR1, self.params.m_dwBaudrate = cached["baud"]
+            self.can_init_can()
+        else:
+            self.can_set_speed()
+        if not cached:
+            self.can_get_hw_infos()     # refresh hw infos to update channels config (channels infos read before init)
+        self._cache_hw()
+        logger.info("============== Done initialing Systec unit. =============")
+        return self
+
+    def _cache_hw(self):
+        """ store opened module discovery results and channel 0 speed (applied on next opening of the same module) """
+        _hw_cache[self.serial] = {"product_code": self.hw_infos.m_dwProductCode, "hw_gen": self._hw_gen,
+                                  "baud": (self.params.m_bBTR0, self.params.m_bBTR1, self.params.m_dwBaudrate)}
+
+    def reopen(self, chans=None):
+        """ Close and open module again (discovery round trips skipped thanks to cached results), channels
+        configuration (speed, filters, buffers sizes) kept
+        :param chans: channels to initialize (channels initialized before closing if None)
+        :return: ucanSystec object """
+        chans = sorted(self.chan_init) if chans is None else chans
+        self.can_close()
+        self.clock.reset()  # device counter restarts
+        self._lazy = False
+        self._open(chans)
         return self
 
     def set_hw_gen(self, gen="auto"):
@@ -389,64 +754,152 @@ class ucanSystec(object):
         else:
             self._use_ex = True
 
-        print("Systec hardware set to {} gen of converters.".format(self._hw_gen))
+        logger.info("Systec hardware set to %s gen of converters.", self._hw_gen)
         return self._hw_gen
 
-    def can_set_speed(self, kbps=100000, dwBd=0):
+    def can_set_speed(self, kbps=100000, dwBd=0, chan=0):
         """ Set CAN bus speed
         :param kbps: speed to init
         :param dwBd: Baud rate registers value (refer to section 2.3.4)
+        :param chan: module channel
         :return: return error code """
+        params = self.chan_params[chan]
         if dwBd:
-            self.params.m_bBTR0 = c_ubyte(USBCAN_BAUD_USE_BTREX >> 8)
-            self.params.m_bBTR1 = c_ubyte(USBCAN_BAUD_USE_BTREX & 0xFF)
-            self.params.m_dwBaudrate = c_uint(baudrateSystec[self._hw_gen].get(kbps))
+            params.m_bBTR0 = c_ubyte(USBCAN_BAUD_USE_BTREX >> 8)
+            params.m_bBTR1 = c_ubyte(USBCAN_BAUD_USE_BTREX & 0xFF)
+            params.m_dwBaudrate = c_ulong(dwBd)
         else:
             try:
                 if self._hw_gen in ("G1", "G2"):
-                    self.params.m_bBTR0 = c_ubyte(baudrateSystec["G2"].get(kbps) >> 8)
-                    self.params.m_bBTR1 = c_ubyte(baudrateSystec["G2"].get(kbps) & 0xFF)
-                    self.params.m_dwBaudrate = c_uint(USBCAN_BAUDEX_USE_BTR01)
+                    params.m_bBTR0 = c_ubyte(baudrateSystec["G2"].get(kbps) >> 8)
+                    params.m_bBTR1 = c_ubyte(baudrateSystec["G2"].get(kbps) & 0xFF)
+                    params.m_dwBaudrate = c_ulong(USBCAN_BAUDEX_USE_BTR01)
                 elif self._hw_gen in ("G3", "G4"):
-                    self.params.m_bBTR0 = c_ubyte(USBCAN_BAUD_USE_BTREX >> 8)
-                    self.params.m_bBTR1 = c_ubyte(USBCAN_BAUD_USE_BTREX & 0xFF)
-                    self.params.m_dwBaudrate = c_uint(baudrateSystec[self._hw_gen].get(kbps))
+                    params.m_bBTR0 = c_ubyte(USBCAN_BAUD_USE_BTREX >> 8)
+                    params.m_bBTR1 = c_ubyte(USBCAN_BAUD_USE_BTREX & 0xFF)
+                    params.m_dwBaudrate = c_ulong(baudrateSystec[self._hw_gen].get(kbps))
                 else:
-                    print("Unhandled module gen {}. Cannot set speed.".format(self._hw_gen))
+                    logger.error("Unhandled module gen %s. Cannot set speed.", self._hw_gen)
                     return retSystec["USBCAN_ERRCMD_ILLBDR"]
             except TypeError:
-                print("Unhandled default speed {}. Try passing dwBd a custom value for desired speed instead.".format(kbps))
+                logger.error("Unhandled default speed %s. Try passing dwBd a custom value for desired speed instead.", kbps)
                 return retSystec["USBCAN_ERRCMD_ILLBDR"]
 
-        return self.can_init_can()
+        return self.can_init_can(chan)
+
+    def can_set_acceptance(self, amr=0xFFFFFFFF, acr=0, chan=0):
+        """ Set channel hardware acceptance filter (see ucanFilter to compile a filter from identifiers)
+        :param amr: Acceptance Mask Register (bit set: don't care, 0xFFFFFFFF receives all CAN messages)
+        :param acr: Acceptance Code Register
+        :param chan: module channel
+        :return: ucanSystec object """
+        params = self.chan_params[chan]
+        params.m_dwAMR = c_ulong(amr)
+        params.m_dwACR = c_ulong(acr)
+        return self.can_init_can(chan)
+
+    def can_set_buffers(self, rx_entries=None, tx_entries=None, chan=0):
+        """ Set channel dll buffers sizes (channel re-initialized: frames still buffered are lost)
+        :param rx_entries: number of entries of receive buffer (unchanged if None)
+        :param tx_entries: number of entries of transmit buffer (unchanged if None)
+        :param chan: module channel
+        :return: ucanSystec object """
+        params = self.chan_params[chan]
+        if rx_entries is not None:
+            params.m_wNrOfRxBufferEntries = rx_entries
+        if tx_entries is not None:
+            params.m_wNrOfTxBufferEntries = tx_entries
+        return self.can_init_can(chan)
 
     def can_close(self):
         """ release systec module communication """
-        print("=== Closing communication with systec USB-CAN module. ===")
+        logger.info("=== Closing communication with systec USB-CAN module. ===")
         if self.is_initialised():
-            self.can_deinit_can()
+            for chan in sorted(self.chan_init) or [None]:
+                self.can_deinit_can(chan)
             self.can_deinit_hw()
             return self._ucanret
 
+    def chan_infos(self, chan=0):
+        """ :param chan: module channel
+        :return: channel infos (tUcanChannelInfo, refreshed by can_get_hw_infos) """
+        return (self.chan0_infos, self.chan1_infos)[chan]
+
     def is_initialised(self):
         """ Returns True if usb/can module is initialized, False otherwise """
-        return True if self._ucanhandle.value > -1 else False
+        return True if self._handle.value > -1 else False
 
     @staticmethod
     def _get_errcode(srch):
         """ get error code srch from usb-can module """
-        for name, err in retSystec.items():
-            if err == srch:
-                return name
-        return "UNKNOWN USB-CAN module error"
+        return retSystecNames.get(srch, "UNKNOWN USB-CAN module error")
 
     @staticmethod
     def _get_status(srch):
         """ get status code srch from usb-can module """
-        for name, st in statusSystec.items():
-            if st == srch:
-                return name
-        return "UNKNOWN USB-CAN module status"
+        return "|".join(decode_status(srch))
+
+    def _ctl_call(self, fct, *args):
+        """ dll control call (serialized with other control calls, concurrent with reads and writes)
+        :param fct: dll function name (called with module handle and args)
+        :return: dll return code """
+        handle = self._ucanhandle   # opened first in lazy mode
+        with self._ctl_lock:
+            return getattr(self.dll, fct)(handle, *args)
+
+    def _fail(self, fct, verbose_only=False):
+        """ account and log failing dll call (last return code)
+        :param fct: dll function name
+        :param verbose_only: logged as debug unless verbose """
+        with self._count_lock:
+            self.fail_count[(fct, self._ucanret)] += 1
+        level = logging.DEBUG if verbose_only and not self.verb else logging.WARNING
+        if logger.isEnabledFor(level):
+            logger.log(level, "!FAIL! %s = %s (%#x)", fct, self._get_errcode(self._ucanret), self._ucanret)
+
+    def failures(self):
+        """ :return: dict of failing dll calls counts keyed by (dll function name, return code name) """
+        with self._count_lock:
+            counts = list(self.fail_count.items())
+        return dict(((fct, self._get_errcode(code)), nb) for (fct, code), nb in counts)
+
+    def stats(self):
+        """ :return: per channel traffic snapshot (totals, return codes and rates over sliding windows) """
+        return self.traffic.snapshot()
+
+    def stats_prometheus(self, **labels):
+        """ :param labels: extra labels (e.g. serial="...")
+        :return: per channel traffic in Prometheus text format """
+        return self.traffic.prometheus(labels=labels)
+
+    def statuses(self):
+        """ :return: dict of non OK status reads counts keyed by decoded status names """
+        with self._count_lock:
+            counts = list(self.status_count.items())
+        return dict((decode_status(st), nb) for st, nb in counts)
+
+    def _on_event(self, handle, event, chan, arg):
+        """ dll events callback (called from dll thread)
+        :param handle: USB-CAN handle
+        :param event: event code (see eventSystec)
+        :param chan: module channel
+        :param arg: callback argument (unused) """
+        for fct in self._event_listeners:
+            try:
+                fct(event, chan)
+            except Exception:
+                logger.exception("Dll event listener %r failed.", fct)
+
+    def add_event_listener(self, fct):
+        """ Add a listener to dll events (listeners are called from dll thread and shall not block)
+        :param fct: function called with event code (see eventSystec) and channel """
+        if fct not in self._event_listeners:
+            self._event_listeners = self._event_listeners + [fct]   # copy on write, safe while dispatching
+
+    def remove_event_listener(self, fct):
+        """ Remove a listener from dll events
+        :param fct: function previously added """
+        self._event_listeners = [f for f in self._event_listeners if f != fct]
 
     @can_err_code_wrapper()
     def can_connect_callback(self, event=eventSystec["USBCAN_EVENT_CONNECT"]):
@@ -461,29 +914,30 @@ class ucanSystec(object):
         :param event: function callback type
         :param chan: module channel
         :return: True if event occured / False otherwise """
-        return self.dll.UcanCallbackFktEx(self._ucanhandle, event, chan, None)
+        return self._ctl_call("UcanCallbackFktEx", event, chan, None)
 
     @can_err_code_wrapper()
     def can_get_err_cnt(self, chan=0):
         """ Get error count
         :param chan: module channel
         :return: error count on rx and tx """
-        self._ucanret = self.dll.UcanGetCanErrorCounterEx(self._ucanhandle, chan, byref(self.tx_err_cnt), byref(self.rx_err_cnt))
+        self._ucanret = self._ctl_call("UcanGetCanErrorCounterEx", chan, byref(self.tx_err_cnt), byref(self.rx_err_cnt))
         if self._ucanret:
-            print("!FAIL! UcanGetCanErrorCounterEx = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanGetCanErrorCounterEx")
+        else:
+            self.traffic.err_cnt(chan, self.tx_err_cnt.value, self.rx_err_cnt.value)
         return self
 
     @can_err_code_wrapper()
-    def can_get_msg_pending(self, chan=0):
+    def can_get_msg_pending(self, chan=0, flags=5):
         """ Get pending messages count
         :param chan: module channel
-        :return: rx pending messages count from usb-can module """
-        self._ucanret = self.dll.UcanGetMsgPending(self._ucanhandle, chan,
-                                                   c_long(5), byref(self.msg_pending))
+        :param flags: pendingSystec flags combination of counted buffers (rx dll and firmware buffers by default)
+        :return: pending messages count from usb-can module """
+        self._ucanret = self._ctl_call("UcanGetMsgPending", chan, c_long(flags), byref(self.msg_pending))
         if self._ucanret:
-            self.msg_pending = c_ubyte(0)
-            if self.verb is True:
-                print("!FAIL! UcanGetMsgPending = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self.msg_pending.value = 0
+            self._fail("UcanGetMsgPending", verbose_only=True)
         return self.msg_pending
 
     @can_err_code_wrapper()
@@ -491,90 +945,304 @@ class ucanSystec(object):
         """ Get messages count
         :param chan: module channel
         :return: messages count from usb-can module """
-        self._ucanret = self.dll.UcanGetMsgCountInfoEx(self._ucanhandle, chan, byref(self.msgcount))
+        self._ucanret = self._ctl_call("UcanGetMsgCountInfoEx", chan, byref(self.msgcount))
         if self._ucanret:
             self.msgcount = tUcanMsgCountInfo(0, 0)
-            if self.verb is True:
-                print("!FAIL! UcanGetMsgCountInfoEx = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanGetMsgCountInfoEx", verbose_only=True)
         return self.msgcount
 
     @can_err_code_wrapper()
     def can_get_msg(self, chan=0, nb_msg=0):
         """ get message from usb-can module (channel 0)
         :param chan: module channel (get messages from any channel if set to 255)
-        :param nb_msg: max number of messages to read at once (1 message at a time if set to 0)
+        :param nb_msg: max number of messages to read at once (1 message at a time if set to 0),
+                       messages are read into rx_buffer when more than 1 (see can_read_msgs)
         :return: return error code """
-        self._ucanret = self.dll.UcanReadCanMsgEx(self._ucanhandle, byref(c_long(chan)), byref(self.rxcan), nb_msg)
-        if self._ucanret and self.verb is True:
-            print("!FAIL! UcanReadCanMsgEx = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
-        return self._ucanret
+        if nb_msg > 1:
+            self.can_read_msgs(chan, nb_msg)
+            return self._ucanret
+        tls = self._tls
+        rx_chan = tls.rx_chan     # channel of the message read (when reading from any channel)
+        rx_chan.value = chan
+        handle = self._ucanhandle
+        with self._rx_lock:
+            ret = tls._ucanret = self.dll.UcanReadCanMsgEx(handle, byref(rx_chan), byref(tls.rxcan), None)
+            if not 0 < ret <= retSystec["USBCAN_WARN_NODATA"]:
+                self.clock.update(tls.rxcan.dw_time, clock_ns())
+        if ret:
+            self._fail("UcanReadCanMsgEx", verbose_only=True)
+            if ret != retSystec["USBCAN_WARN_NODATA"]:
+                self.traffic.code(rx_chan.value, ret)
+        if not 0 < ret <= retSystec["USBCAN_WARN_NODATA"]:
+            self.traffic.rx(rx_chan.value, 1, min(tls.rxcan.b_dlc, 8))
+        return ret
+
+    @can_err_code_wrapper()
+    def can_read_msgs(self, chan=0, nb_msg=0, buf=None):
+        """ get a batch of messages from usb-can module into rx_buffer (single dll call)
+        :param chan: module channel (get messages from any channel if set to 255)
+        :param nb_msg: max number of messages to read at once (whole buffer if set to 0, rx_buffer grows if needed)
+        :param buf: tCanMsgStruct ctypes array to read into instead of rx_buffer
+        :return: number of messages read (view on them given by rx_frames) """
+        tls = self._tls
+        if buf is None:
+            if nb_msg > len(tls.rx_buffer):
+                tls.rx_buffer = (tCanMsgStruct * nb_msg)()
+            buf = tls.rx_buffer
+        tls._rx_last = buf
+        rx_chan, rx_count = tls.rx_chan, tls._rx_count
+        rx_chan.value = chan
+        rx_count.value = min(nb_msg, len(buf)) if nb_msg else len(buf)
+        handle = self._ucanhandle
+        with self._rx_lock:
+            ret = tls._ucanret = self.dll.UcanReadCanMsgEx(handle, byref(rx_chan), buf, byref(rx_count))
+            if rx_count.value and not 0 < ret <= retSystec["USBCAN_WARN_NODATA"]:
+                self.clock.update(buf[rx_count.value - 1].dw_time, clock_ns())  # one sample per batch
+        if ret:
+            self._fail("UcanReadCanMsgEx", verbose_only=True)
+            if ret != retSystec["USBCAN_WARN_NODATA"]:
+                self.traffic.code(rx_chan.value, ret)
+        if 0 < ret <= retSystec["USBCAN_WARN_NODATA"]:
+            rx_count.value = 0    # errors and no data: nothing filled (other warnings come with valid messages)
+        elif rx_count.value:
+            self.traffic.rx(rx_chan.value, rx_count.value, _payload_bytes(buf, rx_count.value))
+        return rx_count.value
+
+    def rx_stamps(self, frames=None):
+        """ Timestamps of received frames on the common host timeline (comparable between modules)
+        :param frames: sequence of tCanMsgStruct read from this module (last batch of calling thread if None)
+        :return: (array of 64 bits device times in ms, array of host clock_ns estimates) """
+        return self.clock.stamp(self.rx_frames if frames is None else frames)
+
+    @property
+    def rx_frames(self):
+        """ :return: zero-copy view (ctypes array) on messages filled by last can_read_msgs call of calling thread """
+        tls = self._tls
+        return (tCanMsgStruct * tls._rx_count.value).from_buffer(tls._rx_last)
 
     @can_err_code_wrapper()
     def can_send_msg(self, message, chan=0):
         """ send message to usb-can module (channel 0)
-        :param message: message to send
+        :param message: message to send (copied, caller message is never modified, dw_time sent as is)
+        :param chan: module channel
+        :return: return error code """
+        tls = self._tls
+        txcan = tls.txcan
+        memmove(addressof(txcan), addressof(message), _CAN_MSG_SIZE)
+        txcan.b_ff = 0x80
+        handle = self._ucanhandle
+        with self._tx_lock:
+            ret = tls._ucanret = self.dll.UcanWriteCanMsgEx(handle, chan, byref(txcan), None)
+        if ret:
+            self._fail("UcanWriteCanMsgEx", verbose_only=True)
+            self.traffic.code(chan, ret)
+        if not 0 < ret < retSystec["USBCAN_WARN_NODATA"]:
+            self.traffic.tx(chan, 1, min(txcan.b_dlc, 8))
+        return ret
+
+    @can_err_code_wrapper()
+    def send_many(self, frames, chan=0, timeout=0):
+        """ send a batch of messages to usb-can module (single dll call, resumed on partial writes)
+        Frames are sent as given (b_ff and dw_time are left untouched), caller frames are never modified.
+        When dll tx buffer is full, remaining frames are resubmitted once it had time to drain (at least one pass,
+        then until timeout): frames still not accepted are left to the caller (_ucanret gives the dll code).
+        :param frames: sequence of tCanMsgStruct (a tCanMsgStruct ctypes array is sent without packing)
+        :param chan: module channel
+        :param timeout: time in s to keep resubmitting remaining frames when dll tx buffer is full (None for a single
+        dll write: never waits, frames not accepted are left to the caller at once)
+        :return: number of messages accepted by the dll """
+        tls = self._tls
+        if isinstance(frames, Array) and frames._type_ is tCanMsgStruct:
+            buf = frames
+        else:
+            frames = list(frames)
+            if len(frames) > len(tls.tx_buffer):
+                tls.tx_buffer = (tCanMsgStruct * len(frames))()
+            buf = tls.tx_buffer
+            for idx, frame in enumerate(frames):
+                buf[idx] = frame    # copied into the buffer
+        nb_msg = len(frames)
+        sent = resubmits = 0
+        deadline = _clock() + (timeout or 0)
+        tx_count = tls._tx_count
+        handle = self._ucanhandle
+        while sent < nb_msg:
+            tx_count.value = nb_msg - sent
+            with self._tx_lock:
+                ret = tls._ucanret = self.dll.UcanWriteCanMsgEx(handle, chan, byref(buf, sent * _CAN_MSG_SIZE),
+                                                                byref(tx_count))
+            if ret:
+                self.traffic.code(chan, ret)
+            if ret == retSystec["USBCAN_ERR_DLL_TXFULL"]:
+                tx_count.value = 0    # nothing stored
+            elif ret not in (retSystec["USBCAN_SUCCESSFUL"], retSystec["USBCAN_WARN_TXLIMIT"],
+                             retSystec["USBCAN_WARN_FW_TXOVERRUN"], retSystec["USBCAN_WARN_FW_RXOVERRUN"]):
+                break
+            sent += min(tx_count.value, nb_msg - sent)
+            if sent < nb_msg:
+                if timeout is None or (resubmits and _clock() >= deadline):
+                    break
+                resubmits += 1
+                if ret in (retSystec["USBCAN_ERR_DLL_TXFULL"], retSystec["USBCAN_WARN_TXLIMIT"]):
+                    time.sleep(0.001)   # let the dll drain its tx buffer
+        if tls._ucanret:
+            self._fail("UcanWriteCanMsgEx", verbose_only=True)
+        if sent:
+            self.traffic.tx(chan, sent, _payload_bytes(buf, sent))
+        return sent
+
+    @can_err_code_wrapper()
+    def can_define_cyclic(self, frames, chan=0):
+        """ Load a list of cyclic CAN messages into module firmware (transmission stopped and restarted
+        with the same flags if the list was running)
+        :param frames: sequence of (tCanMsgStruct or CanFrame, period in ms), up to USBCAN_MAX_CYCCANMSG
+        :param chan: module channel
+        :return: return error code """
+        frames = list(frames)
+        if len(frames) > USBCAN_MAX_CYCCANMSG:
+            logger.error("Cannot define %d cyclic CAN messages (%d max).", len(frames), USBCAN_MAX_CYCCANMSG)
+            return retSystec["USBCAN_ERR_ILLPARAM"]
+        buf = self._tls._cyclic_buffer
+        memset(addressof(buf), 0, sizeof(buf))
+        for idx, (frame, period) in enumerate(frames):
+            if isinstance(frame, CanFrame):
+                frame.to_struct(buf[idx])
+            else:
+                buf[idx] = frame    # copied into the buffer
+            buf[idx].dw_time = c_ulong(period)     # cycle time in ms
+        self._ucanret = self._ctl_call("UcanDefineCyclicCanMsg", chan, byref(buf), len(frames))
+        if self._ucanret == retSystec["USBCAN_ERRCMD_RUNNING"]:
+            flags = self.cyclic_flags.get(chan, cyclicSystec["USBCAN_CYCLIC_FLAG_START"])
+            if not self.can_enable_cyclic(chan, cyclicSystec["USBCAN_CYCLIC_FLAG_STOP"]):
+                self._ucanret = self._ctl_call("UcanDefineCyclicCanMsg", chan, byref(buf), len(frames))
+                if not self._ucanret and frames:
+                    self.can_enable_cyclic(chan, flags)
+        if self._ucanret:
+            self._fail("UcanDefineCyclicCanMsg")
+        else:
+            self.cyclic[chan] = [(tCanMsgStruct.from_buffer_copy(buf[idx]), buf[idx].dw_time) for idx in range(len(frames))]
+        return self._ucanret
+
+    @can_err_code_wrapper()
+    def can_read_cyclic(self, chan=0):
+        """ Read the list of cyclic CAN messages loaded in module firmware
         :param chan: module channel
+        :return: list of (tCanMsgStruct, period in ms) """
+        self._tls._cyclic_count.value = USBCAN_MAX_CYCCANMSG
+        self._ucanret = self._ctl_call("UcanReadCyclicCanMsg", chan, byref(self._tls._cyclic_buffer),
+                                       byref(self._tls._cyclic_count))
+        if self._ucanret:
+            self._fail("UcanReadCyclicCanMsg")
+            return []
+        return [(tCanMsgStruct.from_buffer_copy(msg), msg.dw_time)
+                for msg in self._tls._cyclic_buffer[:min(self._tls._cyclic_count.value, USBCAN_MAX_CYCCANMSG)]]
+
+    @can_err_code_wrapper()
+    def can_enable_cyclic(self, chan=0, flags=cyclicSystec["USBCAN_CYCLIC_FLAG_START"]):
+        """ Start or stop the transmission of cyclic CAN messages
+        :param chan: module channel
+        :param flags: cyclicSystec flags combination (USBCAN_CYCLIC_FLAG_STOP stops transmission)
         :return: return error code """
-        self.txcan = message
-        self.txcan.b_ff = c_ubyte(0x80)
-        self.txcan.dw_time = c_ulong(long(time.time()))
-        self._ucanret = self.dll.UcanWriteCanMsgEx(self._ucanhandle, chan, byref(self.txcan), None)
-        if self._ucanret and self.verb is True:
-            print("!FAIL! UcanWriteCanMsgEx = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+        self._ucanret = self._ctl_call("UcanEnableCyclicCanMsg", chan, c_ulong(flags))
+        if self._ucanret:
+            self._fail("UcanEnableCyclicCanMsg")
+        else:
+            self.cyclic_flags[chan] = flags
         return self._ucanret
 
+    def can_start_cyclic(self, chan=0, sequential=False, echo=True, locked=()):
+        """ Start the transmission of cyclic CAN messages
+        :param chan: module channel
+        :param sequential: list sent in sequential mode (one message per period) instead of parallel mode
+        :param echo: sent messages are received back
+        :param locked: indexes of messages of the list not to send
+        :return: return error code """
+        flags = cyclicSystec["USBCAN_CYCLIC_FLAG_START"]
+        if sequential:
+            flags |= cyclicSystec["USBCAN_CYCLIC_FLAG_SEQUMODE"]
+        if not echo:
+            flags |= cyclicSystec["USBCAN_CYCLIC_FLAG_NOECHO"]
+        for idx in locked:
+            flags |= cyclicSystec["USBCAN_CYCLIC_FLAG_LOCK_{}".format(idx)]
+        return self.can_enable_cyclic(chan, flags)
+
+    def can_stop_cyclic(self, chan=0):
+        """ Stop the transmission of cyclic CAN messages
+        :param chan: module channel
+        :return: return error code """
+        return self.can_enable_cyclic(chan, cyclicSystec["USBCAN_CYCLIC_FLAG_STOP"])
+
     @can_err_code_wrapper()
     def can_reset(self, chan=0, flags=0):
         """ reset of the usb-can module
         :param chan: module channel
         :param flags: custom module reset flags
         :return: return error code """
-        self._ucanret = self.dll.UcanResetCanEx(self._ucanhandle, chan, c_long(flags))
+        self._ucanret = self._ctl_call("UcanResetCanEx", chan, c_long(flags))
         if self._ucanret:
-            print("!FAIL! UcanResetCanEx = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanResetCanEx")
         return self._ucanret
 
     @can_err_code_wrapper()
     def can_init_hw(self, nbr=255, callback=None):
         """ Initialize module through dll
         :param nbr: Number of the module to init (255 means any)
-        :param callback: Callback function
+        :param callback: Callback function (UcanInitHardwareEx is used for tCallbackFktEx callbacks)
         :return: ucanSystec object """
-        self._ucanret = self.dll.UcanInitHardware(byref(self._ucanhandle), nbr, callback)
+        with self._ctl_lock:
+            if isinstance(callback, tCallbackFktEx):
+                self._ucanret = self.dll.UcanInitHardwareEx(byref(self._handle), nbr, callback, None)
+            else:
+                self._ucanret = self.dll.UcanInitHardware(byref(self._handle), nbr, callback)
         if self._ucanret:
-            print("!FAIL! UcanInitHardware = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanInitHardware")
         return self
 
     @can_err_code_wrapper()
     def can_init_can(self, chan=0):
         """ Initialize can through dll
-        :param chan: module channel
+        :param chan: module channel (configured from chan_params[chan], re-initialized if already initialized)
         :return: ucanSystec object """
+        params = self.chan_params[chan]
+        if chan in self.chan_init:
+            self.can_deinit_can(chan)
         if self._use_ex is True:
-            self._ucanret = self.dll.UcanInitCanEx2(self._ucanhandle, chan, byref(self.params))
+            self._ucanret = self._ctl_call("UcanInitCanEx2", chan, byref(params))
         else:
-            self._ucanret = self.dll.UcanInitCan(self._ucanhandle, self.params.btr_h, self.params.btr_l,
-                                                 self.params.dw_amr, self.params.dw_acr)
+            self._ucanret = self._ctl_call("UcanInitCan", params.m_bBTR0, params.m_bBTR1,
+                                           params.m_dwAMR, params.m_dwACR)
         if self._ucanret:
-            print("!FAIL! UcanInitCanEx2 = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanInitCanEx2")
+        else:
+            self.chan_init.add(chan)
+            if chan == 0 and self.serial in _hw_cache:
+                self._cache_hw()    # speed applied on next opening
         return self
 
     @can_err_code_wrapper()
     def can_deinit_hw(self):
         """ Uninit module through dll
         :return: ucanSystec object """
-        self._ucanret = self.dll.UcanDeinitHardware(self._ucanhandle)
+        self._ucanret = self._ctl_call("UcanDeinitHardware")
         if self._ucanret:
-            print("!FAIL! UcanDeinitHardware = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanDeinitHardware")
+        else:
+            self._handle.value = -1
         return self
 
     @can_err_code_wrapper()
-    def can_deinit_can(self):
+    def can_deinit_can(self, chan=None):
         """ Uninit can through dll
+        :param chan: module channel (channel 0 through UcanDeinitCan if None)
         :return: ucanSystec object """
-        self._ucanret = self.dll.UcanDeinitCan(self._ucanhandle)
+        if chan is None:
+            self._ucanret = self._ctl_call("UcanDeinitCan")
+        else:
+            self._ucanret = self._ctl_call("UcanDeinitCanEx", chan)
         if self._ucanret:
-            print("!FAIL! UcanDeinitCan = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanDeinitCan")
+        else:
+            self.chan_init.discard(chan or 0)
         return self
 
     @can_err_code_wrapper()
@@ -582,9 +1250,9 @@ class ucanSystec(object):
         """ sets can module with a new device nr
         :param num: new num to affect to the module (254-255 reserved)
         :return: ucanSystec object """
-        self._ucanret = self.dll.UcanSetDeviceNr(self._ucanhandle, num)
+        self._ucanret = self._ctl_call("UcanSetDeviceNr", num)
         if self._ucanret:
-            print("!FAIL! UcanSetDeviceNr = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanSetDeviceNr")
         return self
 
     @can_err_code_wrapper()
@@ -595,9 +1263,9 @@ class ucanSystec(object):
         :param bdrate: Baud rate register for all sysWORXX modules (refer to section 2.3.4)
         :param chan: module channel
         :return: ucanSystec object """
-        self._ucanret = self.dll.UcanSetBaudrateEx(self._ucanhandle, chan, btrh, btrl, bdrate)
+        self._ucanret = self._ctl_call("UcanSetBaudrateEx", chan, btrh, btrl, bdrate)
         if self._ucanret:
-            print("!FAIL! UcanSetBaudrateEx = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanSetBaudrateEx")
         return self
 
     @can_err_code_wrapper()
@@ -606,9 +1274,9 @@ class ucanSystec(object):
         :param chan: module channel
         :param timeout: timeout value in ms
         :return: error code returned by dll """
-        self._ucanret = self.dll.UcanSetTxTimeout(self._ucanhandle, chan, timeout)
+        self._ucanret = self._ctl_call("UcanSetTxTimeout", chan, timeout)
         if self._ucanret:
-            print("!FAIL! UcanSetTxTimeout = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+            self._fail("UcanSetTxTimeout")
         return self._ucanret
 
     @can_err_code_wrapper()
@@ -616,21 +1284,28 @@ class ucanSystec(object):
         """ get status of usb-can module
         :param chan: module channel
         :return: ucanSystec object """
-        self._ucanret = self.dll.UcanGetStatusEx(self._ucanhandle, chan, byref(self.status))
-        if self._ucanret and self.verb is True:
-            print("!FAIL! UcanGetStatusEx = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
-        if self.status:
-            print("!WARNING! UcanGetStatusEx = {} ({})".format(self._get_status(self.status), hex(self.status)))
+        tls = self._tls
+        handle = self._ucanhandle
+        with self._ctl_lock:
+            tls._ucanret = self.dll.UcanGetStatusEx(handle, chan, byref(tls.status))
+        if tls._ucanret:
+            self._fail("UcanGetStatusEx", verbose_only=True)
+        can_status = tls.status.m_wCanStatus
+        if can_status:
+            with self._count_lock:
+                self.status_count[can_status] += 1
+            logger.log(logging.WARNING if self.verb else logging.DEBUG, "!WARNING! UcanGetStatusEx = %s (%#x)",
+                       _LazyStatus(can_status), can_status)
         return self
 
     @can_err_code_wrapper()
     def can_get_hw_infos(self):
         """ Get module informations
         :return: error code returned by dll """
-        self._ucanret = self.dll.UcanGetHardwareInfoEx2(self._ucanhandle, byref(self.hw_infos),
-                                                        byref(self.chan0_infos), byref(self.chan1_infos))
-        if self._ucanret and self.verb is True:
-            print("!FAIL! UcanGetHardwareInfoEx2 = {} ({})".format(self._get_errcode(self._ucanret), hex(self._ucanret)))
+        self._ucanret = self._ctl_call("UcanGetHardwareInfoEx2", byref(self.hw_infos),
+                                       byref(self.chan0_infos), byref(self.chan1_infos))
+        if self._ucanret:
+            self._fail("UcanGetHardwareInfoEx2", verbose_only=True)
         return self._ucanret
 
     @staticmethod
@@ -651,7 +1326,109 @@ class ucanSystec(object):
     @can_err_code_wrapper()
     def can_get_fw_version(self):
         """ :return: usb-can Firmware version """
-        return self.str_version(self.dll.UcanGetFwVersion(self._ucanhandle))
+        return self.str_version(self._ctl_call("UcanGetFwVersion"))
+
+
+# noinspection PyPep8Naming
+class ucanReader(object):
+    """ Event driven reader: dll receive/status events wake a thread draining all pending frames at once """
+    def __init__(self, bus, chan=255, nb_msg=0, on_frames=None, on_status=None):
+        """ reader init
+        :param bus: ucanSystec instance
+        :param chan: module channel to read (255 for any channel)
+        :param nb_msg: max number of messages per dll read (whole bus rx_buffer if set to 0)
+        :param on_frames: function called with each batch of frames (view valid until function returns)
+        :param on_status: function called with module status (tStatusStruct) on status events """
+        self.bus = bus
+        self.chan = chan
+        self.nb_msg = nb_msg
+        self._frames_cb = [on_frames] if on_frames else []
+        self._status_cb = [on_status] if on_status else []
+        self._wake = threading.Event()
+        self._status_pending = False
+        self._running = False
+        self._thread = None
+
+    def subscribe(self, on_frames=None, on_status=None):
+        """ Add consumers of frames batches and/or status changes
+        :param on_frames: function called with each batch of frames (view valid until function returns)
+        :param on_status: function called with module status (tStatusStruct) on status events """
+        if on_frames:
+            self._frames_cb = self._frames_cb + [on_frames]
+        if on_status:
+            self._status_cb = self._status_cb + [on_status]
+
+    def unsubscribe(self, on_frames=None, on_status=None):
+        """ Remove consumers of frames batches and/or status changes
+        :param on_frames: function given to subscribe
+        :param on_status: function given to subscribe """
+        if on_frames:
+            self._frames_cb = [fct for fct in self._frames_cb if fct != on_frames]
+        if on_status:
+            self._status_cb = [fct for fct in self._status_cb if fct != on_status]
+
+    def _on_event(self, event, chan):
+        """ dll events listener: only wakes reader thread """
+        if event == eventSystec["USBCAN_EVENT_RECEIVE"]:
+            self._wake.set()
+        elif event == eventSystec["USBCAN_EVENT_STATUS"]:
+            self._status_pending = True
+            self._wake.set()
+
+    def drain(self):
+        """ Read all pending frames (batched) and hand them to consumers
+        :return: number of frames read """
+        total = 0
+        while True:
+            nb = self.bus.can_read_msgs(self.chan, self.nb_msg)
+            if nb <= 0:
+                break
+            total += nb
+            frames = self.bus.rx_frames
+            for fct in self._frames_cb:
+                try:
+                    fct(frames)
+                except Exception:
+                    logger.exception("Frames consumer %r failed.", fct)
+        return total
+
+    def _run(self):
+        """ reader thread: sleeps until a dll event occurs (no polling) """
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+            if not self._running:
+                break
+            if self._status_pending:
+                self._status_pending = False
+                self.bus.can_get_status(self.chan if self.chan != 255 else 0)
+                for fct in self._status_cb:
+                    try:
+                        fct(self.bus.status)
+                    except Exception:
+                        logger.exception("Status consumer %r failed.", fct)
+            self.drain()
+
+    def start(self):
+        """ Start reader thread
+        :return: ucanReader object """
+        if not self._running:
+            self._running = True
+            self.bus.add_event_listener(self._on_event)
+            self._thread = threading.Thread(target=self._run, name="ucanReader")
+            self._thread.daemon = True
+            self._thread.start()
+            self._wake.set()    # drain frames received before start
+        return self
+
+    def stop(self, timeout=None):
+        """ Stop reader thread
+        :param timeout: time in s to wait for thread to end """
+        if self._running:
+            self._running = False
+            self.bus.remove_event_listener(self._on_event)
+            self._wake.set()
+            self._thread.join(timeout)
 
 
 # test des differentes fonctions de CANId
@@ -664,10 +1441,16 @@ if __name__ == "__main__":
         NR_POLLS = 30
         print("NR_POLLS = {}".format(NR_POLLS))
 
+        def print_frames(frames):
+            """ print received frames """
+            for frame in frames:
+                print(frame)
+
+        reader = ucanReader(can_bus, on_frames=print_frames).start()
         for i in range(NR_POLLS):
             can_bus.can_send_msg(msg)
             time.sleep(0.4)
-            can_bus.can_get_msg()
+        reader.stop()
 
         can_bus.can_close()
 
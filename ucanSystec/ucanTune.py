@@ -0,0 +1,222 @@
+# -*- coding:utf-8 -*-
+"""
+ucanTune.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN dll buffers auto-tuning (sizes driven by overruns and pending peaks, applied on quiet bus)
+"""
+
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from .ucanSystec import retSystec, retSystecNames, pendingSystec
+from .ucanStats import RX_FRAMES, TX_FRAMES
+
+__all__ = ['ucanTuneAction', 'ucanBufferTuner']
+
+logger = logging.getLogger(__name__)
+
+_clock = getattr(time, "monotonic", time.time)
+
+# buffers resize done by tuner (ret: can_init_can return code, sizes restored when not successful)
+ucanTuneAction = namedtuple('ucanTuneAction', ['chan', 'time', 'reason', 'rx_from', 'rx_to', 'tx_from', 'tx_to',
+                                               'ret'])
+
+_RX_OVERRUN = retSystec["USBCAN_WARN_DLL_RXOVERRUN"]
+_TX_FULL = retSystec["USBCAN_ERR_DLL_TXFULL"]
+_RX_PENDING = pendingSystec["USBCAN_PENDING_FLAG_RX_DLL"]
+_TX_PENDING = pendingSystec["USBCAN_PENDING_FLAG_TX_DLL"]
+
+
+def _pow2(size):
+    """ :return: power of 2 greater or equal to size """
+    return 1 << max(int(size) - 1, 1).bit_length()
+
+
+class _Tuned(object):
+    """ channel tuning state over current window """
+    def __init__(self, overruns, tx_full, now):
+        self.start = now            # window start time
+        self.rx_peak = 0
+        self.tx_peak = 0
+        self.overruns = overruns    # USBCAN_WARN_DLL_RXOVERRUN count at window start
+        self.tx_full = tx_full      # USBCAN_ERR_DLL_TXFULL count at window start
+        self.calm = 0               # consecutive windows without pressure
+        self.quiet = None           # time since buffers are seen empty without traffic (None while busy)
+        self.frames = None          # rx + tx frames count at last sample
+        self.rx_floor = 0           # shrink bounds (sizes below were seen overrun)
+        self.tx_floor = 0
+        self.target = None          # (rx entries, tx entries, reason) waiting for a quiet window
+
+
+# noinspection PyPep8Naming
+class ucanBufferTuner(object):
+    """ Buffers tuner thread: samples dll buffers occupancy of initialized channels, grows buffers after overruns
+    (or peaks close to their size), shrinks them after several windows far below their size.
+    Sizes that overran are never chosen again when shrinking (no oscillation on bursty buses).
+    Channels are re-initialized only once both buffers stayed empty and no frame was read or sent (bus.traffic) for a
+    quiet period (a fast reader keeps buffers empty under load), actions are recorded (see actions and settings to
+    pin tuned sizes in configuration). """
+    def __init__(self, bus, period=0.05, window=10.0, quiet=0.2, limits=(64, 16384), high=0.75, low=0.25,
+                 shrink_after=6, on_action=None):
+        """ tuner init
+        :param bus: ucanSystec instance
+        :param period: time in s between two occupancy samples
+        :param window: time in s over which overruns and pending peaks are evaluated
+        :param quiet: time in s without traffic (and with empty buffers) before re-initializing a channel
+        :param limits: (min, max) number of entries per buffer
+        :param high: peak ratio of buffer size triggering growth
+        :param low: peak ratio of buffer size allowing shrink
+        :param shrink_after: number of consecutive windows below low ratio (and without overrun) before shrinking
+        :param on_action: function called with each ucanTuneAction (from tuner thread) """
+        self.bus = bus
+        self.period = period
+        self.window = window
+        self.quiet = quiet
+        self.limits = limits
+        self.high = high
+        self.low = low
+        self.shrink_after = shrink_after
+        self.actions = []           # ucanTuneAction history
+        self._action_cb = [on_action] if on_action else []
+        self._chans = {}            # channel: _Tuned
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def subscribe(self, on_action):
+        """ Add a consumer of tuning actions
+        :param on_action: function called with each ucanTuneAction (from tuner thread) """
+        self._action_cb = self._action_cb + [on_action]
+
+    def settings(self):
+        """ :return: dict of current (rx entries, tx entries) per initialized channel (values to pin in config) """
+        params = self.bus.chan_params
+        return dict((chan, (params[chan].m_wNrOfRxBufferEntries, params[chan].m_wNrOfTxBufferEntries))
+                    for chan in sorted(self.bus.chan_init))
+
+    def _counts(self, chan):
+        """ :return: (dll rx overruns, dll tx full) counts of channel """
+        return self.bus.traffic.counters(chan, (_RX_OVERRUN, _TX_FULL))[1]
+
+    def _frames(self, chan):
+        """ :return: rx + tx frames count of channel """
+        totals = self.bus.traffic.counters(chan)[0]
+        return totals[RX_FRAMES] + totals[TX_FRAMES]
+
+    def _clamp(self, size):
+        """ :return: size bounded by limits """
+        return min(max(int(size), self.limits[0]), self.limits[1])
+
+    def _evaluate(self, chan, state, now):
+        """ window end: choose buffers sizes for channel """
+        params = self.bus.chan_params[chan]
+        rx_size, tx_size = params.m_wNrOfRxBufferEntries, params.m_wNrOfTxBufferEntries
+        overruns, tx_full = self._counts(chan)
+        rx_over, tx_over = overruns - state.overruns, tx_full - state.tx_full
+        rx, tx, reasons = rx_size, tx_size, []
+        if rx_over or state.rx_peak >= self.high * rx_size:
+            rx = self._clamp(_pow2(max(2 * rx_size, 2 * state.rx_peak)))
+            if rx_over:
+                state.rx_floor = rx
+            reasons.append("rx overrun x{}".format(rx_over) if rx_over else "rx peak {}".format(state.rx_peak))
+        if tx_over or state.tx_peak >= self.high * tx_size:
+            tx = self._clamp(_pow2(max(2 * tx_size, 2 * state.tx_peak)))
+            if tx_over:
+                state.tx_floor = tx
+            reasons.append("tx full x{}".format(tx_over) if tx_over else "tx peak {}".format(state.tx_peak))
+        pressure = bool(reasons)
+        state.calm = 0 if pressure else state.calm + 1
+        if state.calm >= self.shrink_after:
+            if state.rx_peak <= self.low * rx_size:
+                rx = self._clamp(max(rx_size // 2, _pow2(2 * state.rx_peak), state.rx_floor))
+            if state.tx_peak <= self.low * tx_size:
+                tx = self._clamp(max(tx_size // 2, _pow2(2 * state.tx_peak), state.tx_floor))
+            if (rx, tx) != (rx_size, tx_size):
+                reasons.append("{} calm windows".format(state.calm))
+                state.calm = 0
+        if (rx, tx) != (rx_size, tx_size):
+            state.target = (rx, tx, ", ".join(reasons))
+        elif pressure:
+            state.target = None     # already at limits
+        state.start, state.rx_peak, state.tx_peak = now, 0, 0
+        state.overruns, state.tx_full = overruns, tx_full
+
+    def _apply(self, chan, state, now):
+        """ re-initialize channel with target buffers sizes """
+        bus = self.bus
+        params = bus.chan_params[chan]
+        rx_size, tx_size = params.m_wNrOfRxBufferEntries, params.m_wNrOfTxBufferEntries
+        rx, tx, reason = state.target
+        state.target = None
+        bus.can_set_buffers(rx, tx, chan)
+        ret = bus._ucanret
+        if ret:
+            logger.error("Channel %d buffers resize to %d/%d failed (%s), restoring %d/%d.", chan, rx, tx,
+                         retSystecNames.get(ret, hex(ret)), rx_size, tx_size)
+            bus.can_set_buffers(rx_size, tx_size, chan)
+        else:
+            logger.info("Channel %d buffers resized from %d/%d to %d/%d (%s).", chan, rx_size, tx_size, rx, tx, reason)
+        action = ucanTuneAction(chan, now, reason, rx_size, rx, tx_size, tx, ret)
+        self.actions.append(action)
+        state.overruns, state.tx_full = self._counts(chan)
+        for fct in self._action_cb:
+            try:
+                fct(action)
+            except Exception:
+                logger.exception("Tuning action consumer %r failed.", fct)
+
+    def step(self):
+        """ Sample occupancy of initialized channels, evaluate windows, resize on quiet bus (done by tuner thread) """
+        bus = self.bus
+        now = _clock()
+        for chan in sorted(bus.chan_init):
+            state = self._chans.get(chan)
+            if state is None:
+                state = self._chans[chan] = _Tuned(*(self._counts(chan) + (now,)))
+            pending = bus.can_get_msg_pending(chan, _RX_PENDING)
+            if pending == -1 or bus._ucanret:
+                continue    # dll failure (already logged): sampled again next period
+            rx_pending = pending.value
+            pending = bus.can_get_msg_pending(chan, _TX_PENDING)
+            if pending == -1 or bus._ucanret:
+                continue
+            tx_pending = pending.value
+            frames, state.frames = state.frames, self._frames(chan)
+            state.rx_peak = max(state.rx_peak, rx_pending)
+            state.tx_peak = max(state.tx_peak, tx_pending)
+            if now - state.start >= self.window:
+                self._evaluate(chan, state, now)
+            if rx_pending or tx_pending or frames != state.frames:
+                state.quiet = None
+            elif state.quiet is None:
+                state.quiet = now
+            if state.target and state.quiet is not None and now - state.quiet >= self.quiet:
+                self._apply(chan, state, now)
+
+    def _run(self):
+        """ tuner thread: samples each period """
+        while self._running:
+            self.step()
+            self._wake.wait(self.period)
+
+    def start(self):
+        """ Start tuner thread
+        :return: ucanBufferTuner object """
+        if not self._running:
+            self._running = True
+            self._wake.clear()
+            self._thread = threading.Thread(target=self._run, name="ucanBufferTuner")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ Stop tuner thread
+        :param timeout: time in s to wait for thread to end """
+        if self._running:
+            self._running = False
+            self._wake.set()
+            self._thread.join(timeout)
@@ -0,0 +1,157 @@
+# -*- coding:utf-8 -*-
+"""
+ucanWatchdog.py (ucanSystec)
+Author: SMFSW
+
+SystecUSBCAN status watchdog (keeps status channel polled, publishes status transitions, BUSOFF recovery)
+"""
+
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from .ucanSystec import statusSystec, statusSystecNames, resetSystec, eventSystec
+
+__all__ = ['ucanStatusEvent', 'ucanWatchdog']
+
+logger = logging.getLogger(__name__)
+
+_clock = getattr(time, "monotonic", time.time)
+
+# status transition: name is a statusSystec name (set when active is True, cleared otherwise)
+# or "USBCAN_RESET" for a BUSOFF recovery attempt (active is the can_reset return code)
+ucanStatusEvent = namedtuple('ucanStatusEvent', ['chan', 'name', 'active', 'status', 'tx_err', 'rx_err', 'time'])
+
+_WATCHED = (statusSystec["USBCAN_CANERR_BUSLIGHT"] | statusSystec["USBCAN_CANERR_BUSHEAVY"] |
+            statusSystec["USBCAN_CANERR_BUSOFF"] | statusSystec["USBCAN_CANERR_QOVERRUN"])
+
+_BUSOFF = statusSystec["USBCAN_CANERR_BUSOFF"]
+
+
+# noinspection PyPep8Naming
+class ucanWatchdog(object):
+    """ Status watchdog thread: polls status and error counters of initialized channels (module resets itself when
+    status channel is not polled each second), status events from the dll trigger an immediate poll.
+    Only control dll calls are used (never contends with reception and transmission calls). """
+    def __init__(self, bus, period=0.5, watched=_WATCHED, recover=False, backoff=(0.1, 5.0),
+                 reset_flags=resetSystec["USBCAN_RESET_ONLY_STATUS"] & resetSystec["USBCAN_RESET_ONLY_CANCTRL"],
+                 on_event=None):
+        """ watchdog init
+        :param bus: ucanSystec instance
+        :param period: time in s between two polls (shall stay below 1s)
+        :param watched: statusSystec bits published on transitions
+        :param recover: reset channel (can_reset) when in BUSOFF state
+        :param backoff: (first, max) time in s between two recovery attempts (doubled at each attempt)
+        :param reset_flags: can_reset flags used for recovery (CAN controller and status reset by default)
+        :param on_event: function called with each ucanStatusEvent (from watchdog thread) """
+        self.bus = bus
+        self.period = min(period, 1.0)
+        self.watched = watched
+        self.recover = recover
+        self.backoff = backoff
+        self.reset_flags = reset_flags
+        self.polls = 0
+        self.resets = 0
+        self.last = {}          # channel: last status read
+        self._event_cb = [on_event] if on_event else []
+        self._retry = {}        # channel: (attempts, next attempt time)
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def subscribe(self, on_event):
+        """ Add a consumer of status transitions
+        :param on_event: function called with each ucanStatusEvent (from watchdog thread) """
+        self._event_cb = self._event_cb + [on_event]
+
+    def _on_event(self, event, chan):
+        """ dll events listener: status changes polled right away """
+        if event == eventSystec["USBCAN_EVENT_STATUS"]:
+            self._wake.set()
+
+    def _publish(self, event):
+        """ hand event to consumers (a failing consumer never stops the watchdog) """
+        for fct in self._event_cb:
+            try:
+                fct(event)
+            except Exception:
+                logger.exception("Status event consumer %r failed.", fct)
+
+    def poll(self, chan=0):
+        """ Poll channel status and error counters, publish transitions (done by watchdog thread)
+        :param chan: module channel
+        :return: status read (None if it could not be read) """
+        bus = self.bus
+        if bus.can_get_status(chan) == -1 or bus._ucanret:
+            return None     # dll failure (already logged): status kept, polled again next period
+        status = bus.status.m_wCanStatus
+        bus.can_get_err_cnt(chan)
+        tx_err, rx_err = bus.tx_err_cnt.value, bus.rx_err_cnt.value
+        self.polls += 1
+        now = _clock()
+        changed = (status ^ self.last.get(chan, 0)) & self.watched
+        self.last[chan] = status
+        bit = 1
+        while changed >= bit:
+            if changed & bit:
+                self._publish(ucanStatusEvent(chan, statusSystecNames.get(bit, hex(bit)), bool(status & bit),
+                                              status, tx_err, rx_err, now))
+            bit <<= 1
+        if self.recover:
+            self._recover(chan, status, tx_err, rx_err, now)
+        return status
+
+    def _recover(self, chan, status, tx_err, rx_err, now):
+        """ BUSOFF recovery with exponential backoff between attempts """
+        if not status & _BUSOFF:
+            self._retry.pop(chan, None)
+            return
+        attempts, next_try = self._retry.get(chan, (0, now))
+        if now < next_try:
+            return
+        ret = self.bus.can_reset(chan, self.reset_flags)
+        self.resets += 1
+        self._retry[chan] = (attempts + 1, now + min(self.backoff[0] * (2 ** attempts), self.backoff[1]))
+        logger.warning("Channel %d in BUSOFF state, reset attempt %d (%#x).", chan, attempts + 1, ret)
+        self._publish(ucanStatusEvent(chan, "USBCAN_RESET", ret, status, tx_err, rx_err, now))
+        self._wake.set()    # poll reset outcome right away
+
+    def _run(self):
+        """ watchdog thread: polls each period, or right away on dll status events """
+        while self._running:
+            for chan in sorted(self.bus.chan_init):
+                try:
+                    self.poll(chan)
+                except Exception:
+                    logger.exception("Channel %d status poll failed.", chan)
+            self._wake.wait(self._next_timeout())
+            self._wake.clear()
+
+    def _next_timeout(self):
+        """ :return: time in s until next poll (shortened when a recovery attempt is due before) """
+        timeout = self.period
+        if self._retry:
+            now = _clock()
+            timeout = min([timeout] + [max(next_try - now, 0.0) for _, next_try in self._retry.values()])
+        return timeout
+
+    def start(self):
+        """ Start watchdog thread
+        :return: ucanWatchdog object """
+        if not self._running:
+            self._running = True
+            self.bus.add_event_listener(self._on_event)
+            self._thread = threading.Thread(target=self._run, name="ucanWatchdog")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ Stop watchdog thread
+        :param timeout: time in s to wait for thread to end """
+        if self._running:
+            self._running = False
+            self.bus.remove_event_listener(self._on_event)
+            self._wake.set()
+            self._thread.join(timeout)